@@ -1,7 +1,16 @@
-from flask import Blueprint, request, jsonify, render_template, redirect, url_for, session, flash
+import base64
+import json
+import threading
+import time
+from datetime import datetime
+from flask import Blueprint, request, jsonify, render_template, redirect, url_for, session, flash, Response, send_file
+from sqlalchemy import and_, func, select, tuple_
 from werkzeug.security import generate_password_hash
-from models import User, Log, db
+from config import Config
+from models import User, db
 from utils import add_log, admin_required
+from metrics import render_prometheus
+import shards
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -44,39 +53,120 @@ def api_create_user():
     user = User(username=username, password_hash=generate_password_hash(password), role=role)
     db.session.add(user)
     db.session.commit()
+    _forget_user_count(role)
     add_log(None, session.get('admin_username'), 'admin', 'create_user', {"new_user": username, "role": role})
     return jsonify({"ok":True, "user": {"id": user.id, "username": user.username, "role": user.role}})
 
+# ===== User directory =====
+# Pages are keyset-paginated: newest first on (created_at, id), or, when a
+# username prefix `q` is given, alphabetically on (lower(username), id). Both
+# orders are served by indexes on users (see models.py), so a page costs the
+# same at any depth and any table size. The opaque `cursor` returned with a
+# page is passed back to fetch the next one. `count=1` adds the role's total
+# from a per-process cached counter (or a capped match count for searches).
+
+_user_counts = {}  # role -> (count, fetched_at)
+_user_counts_lock = threading.Lock()
+SEARCH_COUNT_CAP = 10000
+
+def _role_count(role):
+    now = time.monotonic()
+    with _user_counts_lock:
+        hit = _user_counts.get(role)
+    if hit and now - hit[1] < Config.USER_COUNT_TTL:
+        return hit[0]
+    n = db.session.query(func.count(User.id)).filter(User.role == role).scalar()
+    with _user_counts_lock:
+        _user_counts[role] = (n, now)
+    return n
+
+def _forget_user_count(role):
+    with _user_counts_lock:
+        _user_counts.pop(role, None)
+
+def _encode_cursor(mode, value, uid):
+    raw = json.dumps([mode, value, uid], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _decode_cursor(token):
+    try:
+        mode, value, uid = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if mode == 'created':
+            value = datetime.fromisoformat(value)
+        elif mode != 'name':
+            raise ValueError(mode)
+        return mode, value, int(uid)
+    except Exception:
+        return None
+
+def _list_users(role, key):
+    limit = max(1, min(request.args.get('limit', default=Config.USER_PAGE_SIZE, type=int), Config.USER_PAGE_MAX))
+    prefix = (request.args.get('q') or '').strip().lower()
+    mode = 'name' if prefix else 'created'
+    token = request.args.get('cursor')
+    cursor = None
+    if token:
+        cursor = _decode_cursor(token)
+        if cursor is None or cursor[0] != mode:
+            return jsonify({'ok': False, 'msg': 'bad_cursor'}), 400
+
+    lname = func.lower(User.username)
+    q = db.session.query(User.id, User.username, User.created_at).filter(User.role == role)
+    if prefix:
+        # range scan on the lower(username) index: prefix <= name < prefix with its last char bumped
+        match = and_(lname >= prefix, lname < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        q = q.filter(match)
+        if cursor:
+            q = q.filter(tuple_(lname, User.id) > tuple_(cursor[1], cursor[2]))
+        q = q.order_by(lname.asc(), User.id.asc())
+    else:
+        if cursor:
+            # row-value comparison; the OR-expanded form makes SQLite scan from the top of the index
+            q = q.filter(tuple_(User.created_at, User.id) < tuple_(cursor[1], cursor[2]))
+        q = q.order_by(User.created_at.desc(), User.id.desc())
+    rows = q.limit(limit + 1).all()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    out = [{"id": r.id, "username": r.username, "created_at": r.created_at.isoformat()} for r in rows]
+    next_cursor = None
+    if more:
+        last = rows[-1]
+        next_cursor = _encode_cursor(mode, last.username.lower() if prefix else last.created_at.isoformat(), last.id)
+    resp = {"ok": True, key: out, "next_cursor": next_cursor}
+    if request.args.get('count') in ('1', 'true', 'yes'):
+        if prefix:
+            capped = select(User.id).where(User.role == role, match).limit(SEARCH_COUNT_CAP + 1).subquery()
+            n = db.session.execute(select(func.count()).select_from(capped)).scalar()
+            resp["total"] = min(n, SEARCH_COUNT_CAP)
+            resp["total_capped"] = n > SEARCH_COUNT_CAP
+        else:
+            resp["total"] = _role_count(role)
+    if not token:
+        # one log row per directory visit, not per page
+        add_log(None, session.get('admin_username'), 'admin', f'list_{key}', {"count": len(out), "q": prefix or None})
+    return jsonify(resp)
+
 @admin_bp.route('/api/admin/students', methods=['GET'])
 @admin_required
 def api_list_students():
-    users = User.query.filter_by(role='student').order_by(User.created_at.desc()).all()
-    out = [{"id":u.id, "username":u.username, "created_at":u.created_at.isoformat()} for u in users]
-    add_log(None, session.get('admin_username'), 'admin', 'list_students', {"count": len(out)})
-    return jsonify({"ok":True, "students": out})
+    return _list_users('student', 'students')
 
 @admin_bp.route('/api/admin/teachers', methods=['GET'])
 @admin_required
 def api_list_teachers():
-    users = User.query.filter_by(role='teacher').order_by(User.created_at.desc()).all()
-    out = [{"id":u.id, "username":u.username, "created_at":u.created_at.isoformat()} for u in users]
-    add_log(None, session.get('admin_username'), 'admin', 'list_teachers', {"count": len(out)})
-    return jsonify({"ok":True, "teachers": out})
+    return _list_users('teacher', 'teachers')
 
 @admin_bp.route('/api/admin/logs', methods=['GET'])
 @admin_required
 def api_view_logs():
-    q = Log.query
     etype = request.args.get('event_type')
     uid = request.args.get('user_id', type=int)
     cheating_only = request.args.get('cheating_only')
-    if etype:
-        q = q.filter_by(event_type=etype)
-    if uid:
-        q = q.filter_by(who_user_id=uid)
     if cheating_only and str(cheating_only).lower() in ('1','true','yes'):
-        q = q.filter_by(event_type='cheating_detected')
-    logs = q.order_by(Log.created_at.desc()).limit(2000).all()
+        etype = 'cheating_detected'
+    # main database plus every exam shard, newest first
+    logs = shards.recent_logs(2000, etype, uid)
     out = []
     for l in logs:
         out.append({
@@ -86,7 +176,125 @@ def api_view_logs():
             "role": l.role,
             "event_type": l.event_type,
             "meta": l.meta,
-            "created_at": l.created_at.isoformat()
+            "created_at": l.created_at.isoformat(),
+            "shard": l.shard
         })
     add_log(None, session.get('admin_username'), 'admin', 'view_logs', {"count": len(out), "filter_event": etype, "cheating_only": bool(cheating_only)})
     return jsonify({"ok":True, "logs": out})
+
+@admin_bp.route('/api/admin/logs/search', methods=['GET'])
+@admin_required
+def api_search_logs():
+    """Ranked full-text search over log username, event_type and meta values (log_search.py).
+
+    q: terms (all must match); `term*` prefix, "a phrase", `event_type:x`.
+    sort=rank (default, page/limit) or sort=recent (keyset: pass `before`
+    from the previous response's next_before; before_id still works without
+    sharding). Exam shards are searched too (shards.search_logs).
+    """
+    from log_search import BadQuery, MAX_RANKED_RESULTS, SearchUnavailable
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        return jsonify({"ok": False, "msg": "missing_q"}), 400
+    limit = max(1, min(request.args.get('limit', default=50, type=int), 200))
+    page = max(1, request.args.get('page', default=1, type=int))
+    sort = 'recent' if request.args.get('sort') == 'recent' else 'rank'
+    try:
+        before = shards.decode_cursor(request.args.get('before'))
+    except ValueError:
+        return jsonify({"ok": False, "msg": "bad_cursor"}), 400
+    before_id = request.args.get('before_id', type=int)
+    if before_id and not before:
+        before = {None: before_id}
+    offset = (page - 1) * limit
+    if sort == 'rank' and offset + limit > MAX_RANKED_RESULTS:
+        return jsonify({"ok": False, "msg": "page_too_deep", "max_results": MAX_RANKED_RESULTS}), 400
+    try:
+        hits, next_before = shards.search_logs(q, limit=limit, offset=offset, sort=sort, before=before,
+                                               raw=request.args.get('syntax') == 'fts')
+    except SearchUnavailable:
+        return jsonify({"ok": False, "msg": "search_unavailable"}), 501
+    except BadQuery as e:
+        return jsonify({"ok": False, "msg": "bad_query", "error": str(e)}), 400
+    out = []
+    for l, score in hits:
+        out.append({
+            "id": l.id,
+            "who_user_id": l.who_user_id,
+            "username": l.username,
+            "role": l.role,
+            "event_type": l.event_type,
+            "meta": l.meta,
+            "created_at": l.created_at.isoformat() if l.created_at else None,
+            "score": None if score is None else round(-score, 4),
+            "shard": l.shard
+        })
+    resp = {"ok": True, "logs": out, "sort": sort}
+    if sort == 'rank':
+        resp["page"] = page
+        resp["has_more"] = len(hits) == limit and offset + limit < MAX_RANKED_RESULTS
+    else:
+        resp["next_before"] = shards.encode_cursor(next_before) if next_before else None
+        if not shards.enabled():
+            resp["next_before_id"] = next_before.get(None) if next_before else None
+    if page == 1 and not before:
+        add_log(None, session.get('admin_username'), 'admin', 'search_logs', {"q": q, "count": len(out)})
+    return jsonify(resp)
+
+@admin_bp.route('/api/admin/gradebook', methods=['GET'])
+@admin_required
+def api_admin_gradebook():
+    """Streamed gradebook export across any exams (see gradebook.export_from_request)."""
+    import gradebook
+    resp, meta = gradebook.export_from_request()
+    if isinstance(meta, int):
+        return resp, meta
+    add_log(None, session.get('admin_username'), 'admin', 'download_gradebook', meta)
+    return resp
+
+# ===== Online backups (see backup.py) =====
+@admin_bp.route('/api/admin/backups', methods=['GET'])
+@admin_required
+def api_list_backups():
+    import backup
+    return jsonify({'ok': True, 'backups': backup.list_snapshots(Config.BACKUP_DIR), 'keep': Config.BACKUP_KEEP,
+                    'interval_hours': Config.BACKUP_INTERVAL_HOURS})
+
+@admin_bp.route('/api/admin/backups', methods=['POST'])
+@admin_required
+def api_create_backup():
+    """Take a snapshot now: queued as a `backup` job, or inline when no process runs the job runner."""
+    import backup
+    from job_routes import job_handle, jobs_available, submit_job
+    d = request.get_json(silent=True) or request.form
+    verify = d.get('verify', 'full')
+    if verify not in ('full', 'quick', 'none'):
+        return jsonify({'ok': False, 'msg': 'bad_verify'}), 400
+    if jobs_available():
+        return job_handle(submit_job('backup', {'verify': verify}))
+    try:
+        manifest = backup.snapshot_now(verify)
+    except backup.BackupFailed as e:
+        return jsonify({'ok': False, 'msg': 'backup_failed', 'error': str(e)}), 500
+    add_log(None, session.get('admin_username'), 'admin', 'backup_created',
+            {'name': manifest['name'], 'bytes': manifest['bytes'], 'seconds': manifest['seconds']})
+    return jsonify({'ok': True, 'backup': manifest})
+
+@admin_bp.route('/api/admin/backups/<name>/download', methods=['GET'])
+@admin_required
+def api_download_backup(name):
+    """One database file of a snapshot (?file=main.sqlite by default, or shards/exam_<id>.sqlite)."""
+    import backup
+    rel = request.args.get('file', 'main.sqlite')
+    path = backup.snapshot_file(Config.BACKUP_DIR, name, rel)
+    if path is None:
+        return jsonify({'ok': False, 'msg': 'backup_not_found'}), 404
+    add_log(None, session.get('admin_username'), 'admin', 'download_backup', {'name': name, 'file': rel})
+    return send_file(path, mimetype='application/vnd.sqlite3', as_attachment=True,
+                     download_name=f'{name}_{rel.replace("/", "_")}')
+
+@admin_bp.route('/api/admin/metrics', methods=['GET'])
+@admin_required
+def api_metrics():
+    """Per-endpoint latency and SQL histograms in Prometheus text format."""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
@@ -1,59 +1,327 @@
-from flask import Flask, render_template
+import os
+import weakref
+import zlib
+import click
+from flask import Flask, render_template, current_app
 from flask import jsonify
+from flask.cli import with_appcontext
 from config import Config
 from models import db
 from admin_routes import admin_bp
 from student_routes import student_bp
 from teacher_routes import teacher_bp
-import threading
+from job_routes import jobs_bp
+from metrics import init_metrics
 
-def start_xmlrpc_server():
-    # Lightweight in-process XML-RPC server to demonstrate RPC
+# ===== Application factory =====
+# create_app builds the app and checks the schema; it starts nothing by itself
+# beyond what `services` (default APP_SERVICES) asks for. Side services are
+# owned per process and started by start_services:
+#   rpc        XML-RPC server and its log flusher (binds RPC_HOST:RPC_PORT)
+#   scheduler  exam pre-warm/finalize loop (one leader across processes)
+#   jobs       background job runner
+# APP_SERVICES defaults to none, so importing the module (web workers,
+# benchmarks, `python -m jobs`) starts none of them, only the prewarm-only
+# scheduler loop that keeps this process's exam cache warm for students
+# (SCHEDULER_ENABLED; replaced by the full scheduler if this process later
+# starts it). `python app.py` owns all of
+# them. With several web workers, one `flask --app app run-services` process
+# owns them, or every worker sets APP_SERVICES=all (the RPC port goes to the
+# first one; the scheduler elects a leader; runners share the job table).
+# start_services can also be called from a post-fork hook when the app is
+# preloaded in a parent process.
+
+SERVICES = ('rpc', 'scheduler', 'jobs')
+_EXTENSION = {'rpc': 'rpc_service', 'scheduler': 'exam_scheduler', 'jobs': 'job_runner', 'prewarm': 'exam_scheduler'}
+_apps = weakref.WeakSet()  # apps built in this process (reset in a forked child)
+
+def parse_services(spec):
+    """'rpc,jobs', 'all' or 'none' (or a list of names) -> tuple of service names."""
+    if isinstance(spec, str):
+        spec = spec.split(',')
+    names = {s.strip().lower() for s in spec} - {'', 'none'}
+    if 'all' in names:
+        return SERVICES
+    unknown = names - set(SERVICES)
+    if unknown:
+        raise ValueError(f'unknown services {sorted(unknown)}; expected {", ".join(SERVICES)}, all or none')
+    return tuple(s for s in SERVICES if s in names)
+
+def start_xmlrpc_server(app, config=Config):
+    # In-process threaded XML-RPC server (multicall enabled); events are kept in a
+    # bounded ring buffer and flushed to the logs table periodically.
     try:
-        from xmlrpc.server import SimpleXMLRPCServer
+        from rpc_service import RPCService
     except Exception:
-        return
-    events = []
-    def ping():
-        return 'pong'
-    def record_event(ev: dict):
-        try:
-            events.append(ev)
-            return True
-        except Exception:
-            return False
-    server = SimpleXMLRPCServer(('127.0.0.1', 9000), allow_none=True, logRequests=False)
-    server.register_function(ping, 'ping')
-    server.register_function(record_event, 'record_event')
-    th = threading.Thread(target=server.serve_forever, daemon=True)
-    th.start()
-
-# Initialize Flask app
-app = Flask(__name__)
-app.secret_key = Config.SECRET_KEY
-app.config['SQLALCHEMY_DATABASE_URI'] = Config.get_database_uri()
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = Config.SQLALCHEMY_TRACK_MODIFICATIONS
-
-# Initialize database
-db.init_app(app)
-
-# Register blueprints
-app.register_blueprint(admin_bp)
-app.register_blueprint(student_bp)
-app.register_blueprint(teacher_bp)
+        return None
+    try:
+        service = RPCService(
+            host=config.RPC_HOST,
+            port=config.RPC_PORT,
+            buffer_size=config.RPC_EVENT_BUFFER_SIZE,
+            flush_interval=config.RPC_FLUSH_INTERVAL,
+            app=app,
+        ).start()
+    except OSError as e:
+        # Another process (usually an earlier worker) owns the port; the RPC
+        # client pool in this one talks to that server.
+        app.logger.info('RPC server not started here: %s:%s is taken (%s)', config.RPC_HOST, config.RPC_PORT,
+                        e.strerror or e)
+        return None
+    app.extensions['rpc_service'] = service
+    return service
+
+def start_exam_scheduler(app, config=Config, finalize=True):
+    # Pre-warms exams before start and finalizes them at close; one leader
+    # across processes runs the finalize jobs. finalize=False is the light
+    # prewarm-only loop start_services gives a process that does not own the
+    # scheduler, so its own exam cache is warm at start_at too.
+    if not config.SCHEDULER_ENABLED:
+        return None
+    prewarmer = app.extensions.get('services', {}).pop('prewarm', None)
+    if prewarmer is not None:
+        prewarmer.stop()  # the full scheduler takes over its prewarm jobs
+    from scheduler import ExamScheduler
+    sched = ExamScheduler(
+        app,
+        prewarm_seconds=config.SCHEDULER_PREWARM_SECONDS,
+        lease_seconds=config.SCHEDULER_LEASE_SECONDS,
+        resync_seconds=config.SCHEDULER_RESYNC_SECONDS,
+        catchup_hours=config.SCHEDULER_CATCHUP_HOURS,
+        absent_marks=config.EXAM_ABSENT_MARKS,
+        finalize=finalize,
+    ).start()
+    app.extensions['exam_scheduler'] = sched
+    return sched
+
+def configure_sqlite(app, config=Config):
+    # Put a file-based SQLite main database in WAL, as ShardRouter does for the
+    # shards: a backup's read transaction then no longer blocks writers.
+    from sqlalchemy import event
+    url = db.engine.url
+    if not config.SQLITE_WAL or url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return False
+
+    @event.listens_for(db.engine, 'connect')
+    def _setup(dbapi_conn, _):
+        cur = dbapi_conn.cursor()
+        cur.execute('PRAGMA synchronous=NORMAL')
+        cur.close()
+    from sqlalchemy.exc import OperationalError
+    try:
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA journal_mode=WAL')  # persistent: stored in the file
+    except OperationalError:
+        # switching needs a moment without other connections; a later boot retries
+        app.logger.warning('could not switch the database to WAL; it stays in its current journal mode')
+        return False
+    return True
+
+def configure_shards(app, config=Config):
+    # Route marks, attempts and exam logs to per-exam SQLite files when enabled.
+    import shards
+    if not config.SHARDING_ENABLED:
+        return None
+    if db.engine.url.get_backend_name() != 'sqlite':
+        app.logger.warning('SHARDING_ENABLED is set but the database is not SQLite; sharding stays off')
+        return None
+    router = shards.configure(True, config.SHARD_DIR, str(db.engine.url), config.SHARD_MAX_OPEN)
+    app.extensions['shard_router'] = router
+    return router
+
+def start_job_runner(app, config=Config):
+    # Runs queued background jobs (exports, scans) on a thread or process pool.
+    if not config.JOBS_ENABLED:
+        return None
+    from jobs import JobRunner
+    runner = JobRunner(
+        app,
+        workers=config.JOB_WORKERS,
+        mode=config.JOB_WORKER_MODE,
+        poll_seconds=config.JOB_POLL_SECONDS,
+        artifact_dir=config.JOB_ARTIFACT_DIR,
+        artifact_ttl=config.JOB_ARTIFACT_TTL,
+        stale_seconds=config.JOB_STALE_SECONDS,
+        backup_seconds=config.BACKUP_INTERVAL_HOURS * 3600,
+    ).start()
+    app.extensions['job_runner'] = runner
+    return runner
+
+_STARTERS = {'rpc': start_xmlrpc_server, 'scheduler': start_exam_scheduler, 'jobs': start_job_runner}
+
+def start_services(app, services=None):
+    """Start the side services this process owns (default APP_SERVICES); returns the names running.
+
+    Services already started in this process are left alone, so calling it
+    again (e.g. from a post-fork hook) is safe. A process that does not own
+    the scheduler still gets its prewarm-only loop ('prewarm').
+    """
+    config = app.extensions['app_config']
+    tried = app.extensions.setdefault('services', {})
+    with app.app_context():
+        for name in parse_services(config.APP_SERVICES if services is None else services):
+            if name not in tried:
+                tried[name] = _STARTERS[name](app, config)
+        if 'scheduler' not in tried and 'prewarm' not in tried:
+            tried['prewarm'] = start_exam_scheduler(app, config, finalize=False)
+    return [name for name, svc in tried.items() if svc is not None]
+
+def stop_services(app):
+    """Stop this process's side services (flushes RPC events, releases the scheduler lease)."""
+    for name, svc in app.extensions.pop('services', {}).items():
+        app.extensions.pop(_EXTENSION[name], None)
+        if svc is not None:
+            svc.stop()
+
+def _after_fork():
+    # A forked child inherits the parent's pooled connections and service
+    # objects but none of its threads: forget both, so the child opens its own
+    # connections and start_services starts fresh threads there. The same goes
+    # for the lazily built singletons (RPC client pool, replicated store) and
+    # the monitor subscribers, whose readers live in the parent.
+    import threading
+    import uuid
+    import jobs
+    import rpc_service
+    import shards
+    import utils
+    for app in list(_apps):
+        app.extensions['services'] = {}
+        for key in _EXTENSION.values():
+            app.extensions.pop(key, None)
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+    if shards.router() is not None:
+        shards.router().close(close=False)
+    jobs._runner = None
+    rpc_service._client_pool, rpc_service._client_pool_lock = None, threading.Lock()
+    utils._kv_store, utils._kv_lock = None, threading.Lock()
+    utils._subscribers, utils._subs_lock = [], threading.Lock()
+    utils._relay_origin = f'{os.getpid()}:{uuid.uuid4().hex[:8]}'
+    utils._relay_thread, utils._relay_lock = None, threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+def create_app(config=None, services=None):
+    """Build the Flask app.
+
+    config is a Config class (or subclass) and defaults to Config. services
+    overrides config.APP_SERVICES for this call; pass 'none' to start
+    nothing yet and call start_services later.
+    """
+    config = config or Config
+    app = Flask(__name__)
+    app.secret_key = config.SECRET_KEY
+    app.config['SQLALCHEMY_DATABASE_URI'] = config.get_database_uri()
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = config.SQLALCHEMY_TRACK_MODIFICATIONS
+    app.config['SLOW_REQUEST_MS'] = config.SLOW_REQUEST_MS
+    app.extensions['app_config'] = config
+    # routes queue jobs when this process runs the job runner, or when
+    # APP_SERVICES hands the runner to another process
+    app.extensions['jobs_elsewhere'] = config.JOBS_ENABLED and 'jobs' not in parse_services(config.APP_SERVICES)
+
+    # Initialize database
+    db.init_app(app)
+
+    # Register blueprints
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(student_bp)
+    app.register_blueprint(teacher_bp)
+    app.register_blueprint(jobs_bp)
+
+    # Per-request latency / SQL instrumentation (exposed at /api/admin/metrics)
+    init_metrics(app)
+
+    for command in (init_db, run_services, rebuild_log_search, migrate_to_shards):
+        app.cli.add_command(command)
+
+    # Main route
+    @app.route('/')
+    def home():
+        return render_template('index.html')
+
+    # Server time endpoint (UTC)
+    @app.route('/api/server_time')
+    def server_time():
+        from datetime import datetime, timezone
+        now = datetime.now(timezone.utc)
+        return jsonify({'ok': True, 'server_time_utc': now.isoformat()})
+
+    import exam_cache
+    exam_cache.configure(config.EXAM_CACHE_TTL)
+    with app.app_context():
+        configure_sqlite(app, config)
+        if config.DB_INIT_ON_START:
+            init_database(app)
+        configure_shards(app, config)
+    _apps.add(app)
+    start_services(app, services)
+    return app
 
 # Database initialization and migration
-def init_database():
-    """Initialize database and handle migrations"""
+def schema_fingerprint():
+    """Checksum of the tables, columns and indexes the models declare (plus the log search DDL)."""
+    from log_search import _DDL
+    parts = list(_DDL)
+    for table in db.metadata.sorted_tables:
+        parts.append(table.name + ':' + ','.join(f'{c.name} {c.type} {c.nullable}' for c in table.columns))
+        parts += sorted(f'{i.name}({",".join(c.name for c in i.columns)})' for i in table.indexes)
+    return zlib.crc32('\n'.join(parts).encode()) & 0x7fffffff or 1
+
+def init_database(app, force=False):
+    """Initialize database and handle migrations.
+
+    On SQLite the schema fingerprint is kept in PRAGMA user_version once
+    everything below has succeeded, so later boots against an up-to-date file
+    skip the DDL probing (force=True runs it anyway). Returns True when the
+    checks ran.
+    """
+    from sqlalchemy import text
+    sqlite = app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+    fingerprint = schema_fingerprint()
+    if sqlite and not force:
+        with db.engine.connect() as conn:
+            if conn.execute(text('PRAGMA user_version')).scalar() == fingerprint:
+                return False
+    ok = True
     db.create_all()
-    
+    # create_all skips indexes on tables that already exist; add any that are missing
+    from sqlalchemy.schema import CreateIndex
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+            except Exception:
+                ok = False
+                app.logger.warning('could not create index %s', index.name)
+    # Full-text search index over logs (SQLite FTS5; see log_search.py)
+    try:
+        from log_search import ensure_index
+        ensure_index(db.engine, app.logger)
+    except Exception:
+        ok = False
+        app.logger.exception('could not set up the log search index')
+
+    # users.created_at was nullable in older databases; the admin directory keysets on
+    # (created_at, id), so give legacy rows the oldest known time (they keep sorting last)
+    try:
+        db.session.execute(text("UPDATE users SET created_at = COALESCE((SELECT MIN(created_at) FROM users), "
+                                "CURRENT_TIMESTAMP) WHERE created_at IS NULL"))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        ok = False
+        app.logger.exception('could not backfill users.created_at')
+
     # Lightweight runtime migration for SQLite: add columns that may be missing
     # This helps existing local DBs created before fields were added.
     # Only run for SQLite to avoid accidental DDL on other DBs.
     try:
-        if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        if sqlite:
             # Inspect current columns in exams
-            from sqlalchemy import text
             res = db.session.execute(text("PRAGMA table_info('exams');")).fetchall()
             cols = {r[1] for r in res}  # r[1] is column name
             # Add is_published column if missing
@@ -64,6 +332,9 @@ def init_database():
             if 'num_questions' not in cols:
                 db.session.execute(text("ALTER TABLE exams ADD COLUMN num_questions INTEGER;"))
                 db.session.commit()
+            if 'updated_at' not in cols:
+                db.session.execute(text("ALTER TABLE exams ADD COLUMN updated_at DATETIME;"))
+                db.session.commit()
             # Inspect current columns in questions and add any missing ones
             try:
                 resq = db.session.execute(text("PRAGMA table_info('questions');")).fetchall()
@@ -97,29 +368,78 @@ def init_database():
                     db.session.commit()
             except Exception:
                 # don't let questions migration break app start
-                pass
+                ok = False
     except Exception:
         # If migration fails, don't crash the app here; logs will show the problem.
+        ok = False
+    if sqlite and ok:
+        db.session.execute(text(f'PRAGMA user_version = {fingerprint}'))
+        db.session.commit()
+    return True
+
+# CLI: flask --app app init-db
+@click.command('init-db')
+@with_appcontext
+def init_db():
+    """Create missing tables and indexes and run the SQLite column migrations."""
+    init_database(current_app, force=True)
+    click.echo('database schema is up to date')
+
+# CLI: APP_SERVICES=none gunicorn ... plus one `flask --app app run-services`
+@click.command('run-services')
+@click.option('--services', default='all', show_default=True, help='comma-separated: rpc, scheduler, jobs')
+@with_appcontext
+def run_services(services):
+    """Run the side services in the foreground until interrupted."""
+    import signal
+    import threading
+    app = current_app._get_current_object()
+    running = start_services(app, services)
+    click.echo('running: ' + (', '.join(running) or 'nothing'))
+    done = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: done.set())
+    try:
+        while not done.wait(3600):
+            pass
+    except KeyboardInterrupt:
         pass
+    finally:
+        stop_services(app)
+
+# CLI: flask --app app rebuild-log-search
+@click.command('rebuild-log-search')
+@click.option('--batch-size', default=100000, show_default=True, help='log rows indexed per transaction')
+@with_appcontext
+def rebuild_log_search(batch_size):
+    """Re-index every log row for full-text search (the main database and each exam shard)."""
+    import shards
+    from log_search import rebuild
+    def progress(done, scanned, total):
+        click.echo(f'\r  {scanned:,}/{total:,} ids scanned, {done:,} rows indexed', nl=False)
+    n = rebuild(db.engine, batch_size=batch_size, progress=progress)
+    click.echo(f'\nindexed {n:,} log rows')
+    if shards.enabled():
+        for eid in shards.router().exam_ids():
+            n = rebuild(shards.router().engine(eid), batch_size=batch_size)
+            click.echo(f'  exam {eid}: indexed {n:,} log rows')
+
+# CLI: SHARDING_ENABLED=1 flask --app app migrate-to-shards
+@click.command('migrate-to-shards')
+@click.option('--batch-size', default=5000, show_default=True, help='log rows copied per statement')
+@with_appcontext
+def migrate_to_shards(batch_size):
+    """Move marks, attempts and exam logs from the main database into per-exam shards."""
+    import shards
+    if not shards.enabled():
+        raise click.ClickException('set SHARDING_ENABLED=1 (SQLite only) first')
+    moved = shards.migrate_to_shards(batch_size=batch_size,
+                                     progress=lambda eid, n: click.echo(f'  exam {eid}: {n:,} rows'))
+    click.echo(f'moved {sum(moved.values()):,} rows into {len(moved)} shards')
+
+# Module-level app for `flask --app app`, `python app.py` and `from app import app`
+app = create_app()
 
-# Initialize database with app context
-with app.app_context():
-    init_database()
-    # Start RPC server thread
-    start_xmlrpc_server()
-
-# Main route
-@app.route('/')
-def home():
-    return render_template('index.html')
-
-# Server time endpoint (UTC)
-@app.route('/api/server_time')
-def server_time():
-    from datetime import datetime, timezone
-    now = datetime.now(timezone.utc)
-    return jsonify({'ok': True, 'server_time_utc': now.isoformat()})
-
-# Run the application
+# Run the application (a single process owns every side service unless APP_SERVICES says otherwise)
 if __name__ == '__main__':
+    start_services(app, os.getenv('APP_SERVICES') or 'all')
     app.run(debug=True)
@@ -0,0 +1,200 @@
+import json
+import os
+import re
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+# ===== Online backup =====
+# Snapshots are taken with SQLite's backup API while the app keeps serving.
+# The copy advances step_pages pages at a time and sleeps between steps; the
+# source is only read-locked during a step, so submit_exam/add_log writers wait
+# at most one step. SQLite restarts an incremental backup whenever another
+# connection writes to the source, so a file that keeps changing is finished
+# with one full-length step after max_restarts restarts. The main database
+# (app.configure_sqlite) and the exam shards run in WAL, where that step only
+# holds a read transaction and writers carry on; on a rollback-journal file
+# it would block them for the whole copy.
+#
+# A snapshot is a directory BACKUP_DIR/snapshot_<utc time>/ holding
+# main.sqlite, shards/exam_<id>.sqlite when sharding is on, and manifest.json.
+# It is built under a .partial name and renamed once every file has passed
+# the integrity check, so a listed snapshot is always complete.
+
+SNAPSHOT = re.compile(r'^snapshot_\d{8}T\d{12}Z$')
+MANIFEST = 'manifest.json'
+
+class BackupFailed(Exception):
+    pass
+
+class _Restarting(Exception):
+    pass
+
+def page_count(path):
+    con = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return con.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        con.close()
+
+def copy_database(src_path, dest_path, step_pages=256, sleep=0.01, max_restarts=3, progress=None, busy_timeout=30):
+    """Copy a live SQLite file to dest_path; returns stats for the manifest.
+
+    progress, if given, is called with the number of pages copied since the
+    last call (it may raise to abort the copy).
+    """
+    stats = {'steps': 0, 'restarts': 0, 'single_pass': step_pages <= 0}
+    last = [None]
+
+    def on_step(status, remaining, total):
+        stats['steps'] += 1
+        if status in (sqlite3.SQLITE_OK, sqlite3.SQLITE_DONE):  # otherwise busy/locked: nothing copied
+            if last[0] is not None and remaining >= last[0]:
+                # the source changed under us and SQLite started over
+                stats['restarts'] += 1
+                if stats['restarts'] > max_restarts:
+                    raise _Restarting()
+            elif progress:
+                progress((total if last[0] is None else last[0]) - remaining)
+            last[0] = remaining
+        if remaining and sleep:
+            time.sleep(sleep)  # between steps the source is unlocked
+
+    started = time.perf_counter()
+    src = sqlite3.connect(src_path, timeout=busy_timeout)
+    try:
+        dst = sqlite3.connect(dest_path)
+        try:
+            try:
+                src.backup(dst, pages=step_pages if step_pages > 0 else -1, progress=on_step)
+            except _Restarting:
+                stats['single_pass'] = True
+                src.backup(dst, pages=-1)
+            # a WAL source leaves the copy in WAL mode; make the snapshot one self-contained file
+            dst.execute('PRAGMA journal_mode=DELETE')
+            stats['pages'] = dst.execute('PRAGMA page_count').fetchone()[0]
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    return stats
+
+def check_integrity(path, quick=False):
+    """'ok', or the first problems SQLite reports for the file."""
+    con = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = con.execute('PRAGMA quick_check' if quick else 'PRAGMA integrity_check').fetchmany(20)
+    finally:
+        con.close()
+    return '; '.join(r[0] for r in rows)
+
+def app_sources():
+    """[(name in snapshot, path)] for the app's main database and every exam shard."""
+    import shards
+    from models import db
+    url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        raise BackupFailed('online backup needs a file-based SQLite database')
+    sources = [('main.sqlite', os.path.abspath(url.database))]
+    router = shards.router()
+    if router is not None:
+        sources += [(f'shards/exam_{eid}.sqlite', router.path(eid)) for eid in router.exam_ids()]
+    return sources
+
+def snapshot_now(verify='full', keep=None, progress=None):
+    """Snapshot the running app's databases with the BACKUP_* settings."""
+    from config import Config
+    return create_snapshot(
+        Config.BACKUP_DIR, app_sources(),
+        step_pages=Config.BACKUP_STEP_PAGES,
+        sleep=Config.BACKUP_STEP_SLEEP,
+        max_restarts=Config.BACKUP_MAX_RESTARTS,
+        verify=verify,
+        keep=int(keep) if keep else Config.BACKUP_KEEP,
+        progress=progress,
+    )
+
+def create_snapshot(backup_dir, sources, step_pages=256, sleep=0.01, max_restarts=3, verify='full',
+                    keep=None, progress=None):
+    """Back up `sources` ([(name in snapshot, live path), ...]) into a new snapshot directory.
+
+    verify is 'full' (integrity_check), 'quick' (quick_check) or 'none'. When
+    keep is set, older snapshots beyond the newest `keep` are deleted after
+    this one succeeds. progress, if given, is called with (name, pages) after
+    each file is copied and checked; it is not called mid-file, because a
+    progress write to the database being copied would restart the copy.
+    Returns the manifest.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    name = 'snapshot_' + datetime.utcnow().strftime('%Y%m%dT%H%M%S%fZ')
+    work = os.path.join(backup_dir, name + '.partial')
+    os.makedirs(work)
+    started = time.perf_counter()
+    manifest = {'name': name, 'created_at': datetime.utcnow().isoformat(), 'verify': verify, 'files': []}
+    try:
+        for rel, src in sources:
+            dest = os.path.join(work, rel)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            entry = {'file': rel, **copy_database(src, dest, step_pages, sleep, max_restarts)}
+            if verify != 'none':
+                entry['integrity'] = check_integrity(dest, quick=(verify == 'quick'))
+                if entry['integrity'] != 'ok':
+                    raise BackupFailed(f'{rel}: integrity check failed: {entry["integrity"]}')
+            entry['bytes'] = os.path.getsize(dest)
+            manifest['files'].append(entry)
+            if progress:
+                progress(rel, entry['pages'])
+        manifest['bytes'] = sum(f['bytes'] for f in manifest['files'])
+        manifest['seconds'] = round(time.perf_counter() - started, 3)
+        with open(os.path.join(work, MANIFEST), 'w') as fh:
+            json.dump(manifest, fh, indent=2)
+        os.rename(work, os.path.join(backup_dir, name))
+    except BaseException:
+        shutil.rmtree(work, ignore_errors=True)
+        raise
+    if keep:
+        manifest['pruned'] = prune(backup_dir, keep)
+    return manifest
+
+def list_snapshots(backup_dir):
+    """Manifests of the complete snapshots in backup_dir, newest first."""
+    if not os.path.isdir(backup_dir):
+        return []
+    out = []
+    for name in sorted(os.listdir(backup_dir), reverse=True):
+        if not SNAPSHOT.match(name):
+            continue
+        try:
+            with open(os.path.join(backup_dir, name, MANIFEST)) as fh:
+                out.append(json.load(fh))
+        except (OSError, ValueError):
+            continue
+    return out
+
+def prune(backup_dir, keep, partial_age=3600):
+    """Delete all but the newest `keep` snapshots; returns the names removed.
+
+    Leftover .partial directories (from a process that died mid-backup) older
+    than partial_age seconds are removed too.
+    """
+    names = sorted((n for n in os.listdir(backup_dir) if SNAPSHOT.match(n)), reverse=True)
+    removed = names[max(1, int(keep)):]
+    for n in removed:
+        shutil.rmtree(os.path.join(backup_dir, n), ignore_errors=True)
+    cutoff = time.time() - partial_age
+    for n in os.listdir(backup_dir):
+        path = os.path.join(backup_dir, n)
+        if n.endswith('.partial') and SNAPSHOT.match(n[:-len('.partial')]) and os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+    return removed
+
+def snapshot_file(backup_dir, name, rel):
+    """Absolute path of one file of a snapshot, or None if it is not part of it."""
+    if not SNAPSHOT.match(name or ''):
+        return None
+    for m in list_snapshots(backup_dir):
+        if m['name'] == name and any(f['file'] == rel for f in m['files']):
+            return os.path.join(backup_dir, name, rel)
+    return None
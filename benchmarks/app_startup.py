@@ -0,0 +1,99 @@
+"""Per-process boot cost of the app: imports, create_app and the first request.
+
+Run from the project root:
+
+    python -m benchmarks.app_startup --repeat 5
+
+Every sample is a fresh interpreter, which is what a new web worker pays.
+The child times the framework imports (Flask, Flask-SQLAlchemy,
+SQLAlchemy), the project's route modules, `from app import app`
+(create_app: schema check, shards, side services) and one request. Scenarios:
+
+  cold              new empty database every run (full schema setup)
+  warm              the same database again (schema fingerprint matches)
+  warm_no_services  as warm with APP_SERVICES=none (web worker of a split deployment)
+
+Reported per scenario: medians in ms, the parent-measured process wall time,
+and the modules loaded, including which optional subsystems got imported.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPTIONAL = ('rpc_service', 'xmlrpc.server', 'scheduler', 'gradebook', 'ricart_agrawala', 'dispatcher',
+            'replication', 'regrade', 'backup')
+
+
+def child():
+    t0 = time.perf_counter()
+    import flask, flask_sqlalchemy, sqlalchemy  # noqa: F401
+    t1 = time.perf_counter()
+    import admin_routes, job_routes, student_routes, teacher_routes  # noqa: F401
+    t2 = time.perf_counter()
+    from app import app
+    t3 = time.perf_counter()
+    status = app.test_client().get('/api/server_time').status_code
+    t4 = time.perf_counter()
+    ms = lambda a, b: round((b - a) * 1000, 2)
+    print(json.dumps({
+        'framework_import_ms': ms(t0, t1),
+        'project_import_ms': ms(t1, t2),
+        'create_app_ms': ms(t2, t3),
+        'first_request_ms': ms(t3, t4),
+        'total_ms': ms(t0, t4),
+        'status': status,
+        'modules': len(sys.modules),
+        'optional_loaded': [m for m in OPTIONAL if m in sys.modules],
+    }), flush=True)
+    os._exit(0)  # skip joining service threads
+
+
+def sample(db_path, services, port):
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + db_path, APP_SERVICES=services, RPC_PORT=str(port))
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, '-m', 'benchmarks.app_startup', '--child'], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    result['process_ms'] = round((time.perf_counter() - t0) * 1000, 2)
+    return result
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+    if args.child:
+        child()
+        return 0
+
+    work = tempfile.mkdtemp(prefix='app_startup_')
+    warm_db = os.path.join(work, 'warm.sqlite')
+    sample(warm_db, 'none', 19290)  # create and stamp the warm database
+    scenarios = {
+        'cold': lambda i: sample(os.path.join(work, f'cold_{i}.sqlite'), 'all', 19300 + i),
+        'warm': lambda i: sample(warm_db, 'all', 19400 + i),
+        'warm_no_services': lambda i: sample(warm_db, 'none', 19500 + i),
+    }
+    report = {'scenario': 'app_startup', 'repeat': args.repeat, 'python': sys.version.split()[0], 'runs': {}}
+    for name, run in scenarios.items():
+        print(f'[{name}]', file=sys.stderr)
+        runs = [run(i) for i in range(args.repeat)]
+        summary = {k: round(statistics.median(r[k] for r in runs), 2)
+                   for k in ('framework_import_ms', 'project_import_ms', 'create_app_ms', 'first_request_ms',
+                             'total_ms', 'process_ms')}
+        summary['modules'] = runs[-1]['modules']
+        summary['optional_loaded'] = runs[-1]['optional_loaded']
+        report['runs'][name] = summary
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""Submit latency while an online backup runs.
+
+Run from the project root:
+
+    python -m benchmarks.backup_latency --logs 1000000 --steps=-1,256,2048 --seconds 30
+
+A database is generated once (benchmarks.generate_dataset; --logs sets its
+size). For each backup step size a load process submits answers as fast as it
+can through the Flask test client. After a third of the run, the parent takes
+a snapshot with backup.create_snapshot. The report compares submit p50/p99
+while the backup runs with p50/p99 before and after it. It also gives the
+backup's duration, restarts and whether it fell back to a single pass. A step
+of -1 copies the whole file in one step, which is what a plain backup would
+do. --sharded runs the load with SHARDING_ENABLED=1, so submits write WAL
+shard files rather than the main database. Each submit comes from a student
+who has not submitted yet (first submits insert a mark and write the main
+database's logs); --students N instead cycles the first N students, which
+mostly measures mark updates. --journal delete runs the main database
+without WAL, as it was before SQLITE_WAL.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load(seconds, students):
+    from app import app
+    from models import Exam, Question, User, db
+
+    with app.app_context():
+        exam_id = db.session.execute(db.select(Exam.id).where(Exam.is_published.is_(True))
+                                     .order_by(Exam.id).limit(1)).scalar()
+        qids = db.session.execute(db.select(Question.id).where(Question.exam_id == exam_id)).scalars().all()
+        q = db.select(User.id).where(User.role == 'student').order_by(User.id)
+        sids = db.session.execute(q.limit(students) if students else q).scalars().all()
+
+    def client(sid):
+        c = app.test_client()
+        with c.session_transaction() as s:
+            s['student_logged_in'] = True
+            s['student_id'] = sid
+            s['student_username'] = f'bench_{sid}'
+        return c
+    clients = [client(sid) for sid in sids] if students else None
+    rnd = random.Random(1)
+    print('ready', flush=True)
+    samples, errors = [], 0
+    end = time.time() + seconds
+    i = 0
+    while time.time() < end:
+        c = clients[i % len(clients)] if clients else client(sids[i % len(sids)])
+        i += 1
+        answers = {f'q{q}': rnd.choice('ABCD') for q in qids}
+        t0 = time.perf_counter()
+        started = time.time()
+        try:
+            ok = c.post('/api/student/submit_exam', json={'exam_id': exam_id, 'answers': answers}).status_code == 200
+        except Exception:
+            ok = False
+        samples.append((started, time.perf_counter() - t0))
+        errors += 0 if ok else 1
+    print(json.dumps({'samples': samples, 'errors': errors}), flush=True)
+
+
+def _summary(latencies):
+    if not latencies:
+        return {'submits': 0}
+    latencies = sorted(latencies)
+    pick = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+    return {'submits': len(latencies), 'p50_ms': pick(0.50), 'p99_ms': pick(0.99), 'max_ms': pick(1.0)}
+
+
+def run(db_path, step_pages, sleep, seconds, students, sharded, shard_dir, wal=True):
+    import backup
+    import sqlite3
+    con = sqlite3.connect(db_path)
+    con.execute('PRAGMA journal_mode=' + ('WAL' if wal else 'DELETE'))
+    con.execute('DELETE FROM marks')  # every run starts with no submissions
+    con.execute('DELETE FROM exam_attempts')
+    con.commit()
+    con.close()
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    env = dict(os.environ, SCHEDULER_ENABLED='0', JOBS_ENABLED='0', RPC_PORT='19200', SQLITE_WAL='1' if wal else '0',
+               SHARDING_ENABLED='1' if sharded else '0', SHARD_DIR=shard_dir,
+               DATABASE_URL='sqlite:///' + db_path)
+    proc = subprocess.Popen([sys.executable, '-m', 'benchmarks.backup_latency', '--load', str(seconds),
+                             '--students', str(students)], cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True)
+    while proc.stdout.readline().strip() != 'ready':
+        if proc.poll() is not None:
+            raise SystemExit('load process failed to start')
+    time.sleep(seconds / 3)
+    out_dir = tempfile.mkdtemp(prefix='backup_latency_out_')
+    t0 = time.time()
+    manifest = backup.create_snapshot(out_dir, [('main.sqlite', db_path)], step_pages=step_pages, sleep=sleep)
+    t1 = time.time()
+    shutil.rmtree(out_dir, ignore_errors=True)
+    out, _ = proc.communicate()
+    if proc.returncode != 0:
+        raise SystemExit(f'load process exited with {proc.returncode}')
+    result = json.loads(out.strip().splitlines()[-1])
+    # a request is "during" the backup if it was in flight at any point of it
+    during = [lat for ts, lat in result['samples'] if ts < t1 and ts + lat > t0]
+    outside = [lat for ts, lat in result['samples'] if not (ts < t1 and ts + lat > t0)]
+    f = manifest['files'][0]
+    return {
+        'backup': {'seconds': round(t1 - t0, 3), 'copy_seconds': f['seconds'], 'steps': f['steps'],
+                   'restarts': f['restarts'], 'single_pass': f['single_pass'], 'mb': round(f['bytes'] / 2**20, 1)},
+        'submit_outside_backup': _summary(outside),
+        'submit_during_backup': _summary(during),
+        'errors': result['errors'],
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--users', type=int, default=5000)
+    ap.add_argument('--exams', type=int, default=50)
+    ap.add_argument('--logs', type=int, default=1000000, help='log rows generated (sets the database size)')
+    ap.add_argument('--steps', default='-1,256,2048', help='comma-separated pages per backup step (-1: one pass)')
+    ap.add_argument('--sleep', type=float, default=0.01, help='seconds between backup steps')
+    ap.add_argument('--seconds', type=float, default=30.0, help='length of each load run')
+    ap.add_argument('--students', type=int, default=0, help='cycle the first N students (0: a new student per submit)')
+    ap.add_argument('--journal', choices=('wal', 'delete'), default='wal', help='main database journal mode')
+    ap.add_argument('--sharded', action='store_true', help='run the load with SHARDING_ENABLED=1')
+    ap.add_argument('--load', type=float, default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+    if args.load is not None:
+        load(args.load, args.students)
+        return 0
+
+    work = tempfile.mkdtemp(prefix='backup_latency_')
+    db_path = os.path.join(work, 'main.sqlite')
+    print(f'generating {args.logs} logs into {db_path}', file=sys.stderr)
+    subprocess.run([sys.executable, '-m', 'benchmarks.generate_dataset', '--users', str(args.users),
+                    '--exams', str(args.exams), '--logs', str(args.logs), '--database-url', 'sqlite:///' + db_path],
+                   cwd=ROOT, env=dict(os.environ, RPC_PORT='19199'), check=True, capture_output=True)
+    report = {'scenario': 'backup_latency', 'db_mb': round(os.path.getsize(db_path) / 2**20, 1),
+              'sharded': args.sharded, 'journal': args.journal, 'students': args.students or 'new', 'sleep': args.sleep,
+              'runs': {}}
+    for step in [int(x) for x in args.steps.split(',') if x.strip()]:
+        print(f'[step {step}] load + backup', file=sys.stderr)
+        report['runs'][f'step_{step}'] = run(db_path, step, args.sleep, args.seconds, args.students, args.sharded,
+                                             os.path.join(work, 'shards'), args.journal == 'wal')
+    print(json.dumps(report, indent=2))
+    shutil.rmtree(work, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,355 @@
+"""Exam-day load test: students log in, wait for start_at, stream events and submit together.
+
+Run from the project root:
+
+    python -m benchmarks.exam_day --students 200 --transport inprocess --out exam_day.json
+    python -m benchmarks.exam_day --students 200 --transport http --teachers 2
+
+A fresh SQLite database is created in a temp directory (or --database-url)
+and seeded with one teacher, --students students and a published exam that
+starts --lead seconds after seeding. Each student thread then:
+
+  1. POST /student/login
+  2. GET /api/student/exam/<id>, waiting out the waiting-room ticket it gets
+     back (or polling every --poll-interval) until it opens
+  3. sends --events POST /api/student/event calls at --event-rate per second
+  4. POST /api/student/submit_exam
+
+while --teachers threads hold /api/teacher/monitor_stream open. The report
+(JSON) has throughput plus p50/p95/p99 per endpoint so runs on different
+commits can be diffed.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+PASSWORD = 'loadtest'
+
+
+class Recorder:
+    """Thread-safe latency/status collector keyed by endpoint label."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.status = {}
+        self.errors = {}
+
+    def add(self, label, seconds, status):
+        with self._lock:
+            self.latencies.setdefault(label, []).append(seconds)
+            key = f'{label}:{status}'
+            self.status[key] = self.status.get(key, 0) + 1
+
+    def error(self, label, exc):
+        with self._lock:
+            key = f'{label}:{type(exc).__name__}'
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return None
+    k = max(0, min(len(sorted_vals) - 1, int(round(p / 100.0 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[k]
+
+
+class InProcessClient:
+    """Drives the app through Flask's test client (no sockets)."""
+
+    def __init__(self, app):
+        self.c = app.test_client()
+
+    def request(self, method, path, json_body=None, form=None):
+        resp = self.c.open(path, method=method, json=json_body, data=form)
+        try:
+            body = resp.get_json(silent=True)
+        finally:
+            resp.close()
+        return resp.status_code, body
+
+    def open_stream(self, path):
+        resp = self.c.get(path, buffered=False)
+        return resp.status_code, (chunk.decode() if isinstance(chunk, bytes) else chunk for chunk in resp.response)
+
+
+class HttpClient:
+    """Keep-alive HTTP/1.1 client with a single session cookie."""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.conn = http.client.HTTPConnection(host, port, timeout=60)
+        self.cookie = None
+
+    def _headers(self, extra=None):
+        h = {'Connection': 'keep-alive'}
+        if self.cookie:
+            h['Cookie'] = self.cookie
+        if extra:
+            h.update(extra)
+        return h
+
+    def _remember_cookie(self, resp):
+        sc = resp.getheader('Set-Cookie')
+        if sc:
+            self.cookie = sc.split(';', 1)[0]
+
+    def request(self, method, path, json_body=None, form=None):
+        body, extra = None, {}
+        if json_body is not None:
+            body, extra = json.dumps(json_body), {'Content-Type': 'application/json'}
+        elif form is not None:
+            body, extra = urlencode(form), {'Content-Type': 'application/x-www-form-urlencoded'}
+        try:
+            self.conn.request(method, path, body=body, headers=self._headers(extra))
+            resp = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # server closed the keep-alive connection; retry once on a new one
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.conn.request(method, path, body=body, headers=self._headers(extra))
+            resp = self.conn.getresponse()
+        data = resp.read()
+        self._remember_cookie(resp)
+        try:
+            parsed = json.loads(data) if data else None
+        except ValueError:
+            parsed = None
+        return resp.status, parsed
+
+    def open_stream(self, path):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=None)
+        conn.request('GET', path, headers=self._headers())
+        resp = conn.getresponse()
+
+        def lines():
+            while True:
+                line = resp.readline()
+                if not line:
+                    return
+                yield line.decode()
+        return resp.status, lines()
+
+
+def timed(rec, label, fn, *a, **kw):
+    t0 = time.perf_counter()
+    try:
+        status, body = fn(*a, **kw)
+    except Exception as e:
+        rec.error(label, e)
+        return None, None
+    rec.add(label, time.perf_counter() - t0, status)
+    return status, body
+
+
+def seed_database(app, n_students, n_teachers, n_questions, lead_seconds, duration_minutes, realistic_hash):
+    from werkzeug.security import generate_password_hash
+    from models import User, Exam, Question, db
+    # one hash shared by every seeded account; cheap by default so the run measures the app, not the KDF
+    pw_hash = generate_password_hash(PASSWORD) if realistic_hash else generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000')
+    with app.app_context():
+        db.create_all()
+        now = datetime.utcnow()
+        db.session.execute(User.__table__.insert(), [
+            {'username': f'lt_teacher_{i}', 'password_hash': pw_hash, 'role': 'teacher', 'created_at': now}
+            for i in range(n_teachers)])
+        db.session.execute(User.__table__.insert(), [
+            {'username': f'lt_student_{i}', 'password_hash': pw_hash, 'role': 'student', 'created_at': now}
+            for i in range(n_students)])
+        teacher = User.query.filter_by(username='lt_teacher_0').first()
+        # start_at is compared with naive local time by api_student_exam_details
+        exam = Exam(title='Load test exam', duration_minutes=duration_minutes, created_by=teacher.id,
+                    is_published=True, num_questions=n_questions,
+                    start_at=datetime.now() + timedelta(seconds=lead_seconds))
+        db.session.add(exam)
+        db.session.commit()
+        db.session.execute(Question.__table__.insert(), [
+            {'exam_id': exam.id, 'text': f'Question {q}', 'option_a': 'a', 'option_b': 'b', 'option_c': 'c',
+             'option_d': 'd', 'correct_option': 'ABCD'[q % 4], 'points': 1.0, 'created_at': now}
+            for q in range(n_questions)])
+        db.session.commit()
+        return exam.id, exam.start_at
+
+
+def student_flow(idx, client, rec, exam_id, args, rng, start_barrier):
+    status, _ = timed(rec, 'student_login', client.request, 'POST', '/student/login',
+                      form={'username': f'lt_student_{idx}', 'password': PASSWORD})
+    start_barrier.wait()
+    questions = None
+    ticket = None
+    deadline = time.time() + args.lead + 120
+    while time.time() < deadline:
+        path = f'/api/student/exam/{exam_id}' + (f'?ticket={ticket}' if ticket else '')
+        status, body = timed(rec, 'exam_details', client.request, 'GET', path)
+        if status == 200 and body and body.get('ok'):
+            questions = body['exam']['questions']
+            break
+        if status not in (403, 429):
+            return
+        if body and body.get('ticket'):
+            # waiting room: come back at the release time on the ticket
+            ticket = body['ticket']
+            time.sleep(body.get('retry_after_ms', 0) / 1000.0 or args.poll_interval)
+        else:
+            time.sleep(args.poll_interval)
+    if questions is None:
+        return
+    gap = 1.0 / args.event_rate if args.event_rate > 0 else 0
+    cheats = 0
+    for e in range(args.events):
+        if rng.random() < args.cheat_prob:
+            cheats += 1
+            payload = {'type': 'cheating_detected', 'exam_id': exam_id, 'count': cheats}
+        else:
+            payload = {'type': 'heartbeat', 'exam_id': exam_id, 'seq': e}
+        timed(rec, 'student_event', client.request, 'POST', '/api/student/event', json_body=payload)
+        if gap:
+            time.sleep(gap)
+    answers = {f"q{q['id']}": rng.choice('ABCD') for q in questions}
+    timed(rec, 'submit_exam', client.request, 'POST', '/api/student/submit_exam',
+          json_body={'exam_id': exam_id, 'answers': answers, 'cheating_count': cheats})
+
+
+def teacher_flow(idx, client, rec, stop, received):
+    timed(rec, 'teacher_login', client.request, 'POST', '/teacher/login',
+          form={'username': f'lt_teacher_{idx}', 'password': PASSWORD})
+    t0 = time.perf_counter()
+    try:
+        status, lines = client.open_stream('/api/teacher/monitor_stream')
+    except Exception as e:
+        rec.error('monitor_first_event', e)
+        return
+    # SSE headers are only flushed with the first event, so this is time-to-first-event
+    rec.add('monitor_first_event', time.perf_counter() - t0, status)
+    n = 0
+    for line in lines:
+        if line.startswith('data:'):
+            n += 1
+        if stop.is_set():
+            break
+    received[idx] = n
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--students', type=int, default=100)
+    ap.add_argument('--teachers', type=int, default=1)
+    ap.add_argument('--questions', type=int, default=20)
+    ap.add_argument('--events', type=int, default=5, help='events per student')
+    ap.add_argument('--event-rate', type=float, default=2.0, help='events per second per student')
+    ap.add_argument('--cheat-prob', type=float, default=0.05)
+    ap.add_argument('--lead', type=float, default=3.0, help='seconds from seeding to start_at')
+    ap.add_argument('--poll-interval', type=float, default=0.25)
+    ap.add_argument('--duration', type=int, default=60, help='exam duration in minutes')
+    ap.add_argument('--transport', choices=('inprocess', 'http'), default='inprocess')
+    ap.add_argument('--database-url', default=None, help='defaults to a fresh SQLite file in a temp dir')
+    ap.add_argument('--realistic-hash', action='store_true', help='seed with the default (slow) password hash')
+    ap.add_argument('--seed', type=int, default=42)
+    ap.add_argument('--out', default=None, help='write the JSON report here as well as stdout')
+    args = ap.parse_args(argv)
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        tmpdir = tempfile.mkdtemp(prefix='exam_day_')
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmpdir, 'loadtest.sqlite')
+    from app import app
+    from utils import publish_event
+
+    exam_id, start_at = seed_database(app, args.students, max(1, args.teachers), args.questions,
+                                      args.lead, args.duration, args.realistic_hash)
+
+    server = None
+    if args.transport == 'http':
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        def make_client():
+            return HttpClient('127.0.0.1', server.port)
+    else:
+        def make_client():
+            return InProcessClient(app)
+
+    rec = Recorder()
+    stop = threading.Event()
+    received = {}
+    teachers = [threading.Thread(target=teacher_flow, args=(i, make_client(), rec, stop, received), daemon=True)
+                for i in range(args.teachers)]
+    for t in teachers:
+        t.start()
+
+    start_barrier = threading.Barrier(args.students)
+    master = random.Random(args.seed)
+    students = [threading.Thread(target=student_flow,
+                                 args=(i, make_client(), rec, exam_id, args, random.Random(master.random()), start_barrier),
+                                 daemon=True)
+                for i in range(args.students)]
+    t0 = time.perf_counter()
+    for t in students:
+        t.start()
+    for t in students:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    stop.set()
+    publish_event({'type': 'loadtest_done'})  # wakes monitor streams so they notice `stop`
+    for t in teachers:
+        t.join(timeout=5)
+    if server is not None:
+        server.shutdown()
+
+    endpoints = {}
+    total = 0
+    for label, vals in sorted(rec.latencies.items()):
+        vals.sort()
+        total += len(vals)
+        endpoints[label] = {
+            'count': len(vals),
+            'throughput_rps': round(len(vals) / elapsed, 2),
+            'mean_ms': round(sum(vals) / len(vals) * 1000, 3),
+            'p50_ms': round(percentile(vals, 50) * 1000, 3),
+            'p95_ms': round(percentile(vals, 95) * 1000, 3),
+            'p99_ms': round(percentile(vals, 99) * 1000, 3),
+            'max_ms': round(vals[-1] * 1000, 3),
+        }
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except Exception:
+        commit = None
+    report = {
+        'scenario': 'exam_day',
+        'commit': commit,
+        'python': platform.python_version(),
+        'transport': args.transport,
+        'config': {k: v for k, v in vars(args).items() if k not in ('out', 'database_url')},
+        'start_at': start_at.isoformat(),
+        'wall_seconds': round(elapsed, 3),
+        'total_requests': total,
+        'throughput_rps': round(total / elapsed, 2) if elapsed else None,
+        'endpoints': endpoints,
+        'status_counts': dict(sorted(rec.status.items())),
+        'errors': dict(sorted(rec.errors.items())),
+        'monitor_events_received': [received.get(i) for i in range(args.teachers)],
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return report
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
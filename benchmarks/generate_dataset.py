@@ -0,0 +1,299 @@
+"""Fill a fresh database with a realistic large dataset.
+
+Run from the project root:
+
+    python -m benchmarks.generate_dataset --scale small --database-url sqlite:////tmp/small.sqlite
+    python -m benchmarks.generate_dataset --users 100000 --exams 3000 --logs 20000000 --database-url ...
+
+Creates users (about 2% teachers), exams owned by a skewed set of teachers,
+their questions, marks for a class-sized sample of students per exam
+(including cheating counts and the same penalties submit_exam applies), and
+a logs table dominated by student activity, with cheating_detected rows that
+carry meta.exam_id. On SQLite rows are written with executemany on the raw
+connection, in chunks, with journaling relaxed for the load.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+SCALES = {
+    'tiny':   {'users': 1000,   'exams': 20,   'logs': 50000},
+    'small':  {'users': 10000,  'exams': 200,  'logs': 1000000},
+    'medium': {'users': 100000, 'exams': 2000, 'logs': 10000000},
+    'large':  {'users': 100000, 'exams': 5000, 'logs': 30000000},
+}
+CHUNK = 50000
+PASSWORD = 'password'
+
+# (event_type, role, weight) for the background log stream
+LOG_MIX = (
+    ('event_heartbeat', 'student', 40),
+    ('view_exam_details', 'student', 12),
+    ('list_exams', 'student', 10),
+    ('event_exam_start', 'student', 8),
+    ('student_login', 'student', 8),
+    ('submit_exam', 'student', 6),
+    ('student_logout', 'student', 4),
+    ('cheating_detected', 'student', 1),
+    ('teacher_login', 'teacher', 3),
+    ('view_cheating_logs', 'teacher', 2),
+    ('download_csv', 'teacher', 1),
+    ('set_mark', 'teacher', 2),
+    ('rpc_ping_error', 'teacher', 1),
+    ('lb_backup', 'teacher', 1),
+    ('view_logs', 'admin', 1),
+)
+
+
+def _ts(dt):
+    # SQLAlchemy's SQLite DateTime storage format
+    return dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+class Writer:
+    """Chunked bulk insert: raw sqlite3 executemany, or SQLAlchemy Core elsewhere."""
+
+    def __init__(self, db):
+        self.db = db
+        self.sqlite = db.engine.dialect.name == 'sqlite'
+        if self.sqlite:
+            self.raw = db.engine.raw_connection()
+            cur = self.raw.cursor()
+            for pragma in ('journal_mode=MEMORY', 'synchronous=OFF', 'cache_size=-200000', 'temp_store=MEMORY'):
+                cur.execute(f'PRAGMA {pragma}')
+            cur.close()
+
+    def insert(self, table, columns, rows):
+        rows = list(rows)
+        if not rows:
+            return 0
+        if self.sqlite:
+            sql = f'INSERT INTO {table.name} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+            cur = self.raw.cursor()
+            cur.executemany(sql, rows)
+            cur.close()
+            self.raw.commit()
+        else:
+            with self.db.engine.begin() as conn:
+                conn.execute(table.insert(), [dict(zip(columns, r)) for r in rows])
+        return len(rows)
+
+    def close(self):
+        if self.sqlite:
+            self.raw.close()
+
+
+def _chunks(it, size=CHUNK):
+    buf = []
+    for row in it:
+        buf.append(row)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+def generate(db, users, exams, logs, seed=1, class_size=(50, 400), verbose=True):
+    from werkzeug.security import generate_password_hash
+    from models import User, Exam, Question, Mark, Log
+
+    rng = random.Random(seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    epoch = now - timedelta(days=730)
+    writer = Writer(db)
+    is_sqlite = writer.sqlite
+    pw_hash = generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000')
+    counts = {}
+    t_all = time.perf_counter()
+
+    def step(name, n, t0):
+        counts[name] = n
+        if verbose:
+            dt = time.perf_counter() - t0
+            print(f'  {name:<10} {n:>12,} rows  {dt:7.2f}s  ({n / dt if dt else 0:,.0f} rows/s)', file=sys.stderr)
+
+    def enc(v):
+        return json.dumps(v) if is_sqlite else v
+
+    def tsv(dt):
+        return _ts(dt) if is_sqlite else dt
+
+    # --- users: ids are assigned 1..users in insertion order ---
+    t0 = time.perf_counter()
+    n_teachers = max(1, users // 50)
+    roles = ['teacher'] * n_teachers + ['student'] * (users - n_teachers)
+    rng.shuffle(roles)
+    teacher_ids, student_ids = [], []
+    usernames = [None]  # indexed by user id
+
+    def user_rows():
+        tn = sn = 0
+        for uid, role in enumerate(roles, start=1):
+            created = epoch + timedelta(seconds=rng.randrange(0, 730 * 86400))
+            if role == 'teacher':
+                tn += 1
+                teacher_ids.append(uid)
+                name = f'teacher_{tn:05d}'
+            else:
+                sn += 1
+                student_ids.append(uid)
+                name = f'student_{sn:07d}'
+            usernames.append(name)
+            yield (name, pw_hash, role, tsv(created))
+    n = sum(writer.insert(User.__table__, ('username', 'password_hash', 'role', 'created_at'), c)
+            for c in _chunks(user_rows()))
+    step('users', n, t0)
+
+    # --- exams: a few prolific teachers own most exams (Pareto weights) ---
+    t0 = time.perf_counter()
+    weights = [rng.paretovariate(1.2) for _ in teacher_ids]
+    owners = rng.choices(teacher_ids, weights=weights, k=exams)
+    exam_meta = []  # (exam_id, title, start_at, num_questions)
+
+    def exam_rows():
+        for eid, owner in enumerate(owners, start=1):
+            start = epoch + timedelta(seconds=rng.randrange(0, 760 * 86400))
+            nq = rng.randint(10, 50)
+            title = f'{rng.choice(("Algebra", "Physics", "Chemistry", "History", "Biology", "Networks", "Databases"))} {rng.choice(("Quiz", "Midterm", "Final", "Test"))} {eid}'
+            exam_meta.append((eid, title, start, nq))
+            yield (title, rng.choice((30, 45, 60, 90, 120)), tsv(start), owner,
+                   1 if rng.random() < 0.9 else 0, nq, tsv(start - timedelta(days=rng.randint(1, 30))))
+    n = sum(writer.insert(Exam.__table__, ('title', 'duration_minutes', 'start_at', 'created_by', 'is_published',
+                                           'num_questions', 'created_at'), c)
+            for c in _chunks(exam_rows()))
+    step('exams', n, t0)
+
+    # --- questions ---
+    t0 = time.perf_counter()
+
+    def question_rows():
+        for eid, title, start, nq in exam_meta:
+            created = start - timedelta(days=1)
+            for q in range(nq):
+                yield (eid, f'{title} question {q + 1}', 'Option A', 'Option B', 'Option C', 'Option D',
+                       'ABCD'[rng.randrange(4)], 1.0 if rng.random() < 0.8 else 2.0, None, tsv(created))
+    n = sum(writer.insert(Question.__table__, ('exam_id', 'text', 'option_a', 'option_b', 'option_c', 'option_d',
+                                               'correct_option', 'points', 'time_seconds', 'created_at'), c)
+            for c in _chunks(question_rows()))
+    step('questions', n, t0)
+
+    # --- marks (and remember cheaters so the log stream can reference them) ---
+    t0 = time.perf_counter()
+    cheaters = []  # (student_id, exam_id, cheating_count, when)
+
+    def mark_rows():
+        for eid, title, start, nq in exam_meta:
+            size = min(len(student_ids), rng.randint(*class_size))
+            skill = rng.uniform(0.4, 0.85)
+            for sid in rng.sample(student_ids, size):
+                raw = sum(1 for _ in range(nq) if rng.random() < skill)
+                r = rng.random()
+                cheat = 0 if r < 0.95 else (1 if r < 0.99 else 2)
+                final = 0 if cheat >= 2 else (raw * 0.5 if cheat == 1 else raw)
+                graded = start + timedelta(minutes=rng.randint(10, 120))
+                if cheat:
+                    cheaters.append((sid, eid, cheat, graded))
+                yield (eid, sid, float(final), tsv(graded), cheat)
+    n = sum(writer.insert(Mark.__table__, ('exam_id', 'student_id', 'marks', 'graded_at', 'cheating_count'), c)
+            for c in _chunks(mark_rows()))
+    step('marks', n, t0)
+
+    # --- logs: time-ordered stream, so ids follow created_at as in production ---
+    t0 = time.perf_counter()
+    event_types = [e for e, _, _ in LOG_MIX]
+    event_roles = {e: r for e, r, _ in LOG_MIX}
+    event_weights = [w for _, _, w in LOG_MIX]
+    span = (now - epoch).total_seconds()
+    cheat_iter = iter(sorted(cheaters, key=lambda c: c[3]))
+
+    def log_rows():
+        step_s = span / max(1, logs)
+        t = epoch
+        next_cheat = next(cheat_iter, None)
+        for i in range(logs):
+            t = t + timedelta(seconds=rng.expovariate(1.0 / step_s))
+            while next_cheat is not None and next_cheat[3] <= t:
+                sid, eid, cnt, when = next_cheat
+                yield (sid, usernames[sid], 'student', 'cheating_detected',
+                       enc({'exam_id': eid, 'cheating_count': cnt}), tsv(when))
+                next_cheat = next(cheat_iter, None)
+            et = rng.choices(event_types, weights=event_weights)[0]
+            role = event_roles[et]
+            if role == 'student':
+                uid = rng.choice(student_ids)
+                eid = rng.randint(1, exams) if exams else None
+                if et == 'cheating_detected':
+                    meta = {'exam_id': eid, 'cheating_count': 1}
+                elif et == 'submit_exam':
+                    meta = {'exam_id': eid, 'original_marks': rng.randint(0, 50), 'final_marks': rng.randint(0, 50),
+                            'cheating_count': 0}
+                elif et in ('view_exam_details', 'event_exam_start', 'event_heartbeat'):
+                    meta = {'exam_id': eid}
+                elif et == 'list_exams':
+                    meta = {'count': rng.randint(1, 30)}
+                else:
+                    meta = {}
+            elif role == 'teacher':
+                uid = rng.choice(teacher_ids)
+                if et == 'rpc_ping_error':
+                    meta = {'error': rng.choice(('[Errno 111] Connection refused', 'timed out', '<ProtocolError 500>'))}
+                elif et == 'lb_backup':
+                    meta = {'payload': {'job': rng.randint(1, 10**6)}, 'primary_error': 'primary_overloaded'}
+                elif et in ('download_csv', 'set_mark'):
+                    meta = {'exam_id': rng.randint(1, exams) if exams else None}
+                else:
+                    meta = {'count': rng.randint(0, 300)}
+            else:
+                uid = None
+                meta = {'count': 2000, 'filter_event': None, 'cheating_only': False}
+            yield (uid, usernames[uid] if uid else 'admin', role, et, enc(meta), tsv(t))
+        while next_cheat is not None:
+            sid, eid, cnt, when = next_cheat
+            yield (sid, usernames[sid], 'student', 'cheating_detected',
+                   enc({'exam_id': eid, 'cheating_count': cnt}), tsv(when))
+            next_cheat = next(cheat_iter, None)
+    n = sum(writer.insert(Log.__table__, ('who_user_id', 'username', 'role', 'event_type', 'meta', 'created_at'), c)
+            for c in _chunks(log_rows()))
+    step('logs', n, t0)
+    writer.close()
+    counts['seconds'] = round(time.perf_counter() - t_all, 2)
+    return counts
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--scale', choices=sorted(SCALES), default='tiny')
+    ap.add_argument('--users', type=int)
+    ap.add_argument('--exams', type=int)
+    ap.add_argument('--logs', type=int)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--database-url', required=True, help='target database; must not already contain data')
+    args = ap.parse_args(argv)
+    sizes = dict(SCALES[args.scale])
+    for k in ('users', 'exams', 'logs'):
+        if getattr(args, k) is not None:
+            sizes[k] = getattr(args, k)
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SCHEDULER_ENABLED', '0')  # don't finalize generated exams while loading
+    from app import app
+    from models import User, db
+    with app.app_context():
+        db.create_all()
+        if db.session.query(User.id).first() is not None:
+            print('refusing to generate into a non-empty database', file=sys.stderr)
+            return 2
+        db.session.remove()
+        print(f'generating {sizes} into {args.database_url}', file=sys.stderr)
+        counts = generate(db, seed=args.seed, **sizes)
+    print(json.dumps(counts))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
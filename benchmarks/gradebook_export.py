@@ -0,0 +1,109 @@
+"""Time and peak memory of the streamed gradebook export.
+
+Run from the project root:
+
+    python -m benchmarks.gradebook_export --exams 50 --students 2000,10000
+
+For each class size a fresh database is filled with --exams exams that every
+student has a mark in. The admin gradebook is downloaded as a gzipped wide
+CSV, a plain wide CSV and a zip of per-exam CSVs. The download is consumed
+chunk by chunk, the way a client would read it. Peak Python heap
+(tracemalloc) should stay roughly flat as the row count grows.
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(exams, students, verify):
+    from app import app
+    from benchmarks.generate_dataset import generate
+    from models import db
+
+    with app.app_context():
+        generate(db, users=students + max(1, students // 50), exams=exams, logs=0,
+                 class_size=(students, students), verbose=False)
+
+    c = app.test_client()
+    with c.session_transaction() as s:
+        s['admin_logged_in'] = True
+        s['admin_username'] = 'admin'
+
+    results = {}
+    for label, url in (('wide_gzip', '/api/admin/gradebook'),
+                       ('wide_plain', '/api/admin/gradebook?compress=0'),
+                       ('zip', '/api/admin/gradebook?format=zip')):
+        def download(keep=None):
+            resp = c.get(url, buffered=False)
+            if resp.status_code != 200:
+                raise SystemExit(f'{label}: HTTP {resp.status_code} {resp.get_data(as_text=True)}')
+            size = chunks = 0
+            for chunk in resp.response:
+                size += len(chunk)
+                chunks += 1
+                if keep is not None:
+                    keep.write(chunk)
+            resp.close()
+            return size, chunks
+
+        # timed without tracemalloc (it slows allocation-heavy code several-fold)
+        t0 = time.perf_counter()
+        size, chunks = download()
+        elapsed = time.perf_counter() - t0
+        tracemalloc.start()
+        download()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        entry = {'seconds': round(elapsed, 3), 'bytes': size, 'chunks': chunks,
+                 'peak_heap_mb': round(peak / 2**20, 2)}
+        if verify:
+            keep = io.BytesIO()
+            download(keep)
+            data = keep.getvalue()
+            if label == 'zip':
+                with zipfile.ZipFile(io.BytesIO(data)) as zf:
+                    entry['data_rows'] = sum(zf.read(n).count(b'\n') - 1 for n in zf.namelist())
+            else:
+                text = gzip.decompress(data) if label == 'wide_gzip' else data
+                entry['data_rows'] = text.count(b'\n') - 1
+        results[label] = entry
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--exams', type=int, default=50)
+    ap.add_argument('--students', default='2000,10000', help='comma-separated class sizes')
+    ap.add_argument('--no-verify', action='store_true', help='skip decoding the archives to count rows')
+    ap.add_argument('--child', type=int, default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+    if args.child is not None:
+        print(json.dumps(run(args.exams, args.child, not args.no_verify)))
+        return 0
+
+    report = {'scenario': 'gradebook_export', 'exams': args.exams, 'runs': {}}
+    for n in [int(x) for x in args.students.split(',') if x.strip()]:
+        print(f'[{n} students] generating and exporting', file=sys.stderr)
+        env = dict(os.environ, SCHEDULER_ENABLED='0',
+                   DATABASE_URL='sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='gradebook_'), 'gb.sqlite'))
+        cmd = [sys.executable, '-m', 'benchmarks.gradebook_export', '--child', str(n), '--exams', str(args.exams)]
+        if args.no_verify:
+            cmd.append('--no-verify')
+        proc = subprocess.run(cmd, cwd=ROOT, env=env, check=True, capture_output=True, text=True)
+        report['runs'][f'{n}_students'] = json.loads(proc.stdout.strip().splitlines()[-1])
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Mean-latency benchmark: naive primary-then-backup vs the circuit-breaking dispatcher.
+
+Run from the project root:
+
+    python -m benchmarks.lb_dispatch --requests 2000 --fail-ratio 0.5
+
+The primary fails with probability --fail-ratio and each failed attempt costs
+--fail-ms (a timeout or overload error is rarely free); the backup always
+succeeds in --backup-ms.
+"""
+import argparse
+import json
+import random
+import time
+
+from dispatcher import Backend, CircuitBreaker, Dispatcher
+
+
+def make_workers(fail_ratio, fail_ms, primary_ms, backup_ms, seed):
+    rng = random.Random(seed)
+
+    def primary(payload):
+        if rng.random() < fail_ratio:
+            time.sleep(fail_ms / 1000.0)
+            raise RuntimeError('primary_overloaded')
+        time.sleep(primary_ms / 1000.0)
+        return {'processor': 'primary', 'received': payload}
+
+    def backup(payload):
+        time.sleep(backup_ms / 1000.0)
+        return {'processor': 'backup', 'received': payload}
+    return primary, backup
+
+
+def run_naive(primary, backup, n):
+    lat = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        try:
+            primary(i)
+        except Exception:
+            backup(i)
+        lat.append(time.perf_counter() - t0)
+    return lat, None
+
+
+def run_dispatcher(primary, backup, n, reset_timeout):
+    d = Dispatcher([
+        Backend('primary', primary, priority=0, breaker=CircuitBreaker(reset_timeout=reset_timeout)),
+        Backend('backup', backup, priority=1, breaker=CircuitBreaker(reset_timeout=reset_timeout)),
+    ])
+    lat, first_open = [], None
+    for i in range(n):
+        t0 = time.perf_counter()
+        d.dispatch(i)
+        lat.append(time.perf_counter() - t0)
+        if first_open is None and d.backends[0].breaker.state != 'closed':
+            first_open = i + 1
+    return lat, {'primary_open_after_requests': first_open, 'stats': d.stats()}
+
+
+def summarize(lat):
+    s = sorted(lat)
+    return {
+        'mean_ms': round(sum(s) / len(s) * 1000, 3),
+        'p50_ms': round(s[len(s) // 2] * 1000, 3),
+        'p99_ms': round(s[min(len(s) - 1, int(len(s) * 0.99))] * 1000, 3),
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--requests', type=int, default=2000)
+    ap.add_argument('--fail-ratio', type=float, default=0.5)
+    ap.add_argument('--fail-ms', type=float, default=2.0)
+    ap.add_argument('--primary-ms', type=float, default=0.5)
+    ap.add_argument('--backup-ms', type=float, default=0.5)
+    ap.add_argument('--reset-timeout', type=float, default=5.0)
+    ap.add_argument('--seed', type=int, default=7)
+    args = ap.parse_args(argv)
+
+    p, b = make_workers(args.fail_ratio, args.fail_ms, args.primary_ms, args.backup_ms, args.seed)
+    naive, _ = run_naive(p, b, args.requests)
+    p, b = make_workers(args.fail_ratio, args.fail_ms, args.primary_ms, args.backup_ms, args.seed)
+    disp, info = run_dispatcher(p, b, args.requests, args.reset_timeout)
+    out = {'naive': summarize(naive), 'dispatcher': summarize(disp), **info}
+    out['mean_latency_improvement'] = round(out['naive']['mean_ms'] / out['dispatcher']['mean_ms'], 2)
+    print(json.dumps(out, indent=2))
+    return out
+
+
+if __name__ == '__main__':
+    main()
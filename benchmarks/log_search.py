@@ -0,0 +1,137 @@
+"""Latency of the full-text log search endpoint on a generated dataset.
+
+Run from the project root:
+
+    python -m benchmarks.generate_dataset --scale medium --database-url sqlite:////tmp/medium.sqlite
+    python -m benchmarks.log_search --database-url sqlite:////tmp/medium.sqlite --repeat 10
+
+The FTS index is rebuilt first when it is missing or empty (--rebuild forces
+it). Each query is sent through the Flask test client as an admin, once with
+sort=rank and once with sort=recent, and compared with the LIKE scan the
+admin log view would otherwise need. The insert overhead of the sync trigger
+is measured on a scratch database so the dataset is left untouched.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.query_suite import percentile
+
+
+def _time(fn, repeat):
+    fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    return {'p50_ms': round(percentile(times, 50) * 1000, 3), 'max_ms': round(times[-1] * 1000, 3)}
+
+
+def pick_queries(db):
+    from models import Log
+    from sqlalchemy import func
+    student = (db.session.query(Log.username).filter(Log.role == 'student')
+               .order_by(Log.id.desc()).limit(1).scalar())
+    busiest = (db.session.query(Log.username).filter(Log.role == 'teacher').group_by(Log.username)
+               .order_by(func.count(Log.id).desc()).limit(1).scalar())
+    return [
+        ('username', student, 'username', student),
+        ('teacher_rare_event', f'{busiest} event_type:lb_backup', 'username', busiest),
+        ('event_type', 'event_type:cheating_detected', 'event_type', 'cheating_detected'),
+        ('meta_phrase', '"Connection refused"', 'meta', 'Connection refused'),
+        ('prefix', 'teacher_000*', 'username', 'teacher_000'),
+        ('common_term', 'heartbeat', 'event_type', 'heartbeat'),
+    ]
+
+
+def trigger_overhead(rows):
+    """Bulk-insert `rows` log rows into scratch databases with and without the sync trigger."""
+    from sqlalchemy import create_engine, text
+    import log_search
+    from models import Log
+    out = {}
+    for label, with_index in (('without_index', False), ('with_index', True)):
+        path = os.path.join(tempfile.mkdtemp(prefix='log_search_'), 'scratch.sqlite')
+        engine = create_engine('sqlite:///' + path)
+        Log.__table__.create(engine)
+        if with_index:
+            log_search.ensure_index(engine)
+        batch = [{'who_user_id': i, 'username': f'student_{i:07d}', 'role': 'student',
+                  'event_type': 'event_heartbeat', 'meta': {'exam_id': i % 300, 'note': 'Connection refused'}}
+                 for i in range(rows)]
+        t0 = time.perf_counter()
+        with engine.begin() as conn:
+            conn.execute(Log.__table__.insert(), batch)
+        elapsed = time.perf_counter() - t0
+        if with_index:
+            with engine.connect() as conn:
+                assert conn.execute(text(f'SELECT count(*) FROM {log_search.FTS_TABLE}')).scalar() == rows
+        engine.dispose()
+        out[label] = {'seconds': round(elapsed, 3), 'rows_per_second': round(rows / elapsed)}
+    out['slowdown'] = round(out['with_index']['seconds'] / out['without_index']['seconds'], 2)
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--database-url', required=True, help='a database built by benchmarks.generate_dataset')
+    ap.add_argument('--repeat', type=int, default=10)
+    ap.add_argument('--limit', type=int, default=50)
+    ap.add_argument('--rebuild', action='store_true', help='rebuild the FTS index even if it is populated')
+    ap.add_argument('--insert-rows', type=int, default=20000, help='rows for the trigger overhead test (0 skips it)')
+    ap.add_argument('--skip-like', action='store_true', help='do not time the LIKE baseline (slow on big tables)')
+    args = ap.parse_args(argv)
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SCHEDULER_ENABLED', '0')
+    from app import app
+    import log_search
+    from models import Log, db
+    from sqlalchemy import text
+
+    report = {'scenario': 'log_search', 'repeat': args.repeat, 'limit': args.limit}
+    with app.app_context():
+        report['log_rows'] = db.session.query(db.func.count(Log.id)).scalar()
+        indexed = db.session.execute(text(f'SELECT count(*) FROM {log_search.FTS_TABLE}')).scalar()
+        if args.rebuild or indexed < report['log_rows']:
+            print(f'indexing {report["log_rows"]:,} log rows', file=sys.stderr)
+            t0 = time.perf_counter()
+            log_search.rebuild(db.engine)
+            report['rebuild_seconds'] = round(time.perf_counter() - t0, 2)
+        queries = pick_queries(db)
+
+    c = app.test_client()
+    with c.session_transaction() as s:
+        s['admin_logged_in'] = True
+        s['admin_username'] = 'admin'
+
+    results = {}
+    for label, q, column, needle in queries:
+        entry = {'q': q}
+        for sort in ('rank', 'recent'):
+            url = f'/api/admin/logs/search?sort={sort}&limit={args.limit}&q=' + q.replace(' ', '+')
+            resp = c.get(url)
+            if resp.status_code != 200:
+                raise SystemExit(f'{label}: HTTP {resp.status_code} {resp.get_data(as_text=True)}')
+            entry[f'{sort}_hits'] = len(resp.get_json()['logs'])
+            entry[sort] = _time(lambda: c.get(url), args.repeat)
+        if not args.skip_like:
+            with app.app_context():
+                col = db.cast(Log.meta, db.String) if column == 'meta' else getattr(Log, column)
+                like = Log.query.filter(col.like(f'%{needle}%')).order_by(Log.id.desc()).limit(args.limit)
+                entry['like_scan'] = _time(lambda: like.all(), max(1, args.repeat // 5))
+        results[label] = entry
+    report['queries'] = results
+    if args.insert_rows:
+        report['trigger_overhead'] = trigger_overhead(args.insert_rows)
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Latency and SQL-count benchmark for the heavy read endpoints at several data scales.
+
+Run from the project root:
+
+    python -m benchmarks.query_suite --scales tiny,small --repeat 5
+    python -m benchmarks.query_suite --database-url sqlite:////tmp/medium.sqlite --repeat 3
+
+For each scale a dataset is generated with benchmarks.generate_dataset (or an
+existing one is reused with --database-url / --data-dir), then each query runs
+`--repeat` times through the Flask test client in a separate process.
+The per-query SQL statement count comes from the metrics middleware, so N+1
+patterns show up as counts that grow with the data.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_vals, pct):
+    if not sorted_vals:
+        return 0.0
+    k = max(0, min(len(sorted_vals) - 1, int(round(pct / 100.0 * (len(sorted_vals) - 1)))))
+    return sorted_vals[k]
+
+
+def pick_subjects(db):
+    """Choose realistic worst-case subjects: the biggest exam, its owner, the busiest student."""
+    from sqlalchemy import func
+    from models import Exam, Mark, User
+    exam_id, _ = (db.session.query(Mark.exam_id, func.count(Mark.id))
+                  .group_by(Mark.exam_id).order_by(func.count(Mark.id).desc()).first())
+    teacher_id = db.session.get(Exam, exam_id).created_by
+    teacher = db.session.get(User, teacher_id)
+    student_id, _ = (db.session.query(Mark.student_id, func.count(Mark.id))
+                     .group_by(Mark.student_id).order_by(func.count(Mark.id).desc()).first())
+    student = db.session.get(User, student_id)
+    return {'exam_id': exam_id, 'teacher_id': teacher_id, 'teacher_username': teacher.username,
+            'student_id': student_id, 'student_username': student.username}
+
+
+def run_queries(repeat):
+    """Time each query against the already-configured DATABASE_URL (runs in the child process)."""
+    from app import app
+    from metrics import snapshot, reset, _REQS, _SQL_STMTS
+    from models import db
+
+    with app.app_context():
+        subjects = pick_subjects(db)
+        counts = {t.name: db.session.execute(db.select(db.func.count()).select_from(t)).scalar()
+                  for t in db.metadata.sorted_tables}
+
+    def client(role, uid, name):
+        c = app.test_client()
+        with c.session_transaction() as s:
+            s[f'{role}_logged_in'] = True
+            s[f'{role}_id'] = uid
+            s[f'{role}_username'] = name
+            if role == 'admin':
+                s['admin_username'] = name
+        return c
+
+    admin = client('admin', None, 'admin')
+    teacher = client('teacher', subjects['teacher_id'], subjects['teacher_username'])
+    student = client('student', subjects['student_id'], subjects['student_username'])
+    queries = [
+        ('api_view_logs', admin, '/api/admin/logs'),
+        ('api_view_logs[cheating_only]', admin, '/api/admin/logs?cheating_only=1'),
+        ('api_view_logs[user_id]', admin, f'/api/admin/logs?user_id={subjects["student_id"]}'),
+        ('api_list_students', admin, '/api/admin/students'),
+        ('api_exam_marks_csv', teacher, f'/api/teacher/exam_marks_csv?exam_id={subjects["exam_id"]}'),
+        ('api_teacher_cheating_logs', teacher, '/api/teacher/cheating_logs'),
+        ('api_student_my_marks', student, '/api/student/my_marks'),
+    ]
+
+    results = {}
+    for label, c, url in queries:
+        c.get(url)  # warm caches so the first repeat is not an outlier
+        reset()
+        times = []
+        size = 0
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            resp = c.get(url)
+            times.append(time.perf_counter() - t0)
+            if resp.status_code != 200:
+                raise SystemExit(f'{label}: HTTP {resp.status_code}')
+            size = len(resp.get_data())
+        rows = snapshot()['endpoints'].values()
+        reqs = sum(r[_REQS] for r in rows) or 1
+        times.sort()
+        results[label] = {
+            'mean_ms': round(sum(times) / len(times) * 1000, 3),
+            'p50_ms': round(percentile(times, 50) * 1000, 3),
+            'max_ms': round(times[-1] * 1000, 3),
+            'sql_statements': round(sum(r[_SQL_STMTS] for r in rows) / reqs, 1),
+            'response_bytes': size,
+        }
+    return {'rows': counts, 'subjects': subjects, 'queries': results}
+
+
+def _child(args):
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SCHEDULER_ENABLED', '0')  # keep the dataset unchanged between runs
+    print(json.dumps(run_queries(args.repeat)))
+    return 0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--scales', default='tiny,small', help='comma-separated presets from generate_dataset.SCALES')
+    ap.add_argument('--database-url', default=None, help='benchmark this existing database instead of generating')
+    ap.add_argument('--data-dir', default=None, help='keep generated databases here and reuse them across runs')
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--out', default=None, help='write the JSON report here as well as stdout')
+    ap.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+    if args.child:
+        return _child(args)
+
+    from benchmarks.generate_dataset import SCALES
+    if args.database_url:
+        targets = [('custom', args.database_url)]
+    else:
+        import tempfile
+        data_dir = args.data_dir or tempfile.mkdtemp(prefix='query_suite_')
+        os.makedirs(data_dir, exist_ok=True)
+        targets = []
+        for scale in [s.strip() for s in args.scales.split(',') if s.strip()]:
+            if scale not in SCALES:
+                ap.error(f'unknown scale {scale!r}; choose from {", ".join(sorted(SCALES))}')
+            path = os.path.join(data_dir, f'{scale}.sqlite')
+            url = 'sqlite:///' + path
+            if not os.path.exists(path):
+                print(f'[{scale}] generating dataset', file=sys.stderr)
+                subprocess.run([sys.executable, '-m', 'benchmarks.generate_dataset', '--scale', scale,
+                                '--database-url', url], cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+            targets.append((scale, url))
+
+    # one process per database: the app binds its engine at import time
+    report = {'scenario': 'query_suite', 'python': platform.python_version(), 'repeat': args.repeat, 'scales': {}}
+    for scale, url in targets:
+        print(f'[{scale}] running queries', file=sys.stderr)
+        proc = subprocess.run([sys.executable, '-m', 'benchmarks.query_suite', '--child',
+                               '--database-url', url, '--repeat', str(args.repeat)],
+                              cwd=ROOT, check=True, capture_output=True, text=True)
+        report['scales'][scale] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""Time a bulk regrade after an answer key change.
+
+Run from the project root:
+
+    python -m benchmarks.regrade_bulk --submissions 20000 --questions 50 --flip 5
+
+A fresh database gets one exam with --questions questions and
+--submissions submitted attempts with marks (10% with one cheating
+incident, 2% with two). Then --flip questions get a new correct option and
+the exam is regraded with regrade.regrade_exam. Reported: load, compute and
+write time, marks changed, and for comparison the time to rescore the same
+submissions one at a time with grading.score_answers.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--submissions', type=int, default=20000)
+    ap.add_argument('--questions', type=int, default=50)
+    ap.add_argument('--flip', type=int, default=5, help='questions whose correct option changes')
+    ap.add_argument('--repeat', type=int, default=3, help='dry-run regrades timed after the real one')
+    args = ap.parse_args(argv)
+
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='regrade_'), 'r.sqlite'))
+    os.environ.setdefault('SCHEDULER_ENABLED', '0')
+    os.environ.setdefault('JOBS_ENABLED', '0')
+    from app import app
+    from grading import apply_cheating_penalty, score_answers
+    from models import Exam, ExamAttempt, Mark, Question, User, db
+    import exam_cache
+    import regrade
+    import shards
+
+    rnd = random.Random(7)
+    with app.app_context():
+        teacher = User(username='bench_teacher', password_hash='x', role='teacher')
+        db.session.add(teacher)
+        db.session.commit()
+        exam = Exam(title='Regrade bench', duration_minutes=60, created_by=teacher.id, is_published=True,
+                    num_questions=args.questions)
+        db.session.add(exam)
+        db.session.commit()
+        db.session.add_all(Question(exam_id=exam.id, text=f'Q{i}', option_a='a', option_b='b', option_c='c',
+                                    option_d='d', correct_option=rnd.choice('ABCD')) for i in range(args.questions))
+        db.session.commit()
+        key = exam_cache.load_bundle(exam.id).answer_key
+        n = args.submissions
+        db.session.execute(User.__table__.insert(),
+                           [{'username': f'bench_s{i}', 'password_hash': 'x', 'role': 'student'} for i in range(n)])
+        db.session.commit()
+        sids = db.session.execute(db.select(User.id).where(User.role == 'student').order_by(User.id)).scalars().all()
+        attempts, marks = [], []
+        for sid in sids:
+            answers = {f'q{q}': (key[q] if rnd.random() < 0.7 else rnd.choice('ABCD'))
+                       for q in key if rnd.random() < 0.95}
+            cheats = 2 if rnd.random() < 0.02 else (1 if rnd.random() < 0.1 else 0)
+            final, _ = apply_cheating_penalty(score_answers(answers, key), cheats)
+            attempts.append({'exam_id': exam.id, 'student_id': sid, 'answers': answers, 'cheating_count': cheats,
+                             'submitted_at': exam.created_at})
+            marks.append({'exam_id': exam.id, 'student_id': sid, 'marks': final, 'cheating_count': cheats,
+                          'graded_at': exam.created_at})
+        exam_id = exam.id
+        db.session.remove()
+        with shards.exam_db(exam_id) as conn:
+            conn.execute(ExamAttempt.__table__.insert(), attempts)
+            conn.execute(Mark.__table__.insert(), marks)
+
+        flipped = rnd.sample(sorted(key), min(args.flip, len(key)))
+        for qid in flipped:
+            q = db.session.get(Question, qid)
+            q.correct_option = 'ABCD'[('ABCD'.index(q.correct_option) + 1) % 4]
+        db.session.commit()
+        new_key = exam_cache.load_bundle(exam_id).answer_key
+
+        summary = regrade.regrade_exam(exam_id, new_key)
+        dry = [regrade.regrade_exam(exam_id, new_key, dry_run=True)['timings_ms'] for _ in range(args.repeat)]
+
+        t0 = time.perf_counter()
+        for a in attempts:
+            apply_cheating_penalty(score_answers(a['answers'], new_key), a['cheating_count'])
+        scalar_ms = (time.perf_counter() - t0) * 1000
+
+    report = {
+        'scenario': 'regrade_bulk',
+        'submissions': args.submissions,
+        'questions': args.questions,
+        'flipped_questions': len(flipped),
+        'changed': summary['changed'],
+        'written': summary['written'],
+        'regrade_ms': summary['timings_ms'],
+        'dry_run_ms': dry,
+        'scalar_score_answers_ms': round(scalar_ms, 1),
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
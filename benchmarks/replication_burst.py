@@ -0,0 +1,63 @@
+"""Write-burst benchmark for the replicated key-value store.
+
+Run from the project root:
+
+    python -m benchmarks.replication_burst --writes 10000 --lag 0.5
+
+The old implementation started one threading.Timer per write, so a burst of
+10k writes meant 10k threads. Here the thread count should stay at
+baseline + one applier per replica for the whole burst.
+"""
+import argparse
+import json
+import threading
+import time
+
+from replication import ReplicatedStore
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--writes', type=int, default=10000)
+    ap.add_argument('--replicas', type=int, default=3)
+    ap.add_argument('--lag', type=float, default=0.5)
+    ap.add_argument('--batch', type=int, default=500)
+    ap.add_argument('--keys', type=int, default=1000)
+    args = ap.parse_args(argv)
+
+    baseline_threads = threading.active_count()
+    store = ReplicatedStore(replicas=args.replicas, lag_seconds=args.lag, batch_size=args.batch).start()
+    peak_threads = threading.active_count()
+
+    t0 = time.perf_counter()
+    for i in range(args.writes):
+        store.write(f'k{i % args.keys}', i)
+        if i % 500 == 0:
+            peak_threads = max(peak_threads, threading.active_count())
+    write_secs = time.perf_counter() - t0
+    peak_threads = max(peak_threads, threading.active_count())
+
+    # wait for every replica to catch up
+    while store.stats()['max_lag_versions'] > 0:
+        peak_threads = max(peak_threads, threading.active_count())
+        time.sleep(0.01)
+    converge_secs = time.perf_counter() - t0
+    stats = store.stats()
+    store.stop()
+
+    out = {
+        'writes': args.writes,
+        'writes_per_sec': round(args.writes / write_secs, 1),
+        'seconds_until_all_replicas_caught_up': round(converge_secs, 3),
+        'threads_before': baseline_threads,
+        'threads_peak': peak_threads,
+        'threads_added': peak_threads - baseline_threads,
+        'replica_batches': [r['batches'] for r in stats['replicas']],
+        'log_entries_retained': stats['log_entries_retained'],
+    }
+    print(json.dumps(out, indent=2))
+    return out
+
+
+if __name__ == '__main__':
+    main()
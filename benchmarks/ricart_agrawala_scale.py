@@ -0,0 +1,48 @@
+"""Scaling benchmark for the Ricart–Agrawala discrete-event simulator.
+
+Run from the project root:
+
+    python -m benchmarks.ricart_agrawala_scale --nodes 50 500 5000 --requests 10
+
+Exact mode (one event per message) is only run up to --exact-max nodes.
+"""
+import argparse
+import json
+
+from ricart_agrawala import RicartAgrawalaSimulation
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--nodes', type=int, nargs='+', default=[50, 500, 5000])
+    ap.add_argument('--requests', type=int, default=10)
+    ap.add_argument('--latency-mean', type=float, default=1.0)
+    ap.add_argument('--exact-max', type=int, default=200)
+    ap.add_argument('--seed', type=int, default=1)
+    args = ap.parse_args(argv)
+
+    rows = []
+    for n in args.nodes:
+        modes = ['exact', 'coalesced'] if n <= args.exact_max else ['coalesced']
+        for mode in modes:
+            sim = RicartAgrawalaSimulation(nodes=n, requests_per_node=args.requests, seed=args.seed,
+                                           latency={'dist': 'exponential', 'mean': args.latency_mean},
+                                           coalesce=(mode == 'coalesced'))
+            s = sim.run_to_completion()
+            rows.append({
+                'nodes': n,
+                'mode': mode,
+                'cs_entries': s['cs_entries'],
+                'messages': s['messages']['total'],
+                'wall_seconds': s['wall_seconds'],
+                'events_per_sec': round(s['events_processed'] / s['wall_seconds'], 1) if s['wall_seconds'] else None,
+                'sync_delay_ms': s['sync_delay_ms']['mean'],
+                'response_time_ms': s['response_time_ms']['mean'],
+                'throughput_cs_per_sec': s['throughput_cs_per_sec'],
+            })
+    print(json.dumps(rows, indent=2))
+    return rows
+
+
+if __name__ == '__main__':
+    main()
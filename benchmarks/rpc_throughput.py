@@ -0,0 +1,96 @@
+"""Throughput benchmark for the in-process XML-RPC service.
+
+Run from the project root:
+
+    python -m benchmarks.rpc_throughput --calls 2000 --threads 4 --batch 50
+
+Reports calls/sec for: a fresh ServerProxy per call (the old route behaviour),
+pooled keep-alive proxies, and system.multicall batches.
+"""
+import argparse
+import json
+import threading
+import time
+import xmlrpc.client
+
+from rpc_service import RPCService, RPCClientPool
+
+
+def _run_threads(n_threads, target):
+    threads = [threading.Thread(target=target) for _ in range(n_threads)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - t0
+
+
+def bench_fresh_proxy(url, calls, n_threads):
+    per = calls // n_threads
+
+    def work():
+        for i in range(per):
+            xmlrpc.client.ServerProxy(url, allow_none=True).record_event({'i': i})
+    return per * n_threads, _run_threads(n_threads, work)
+
+
+def bench_pooled(url, calls, n_threads):
+    pool = RPCClientPool(url, size=n_threads)
+    per = calls // n_threads
+
+    def work():
+        for i in range(per):
+            with pool.proxy() as p:
+                p.record_event({'i': i})
+    elapsed = _run_threads(n_threads, work)
+    pool.close()
+    return per * n_threads, elapsed
+
+
+def bench_multicall(url, calls, n_threads, batch):
+    pool = RPCClientPool(url, size=n_threads)
+    per = calls // n_threads
+
+    def work():
+        done = 0
+        while done < per:
+            n = min(batch, per - done)
+            with pool.proxy() as p:
+                mc = xmlrpc.client.MultiCall(p)
+                for i in range(n):
+                    mc.record_event({'i': done + i})
+                list(mc())
+            done += n
+    elapsed = _run_threads(n_threads, work)
+    pool.close()
+    return per * n_threads, elapsed
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--calls', type=int, default=2000)
+    ap.add_argument('--threads', type=int, default=4)
+    ap.add_argument('--batch', type=int, default=50)
+    args = ap.parse_args(argv)
+
+    service = RPCService(port=0, buffer_size=max(args.calls, 1000), flush_interval=0).start()
+    url = f'http://{service.host}:{service.port}'
+    results = {}
+    try:
+        for name, fn in (
+            ('fresh_proxy', lambda: bench_fresh_proxy(url, args.calls, args.threads)),
+            ('pooled', lambda: bench_pooled(url, args.calls, args.threads)),
+            ('multicall', lambda: bench_multicall(url, args.calls, args.threads, args.batch)),
+        ):
+            n, elapsed = fn()
+            results[name] = {'calls': n, 'seconds': round(elapsed, 4), 'calls_per_sec': round(n / elapsed, 1)}
+        results['buffer'] = service.buffer.stats()
+    finally:
+        service.stop()
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == '__main__':
+    main()
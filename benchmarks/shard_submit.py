@@ -0,0 +1,164 @@
+"""Submit throughput with several exams running at once, with and without per-exam shards.
+
+Run from the project root:
+
+    python -m benchmarks.shard_submit --exams 1,2,4,8 --seconds 10
+
+For each layout (one database, then SHARDING_ENABLED=1) and each exam count
+N, a fresh database gets N published exams and a class of students per exam.
+N app processes are then started, one per exam, each submitting answers for
+its own exam as fast as it can through the Flask test client, all beginning
+at the same moment. Reported: total submits/sec, per-request p50/p99 and
+requests that failed (e.g. "database is locked"). Without shards every
+process queues on the main database's write lock, so throughput stays flat
+as N grows; with shards each exam writes its own file.
+
+By default each worker cycles through its class, so after the first round
+submits update marks. --fresh makes every submit a student's first (a new
+mark and attempt row); a worker stops early when its --students run out.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUESTIONS = 10
+
+
+def setup(exams, students):
+    from app import app
+    from models import Exam, Question, User, db
+    from werkzeug.security import generate_password_hash
+
+    with app.app_context():
+        pw = generate_password_hash('x')
+        teacher = User(username='bench_teacher', password_hash=pw, role='teacher')
+        db.session.add(teacher)
+        db.session.add_all(User(username=f'bench_s{i}', password_hash=pw, role='student')
+                           for i in range(exams * students))
+        db.session.commit()
+        for n in range(exams):
+            exam = Exam(title=f'Bench exam {n + 1}', duration_minutes=60, created_by=teacher.id,
+                        is_published=True, num_questions=QUESTIONS)
+            db.session.add(exam)
+            db.session.flush()
+            db.session.add_all(Question(exam_id=exam.id, text=f'Q{q}', option_a='a', option_b='b', option_c='c',
+                                        option_d='d', correct_option='ABCD'[q % 4], points=1)
+                               for q in range(QUESTIONS))
+        db.session.commit()
+
+
+def worker(index, students, seconds, start_at, fresh=False):
+    from app import app
+    from models import Exam, Question, User, db
+
+    with app.app_context():
+        exam_id = db.session.execute(db.select(Exam.id).order_by(Exam.id).offset(index).limit(1)).scalar()
+        qids = db.session.execute(db.select(Question.id).where(Question.exam_id == exam_id)).scalars().all()
+        sids = db.session.execute(db.select(User.id).where(User.role == 'student').order_by(User.id)
+                                  .offset(index * students).limit(students)).scalars().all()
+
+    def client(sid):
+        c = app.test_client()
+        with c.session_transaction() as s:
+            s['student_logged_in'] = True
+            s['student_id'] = sid
+            s['student_username'] = f'bench_{sid}'
+        return c
+    clients = None if fresh else [client(sid) for sid in sids]
+    rnd = random.Random(index)
+    latencies, errors = [], 0
+    time.sleep(max(0.0, start_at - time.time()))
+    started = time.time()
+    end = started + seconds
+    i = 0
+    while time.time() < end:
+        if fresh and i >= len(sids):
+            break
+        c = client(sids[i]) if fresh else clients[i % len(clients)]
+        i += 1
+        answers = {f'q{q}': rnd.choice('ABCD') for q in qids}
+        t0 = time.perf_counter()
+        try:
+            resp = c.post('/api/student/submit_exam', json={'exam_id': exam_id, 'answers': answers})
+            ok = resp.status_code == 200
+        except Exception:
+            ok = False
+        latencies.append(time.perf_counter() - t0)
+        errors += 0 if ok else 1
+    return {'submits': len(latencies) - errors, 'errors': errors, 'latencies': latencies,
+            'elapsed': time.time() - started}
+
+
+def _pct(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(sharded, exams, students, seconds, fresh=False):
+    base = tempfile.mkdtemp(prefix='shard_submit_')
+    env = dict(os.environ, SCHEDULER_ENABLED='0', JOBS_ENABLED='0',
+               SHARDING_ENABLED='1' if sharded else '0', SHARD_DIR=os.path.join(base, 'shards'),
+               DATABASE_URL='sqlite:///' + os.path.join(base, 'main.sqlite'))
+    me = [sys.executable, '-m', 'benchmarks.shard_submit']
+    subprocess.run(me + ['--setup', str(exams), '--students', str(students)], cwd=ROOT,
+                   env=dict(env, RPC_PORT='19100'), check=True, capture_output=True)
+    start_at = time.time() + 3.0 + 0.3 * exams  # every worker imports the app before the clock starts
+    procs = [subprocess.Popen(me + ['--worker', str(i), '--students', str(students), '--seconds', str(seconds),
+                                    '--start-at', repr(start_at)] + (['--fresh'] if fresh else []),
+                              cwd=ROOT, env=dict(env, RPC_PORT=str(19101 + i)), stdout=subprocess.PIPE, text=True)
+             for i in range(exams)]
+    results = []
+    for p in procs:
+        out, _ = p.communicate()
+        if p.returncode != 0:
+            raise SystemExit(f'worker failed with exit code {p.returncode}')
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    latencies = [x for r in results for x in r['latencies']]
+    submits = sum(r['submits'] for r in results)
+    elapsed = max(r['elapsed'] for r in results)
+    return {
+        'submits_per_sec': round(submits / elapsed, 1),
+        'submits': submits,
+        'errors': sum(r['errors'] for r in results),
+        'p50_ms': round(_pct(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p99_ms': round(_pct(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--exams', default='1,2,4,8', help='comma-separated numbers of concurrent exams')
+    ap.add_argument('--students', type=int, default=200, help='students per exam')
+    ap.add_argument('--seconds', type=float, default=10.0, help='length of each timed run')
+    ap.add_argument('--fresh', action='store_true', help="every submit is a student's first")
+    ap.add_argument('--setup', type=int, default=None, help=argparse.SUPPRESS)
+    ap.add_argument('--worker', type=int, default=None, help=argparse.SUPPRESS)
+    ap.add_argument('--start-at', type=float, default=0.0, help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+    if args.setup is not None:
+        setup(args.setup, args.students)
+        return 0
+    if args.worker is not None:
+        print(json.dumps(worker(args.worker, args.students, args.seconds, args.start_at, args.fresh)))
+        return 0
+
+    report = {'scenario': 'shard_submit', 'students_per_exam': args.students, 'seconds': args.seconds,
+              'fresh': args.fresh, 'unsharded': {}, 'sharded': {}}
+    for n in [int(x) for x in args.exams.split(',') if x.strip()]:
+        for label in ('unsharded', 'sharded'):
+            print(f'[{label}] {n} concurrent exams', file=sys.stderr)
+            report[label][f'{n}_exams'] = run(label == 'sharded', n, args.students, args.seconds, args.fresh)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
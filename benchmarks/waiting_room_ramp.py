@@ -0,0 +1,149 @@
+"""Database load around exam start, with and without the waiting room.
+
+Run from the project root:
+
+    python -m benchmarks.waiting_room_ramp --students 500 --rate 50
+    python -m benchmarks.waiting_room_ramp --students 500 --scenarios legacy,metered --bucket 0.25
+
+Every student opens the exam a little before start_at. For each scenario a
+fresh exam is created and the SQL statements the app issues are counted in
+time buckets relative to start_at:
+
+  legacy   no metering or jitter; clients ignore tickets and retry every
+           --poll-interval (the old tight-loop behaviour)
+  herd     no metering or jitter; clients wait for the release time on their ticket
+  metered  admission metered at --rate per second with --jitter; clients follow tickets
+
+A smooth ramp shows up as a low, flat peak_statements_per_second spread over
+students / rate seconds instead of one tall bucket at start_at.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+def run_scenario(app, name, student_ids, n_questions, lead, rate, jitter, follow_tickets, poll_interval, bucket):
+    import utils
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from models import Exam, Question, db
+    from waiting_room import WaitingRoom
+
+    with app.app_context():
+        exam = Exam(title=f'Ramp {name}', duration_minutes=60, created_by=None, is_published=True,
+                    num_questions=n_questions, start_at=datetime.now() + timedelta(seconds=lead))
+        db.session.add(exam)
+        db.session.commit()
+        db.session.execute(Question.__table__.insert(), [
+            {'exam_id': exam.id, 'text': f'Question {q}', 'option_a': 'a', 'option_b': 'b', 'option_c': 'c',
+             'option_d': 'd', 'correct_option': 'ABCD'[q % 4], 'points': 1.0}
+            for q in range(n_questions)])
+        db.session.commit()
+        exam_id, start_ts = exam.id, exam.start_at.timestamp()
+        utils._waiting_room = WaitingRoom(app.secret_key, rate=rate, jitter_seconds=jitter)
+
+    stamps = []
+    lock = threading.Lock()
+
+    def on_execute(*a):
+        t = time.time()
+        with lock:
+            stamps.append(t)
+    event.listen(Engine, 'before_cursor_execute', on_execute)
+
+    admitted_at = []
+    requests_sent = [0]
+
+    def student(sid):
+        c = app.test_client()
+        with c.session_transaction() as s:
+            s['student_logged_in'] = True
+            s['student_id'] = sid
+            s['student_username'] = f'ramp_{sid}'
+        ticket = None
+        while True:
+            url = f'/api/student/exam/{exam_id}' + (f'?ticket={ticket}' if ticket else '')
+            resp = c.get(url)
+            body = resp.get_json(silent=True) or {}
+            with lock:
+                requests_sent[0] += 1
+            if resp.status_code == 200:
+                with lock:
+                    admitted_at.append(time.time())
+                return
+            if follow_tickets and body.get('ticket'):
+                ticket = body['ticket']
+                time.sleep(body['retry_after_ms'] / 1000.0)
+            else:
+                time.sleep(poll_interval)
+
+    threads = [threading.Thread(target=student, args=(sid,), daemon=True) for sid in student_ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    event.remove(Engine, 'before_cursor_execute', on_execute)
+
+    buckets = {}
+    for t in stamps:
+        k = int((t - start_ts) // bucket)
+        buckets[k] = buckets.get(k, 0) + 1
+    after = {k: v for k, v in buckets.items() if k >= 0}
+    peak = max(after.values()) if after else 0
+    admitted_at.sort()
+    return {
+        'rate_per_second': rate,
+        'jitter_seconds': jitter,
+        'follow_tickets': follow_tickets,
+        'http_requests': requests_sent[0],
+        'sql_statements': len(stamps),
+        'sql_statements_before_start': sum(v for k, v in buckets.items() if k < 0),
+        'peak_statements_per_bucket': peak,
+        'peak_statements_per_second': round(peak / bucket, 1),
+        'admission_spread_seconds': round(admitted_at[-1] - admitted_at[0], 3) if admitted_at else None,
+        'last_admitted_after_start_seconds': round(admitted_at[-1] - start_ts, 3) if admitted_at else None,
+        'timeline': {f'{k * bucket:+.2f}s': buckets[k] for k in sorted(buckets)},
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--students', type=int, default=300)
+    ap.add_argument('--questions', type=int, default=20)
+    ap.add_argument('--lead', type=float, default=2.0, help='seconds between opening the exam and start_at')
+    ap.add_argument('--rate', type=float, default=50.0, help='admissions per second in the metered scenario')
+    ap.add_argument('--jitter', type=float, default=1.0)
+    ap.add_argument('--poll-interval', type=float, default=0.1, help='retry interval for the legacy clients')
+    ap.add_argument('--bucket', type=float, default=0.5, help='timeline bucket width in seconds')
+    ap.add_argument('--scenarios', default='legacy,herd,metered')
+    args = ap.parse_args(argv)
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='waiting_room_'), 'ramp.sqlite')
+    from app import app
+    from models import User, db
+    with app.app_context():
+        db.session.execute(User.__table__.insert(), [
+            {'username': f'ramp_{i}', 'password_hash': '-', 'role': 'student'} for i in range(args.students)])
+        db.session.commit()
+        student_ids = [u.id for u in User.query.filter_by(role='student').all()]
+
+    presets = {
+        'legacy': (0.0, 0.0, False),
+        'herd': (0.0, 0.0, True),
+        'metered': (args.rate, args.jitter, True),
+    }
+    report = {'students': args.students, 'bucket_seconds': args.bucket, 'scenarios': {}}
+    for name in [s.strip() for s in args.scenarios.split(',') if s.strip()]:
+        rate, jitter, follow = presets[name]
+        report['scenarios'][name] = run_scenario(app, name, student_ids, args.questions, args.lead, rate, jitter,
+                                                 follow, args.poll_interval, args.bucket)
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    main()
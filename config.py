@@ -19,20 +19,106 @@ class Config:
     
     SECRET_KEY = os.getenv('FLASK_SECRET', 'dev-secret-please-change')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Requests slower than this are logged with their SQL statements (0 disables)
+    SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '500'))
+
+    # App factory (see create_app in app.py). APP_SERVICES names the side services
+    # this process owns: 'rpc', 'scheduler', 'jobs' (comma-separated), 'all' or 'none'.
+    # The default 'none' keeps `import app` (web workers, benchmarks, job
+    # processes) free of side services; `python app.py` starts them all and a
+    # multi-process deployment runs one `flask --app app run-services`.
+    APP_SERVICES = os.getenv('APP_SERVICES', 'none')
+    DB_INIT_ON_START = os.getenv('DB_INIT_ON_START', '1').lower() in ('1', 'true', 'yes')  # schema check/migrations at boot
+    # WAL on a file-based SQLite main database: readers (the online backup too) never block writers
+    SQLITE_WAL = os.getenv('SQLITE_WAL', '1').lower() in ('1', 'true', 'yes')
+    # Scheduler/job events reach monitor streams in other processes through the monitor_events table
+    MONITOR_RELAY_POLL_SECONDS = float(os.getenv('MONITOR_RELAY_POLL_SECONDS', '1.0'))
+    MONITOR_RELAY_KEEP = int(os.getenv('MONITOR_RELAY_KEEP', '1000'))  # newest rows kept
+
+    # In-process XML-RPC service (see rpc_service.py)
+    RPC_HOST = os.getenv('RPC_HOST', '127.0.0.1')
+    RPC_PORT = int(os.getenv('RPC_PORT', '9000'))
+    RPC_EVENT_BUFFER_SIZE = int(os.getenv('RPC_EVENT_BUFFER_SIZE', '10000'))  # ring buffer capacity
+    RPC_FLUSH_INTERVAL = float(os.getenv('RPC_FLUSH_INTERVAL', '2.0'))  # seconds between DB flushes
+    RPC_POOL_SIZE = int(os.getenv('RPC_POOL_SIZE', '8'))  # pooled client connections per process
+
+    # lb_process dispatcher (see dispatcher.py): 'name:priority:weight,...'
+    LB_POOL = os.getenv('LB_POOL', 'primary:0:1,backup:1:1')
+    LB_STRATEGY = os.getenv('LB_STRATEGY', 'least_loaded')  # or 'weighted'
+    LB_BREAKER_WINDOW = int(os.getenv('LB_BREAKER_WINDOW', '20'))
+    LB_BREAKER_MIN_CALLS = int(os.getenv('LB_BREAKER_MIN_CALLS', '10'))  # outcomes needed before the error rate counts (capped at the window)
+    LB_BREAKER_ERROR_RATE = float(os.getenv('LB_BREAKER_ERROR_RATE', '0.3'))
+    LB_BREAKER_RESET_SECONDS = float(os.getenv('LB_BREAKER_RESET_SECONDS', '5'))
+
+    # Replicated key-value demo (see replication.py)
+    REPLICA_COUNT = int(os.getenv('REPLICA_COUNT', '3'))
+    REPLICA_LAG_SECONDS = float(os.getenv('REPLICA_LAG_SECONDS', '2'))
+    REPLICA_BATCH_SIZE = int(os.getenv('REPLICA_BATCH_SIZE', '500'))
+
+    # Ricart–Agrawala simulator: cap on nodes * requests_per_node per API call (exact mode: entries * nodes)
+    RA_MAX_CS_ENTRIES = int(os.getenv('RA_MAX_CS_ENTRIES', '1000000'))
+
+    # Exam start waiting room (see waiting_room.py); the rate is per app process, 0 = no metering
+    WAITING_ROOM_RATE = float(os.getenv('WAITING_ROOM_RATE', '50'))  # admissions per second
+    WAITING_ROOM_JITTER_SECONDS = float(os.getenv('WAITING_ROOM_JITTER_SECONDS', '1.0'))
+    WAITING_ROOM_SCHEDULE_TTL = float(os.getenv('WAITING_ROOM_SCHEDULE_TTL', '5'))  # seconds start_at is cached
+
+    # Exam lifecycle scheduler (see scheduler.py) and the exam payload cache it warms
+    SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    SCHEDULER_PREWARM_SECONDS = float(os.getenv('SCHEDULER_PREWARM_SECONDS', '300'))
+    SCHEDULER_LEASE_SECONDS = float(os.getenv('SCHEDULER_LEASE_SECONDS', '30'))  # leader lease across workers
+    SCHEDULER_RESYNC_SECONDS = float(os.getenv('SCHEDULER_RESYNC_SECONDS', '60'))
+    SCHEDULER_CATCHUP_HOURS = float(os.getenv('SCHEDULER_CATCHUP_HOURS', '24'))  # finalize exams that closed while down
+    # opt-in: 'zero' or 'null' gives every student account without a mark one at close ('none': only real attempts)
+    EXAM_ABSENT_MARKS = os.getenv('EXAM_ABSENT_MARKS', 'none')
+    EXAM_CACHE_TTL = float(os.getenv('EXAM_CACHE_TTL', '300'))
+
+    # Admin user directory paging
+    USER_PAGE_SIZE = int(os.getenv('USER_PAGE_SIZE', '50'))
+    USER_PAGE_MAX = int(os.getenv('USER_PAGE_MAX', '500'))
+    USER_COUNT_TTL = float(os.getenv('USER_COUNT_TTL', '60'))  # seconds a per-role total is cached
+
+    # Gradebook / marks CSV export (see gradebook.py)
+    EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '5000'))  # rows per database read while streaming
+    EXPORT_MAX_EXAMS = int(os.getenv('EXPORT_MAX_EXAMS', '500'))  # exams per gradebook export
+
+    # Background jobs (see jobs.py)
+    JOBS_ENABLED = os.getenv('JOBS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))  # concurrent jobs per app process
+    JOB_WORKER_MODE = os.getenv('JOB_WORKER_MODE', 'thread')  # 'thread' or 'process'
+    JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', '1.0'))
+    JOB_ARTIFACT_DIR = os.getenv('JOB_ARTIFACT_DIR', os.path.join(os.path.dirname(__file__), 'job_artifacts'))
+    JOB_ARTIFACT_TTL = float(os.getenv('JOB_ARTIFACT_TTL', '86400'))  # seconds a finished download is kept
+    JOB_STALE_SECONDS = float(os.getenv('JOB_STALE_SECONDS', '60'))  # running job with no heartbeat -> failed
+    JOB_INLINE_MAX_ROWS = int(os.getenv('JOB_INLINE_MAX_ROWS', '50000'))  # bigger marks exports become jobs
+
+    # Per-exam shards for marks, attempts and exam logs (SQLite only; see shards.py)
+    SHARDING_ENABLED = os.getenv('SHARDING_ENABLED', '0').lower() in ('1', 'true', 'yes')
+    SHARD_DIR = os.getenv('SHARD_DIR', os.path.join(os.path.dirname(__file__), 'shards'))
+    SHARD_MAX_OPEN = int(os.getenv('SHARD_MAX_OPEN', '64'))  # shard engines kept open per process
+
+    # Online backups (SQLite backup API; see backup.py)
+    BACKUP_DIR = os.getenv('BACKUP_DIR', os.path.join(os.path.dirname(__file__), 'backups'))
+    BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))  # snapshots retained
+    BACKUP_INTERVAL_HOURS = float(os.getenv('BACKUP_INTERVAL_HOURS', '0'))  # 0: only on demand
+    BACKUP_STEP_PAGES = int(os.getenv('BACKUP_STEP_PAGES', '256'))  # pages copied per step (-1: one pass)
+    BACKUP_STEP_SLEEP = float(os.getenv('BACKUP_STEP_SLEEP', '0.01'))  # seconds writers get between steps
+    BACKUP_MAX_RESTARTS = int(os.getenv('BACKUP_MAX_RESTARTS', '3'))  # then finish in one pass
     
-    @staticmethod
-    def get_database_uri():
+    @classmethod
+    def get_database_uri(cls):
         """Build and return the database URI"""
-        if Config.DATABASE_URL:
+        if cls.DATABASE_URL:
             # If user provided a full DATABASE_URL (e.g., for production), use it directly.
-            return Config.DATABASE_URL
+            return cls.DATABASE_URL
         else:
-            if Config.DB_DIALECT.lower() == 'mysql':
+            if cls.DB_DIALECT.lower() == 'mysql':
                 # use pymysql (install pymysql if you choose mysql)
-                return f'mysql+pymysql://{Config.DB_USER}:{Config.DB_PASS}@{Config.DB_HOST}:{Config.DB_PORT}/{Config.DB_NAME}'
-            elif Config.DB_DIALECT.lower() in ('postgres', 'postgresql'):
+                return f'mysql+pymysql://{cls.DB_USER}:{cls.DB_PASS}@{cls.DB_HOST}:{cls.DB_PORT}/{cls.DB_NAME}'
+            elif cls.DB_DIALECT.lower() in ('postgres', 'postgresql'):
                 # postgres
-                return f'postgresql+psycopg2://{Config.DB_USER}:{Config.DB_PASS}@{Config.DB_HOST}:{Config.DB_PORT}/{Config.DB_NAME}'
+                return f'postgresql+psycopg2://{cls.DB_USER}:{cls.DB_PASS}@{cls.DB_HOST}:{cls.DB_PORT}/{cls.DB_NAME}'
             else:
                 # default: lightweight file-based SQLite database in project folder
                 db_path = os.path.join(os.path.dirname(__file__), 'data.sqlite')
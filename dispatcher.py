@@ -0,0 +1,227 @@
+import random
+import threading
+import time
+from collections import deque
+
+# ===== Health-checked dispatcher =====
+# Routes a call across a pool of backends grouped into priority tiers (e.g. a
+# primary tier and a backup tier). Each backend has a circuit breaker fed by a
+# rolling window of outcomes, so a failing primary stops receiving traffic
+# after a bounded number of requests instead of failing half of them forever.
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class NoBackendAvailable(RuntimeError):
+    pass
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over the last `window` calls.
+
+    The breaker opens once at least `min_calls` outcomes are in the window and
+    the error rate reaches `error_threshold`, or after `max_consecutive_failures`
+    failures in a row. With the defaults a backend that fails every call is
+    cut off after 5 requests and any backend failing at >= 30% is cut off
+    within `window` requests. After `reset_timeout` seconds it lets up to
+    `half_open_max_calls` probes through; one success closes it again.
+    """
+
+    def __init__(self, window=20, min_calls=10, error_threshold=0.3, max_consecutive_failures=5,
+                 reset_timeout=5.0, half_open_max_calls=1, clock=time.monotonic):
+        self.window = window
+        self.min_calls = min(min_calls, window)  # a window smaller than min_calls could never trip
+        self.error_threshold = error_threshold
+        self.max_consecutive_failures = max_consecutive_failures
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self.state = CLOSED
+        self.opened_at = None
+        self.consecutive_failures = 0
+        self._outcomes = deque(maxlen=window)  # True = failure
+        self._failures = 0
+        self._half_open_inflight = 0
+        self.times_opened = 0
+
+    def _record(self, failed):
+        if len(self._outcomes) == self._outcomes.maxlen and self._outcomes[0]:
+            self._failures -= 1
+        self._outcomes.append(failed)
+        if failed:
+            self._failures += 1
+
+    def error_rate(self):
+        return self._failures / len(self._outcomes) if self._outcomes else 0.0
+
+    def allow(self):
+        """Return True if a call may be attempted now (reserves a half-open probe slot)."""
+        if self.state == OPEN:
+            if self._clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+            self._half_open_inflight = 0
+        if self.state == HALF_OPEN:
+            if self._half_open_inflight >= self.half_open_max_calls:
+                return False
+            self._half_open_inflight += 1
+        return True
+
+    def on_success(self):
+        self.consecutive_failures = 0
+        if self.state == HALF_OPEN:
+            # probe succeeded: start over with a clean window
+            self.state = CLOSED
+            self._outcomes.clear()
+            self._failures = 0
+            return
+        self._record(False)
+
+    def on_failure(self):
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            self._trip()
+            return
+        self._record(True)
+        if self.consecutive_failures >= self.max_consecutive_failures or (
+                len(self._outcomes) >= self.min_calls and self.error_rate() >= self.error_threshold):
+            self._trip()
+
+    def _trip(self):
+        self.state = OPEN
+        self.opened_at = self._clock()
+        self.times_opened += 1
+
+class Backend:
+    """A named worker plus its breaker, load and rolling latency window."""
+
+    def __init__(self, name, fn, priority=0, weight=1.0, latency_window=100, breaker=None):
+        self.name = name
+        self.fn = fn
+        self.priority = priority
+        self.weight = float(weight)
+        self.breaker = breaker or CircuitBreaker()
+        self.in_flight = 0
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self._latencies = deque(maxlen=latency_window)
+
+    def mean_latency(self):
+        return sum(self._latencies) / len(self._latencies) if self._latencies else 0.0
+
+    def stats(self):
+        lat = sorted(self._latencies)
+
+        def pct(p):
+            return round(lat[min(len(lat) - 1, int(p * len(lat)))] * 1000, 3) if lat else None
+        return {
+            'name': self.name,
+            'priority': self.priority,
+            'weight': self.weight,
+            'state': self.breaker.state,
+            'times_opened': self.breaker.times_opened,
+            'in_flight': self.in_flight,
+            'calls': self.calls,
+            'successes': self.successes,
+            'failures': self.failures,
+            'rejected_by_breaker': self.rejected,
+            'window_error_rate': round(self.breaker.error_rate(), 4),
+            'window_mean_ms': round(self.mean_latency() * 1000, 3),
+            'window_p50_ms': pct(0.50),
+            'window_p95_ms': pct(0.95),
+        }
+
+class Dispatcher:
+    """Try backends tier by tier (lowest priority number first).
+
+    Inside a tier the backend is picked by `strategy`: 'weighted' (random,
+    proportional to weight) or 'least_loaded' (fewest in-flight calls per unit
+    of weight, ties broken by rolling mean latency). A failed call falls
+    through to the next candidate; only backends whose breaker allows traffic
+    are considered.
+    """
+
+    def __init__(self, backends, strategy='least_loaded', rng=None):
+        if strategy not in ('weighted', 'least_loaded'):
+            raise ValueError(f'unknown strategy: {strategy}')
+        self.backends = list(backends)
+        self.strategy = strategy
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def _order_tier(self, tier):
+        if self.strategy == 'least_loaded':
+            return sorted(tier, key=lambda b: (b.in_flight / (b.weight or 1e-9), b.mean_latency()))
+        # weighted random ordering without replacement
+        pool, out = list(tier), []
+        while pool:
+            total = sum(b.weight for b in pool)
+            r = self._rng.random() * total
+            for i, b in enumerate(pool):
+                r -= b.weight
+                if r <= 0 or i == len(pool) - 1:
+                    out.append(pool.pop(i))
+                    break
+        return out
+
+    def _candidates(self):
+        tiers = {}
+        for b in self.backends:
+            tiers.setdefault(b.priority, []).append(b)
+        for prio in sorted(tiers):
+            yield from self._order_tier(tiers[prio])
+
+    def dispatch(self, payload):
+        """Run payload on the first healthy backend that succeeds.
+
+        Returns (backend_name, result, errors) where errors maps each backend
+        that was tried and failed to its error string.
+        """
+        errors = {}
+        for b in self._candidates():
+            with self._lock:
+                if not b.breaker.allow():
+                    b.rejected += 1
+                    continue
+                b.in_flight += 1
+                b.calls += 1
+            t0 = time.perf_counter()
+            try:
+                out = b.fn(payload)
+            except Exception as e:
+                elapsed = time.perf_counter() - t0
+                with self._lock:
+                    b.in_flight -= 1
+                    b.failures += 1
+                    b._latencies.append(elapsed)
+                    b.breaker.on_failure()
+                errors[b.name] = str(e)
+                continue
+            elapsed = time.perf_counter() - t0
+            with self._lock:
+                b.in_flight -= 1
+                b.successes += 1
+                b._latencies.append(elapsed)
+                b.breaker.on_success()
+            return b.name, out, errors
+        raise NoBackendAvailable(errors or 'all_backends_open')
+
+    def stats(self):
+        with self._lock:
+            return {'strategy': self.strategy, 'backends': [b.stats() for b in self.backends]}
+
+def parse_pool_spec(spec):
+    """Parse 'name:priority:weight,...' (priority and weight optional) into tuples."""
+    out = []
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        bits = part.split(':')
+        name = bits[0].strip()
+        priority = int(bits[1]) if len(bits) > 1 and bits[1] else 0
+        weight = float(bits[2]) if len(bits) > 2 and bits[2] else 1.0
+        out.append((name, priority, weight))
+    return out
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from models import Exam, Question, db
+
+# ===== Exam payload / answer key cache =====
+# The question list students download and the answer key submit_exam grades
+# against are built once per exam and kept in process memory. The scheduler
+# warms them shortly before start_at; teacher edits invalidate them. A bundle
+# records exams.updated_at as its version; callers that already hold the exam
+# row pass it, so an edit made in another process is picked up at once.
+# Entries also expire after `ttl` seconds.
+
+class ExamBundle:
+    __slots__ = ('exam_id', 'questions', 'answer_key', 'loaded_at', 'version')
+
+    def __init__(self, exam_id, questions, answer_key, loaded_at, version=None):
+        self.exam_id = exam_id
+        self.questions = questions    # list of question dicts as served to students
+        self.answer_key = answer_key  # question id -> correct option
+        self.loaded_at = loaded_at
+        self.version = version        # exams.updated_at when loaded
+
+_bundles = {}
+_lock = threading.Lock()
+_ttl = 300.0
+
+def configure(ttl):
+    global _ttl
+    _ttl = float(ttl)
+
+def load_bundle(exam_id):
+    """Build the bundle from the database, bypassing the cache."""
+    # version read first: an edit landing between the two queries only makes the bundle look stale
+    version = db.session.execute(db.select(Exam.updated_at).where(Exam.id == exam_id)).scalar()
+    qlist, key = [], {}
+    for q in Question.query.filter_by(exam_id=exam_id).order_by(Question.created_at.asc()).all():
+        qlist.append({
+            'id': q.id,
+            'text': q.text,
+            'options': {
+                'A': q.option_a,
+                'B': q.option_b,
+                'C': q.option_c,
+                'D': q.option_d
+            },
+            'points': q.points,
+            'time_seconds': q.time_seconds
+        })
+        key[q.id] = q.correct_option
+    return ExamBundle(exam_id, qlist, key, time.monotonic(), version)
+
+_ANY = object()
+
+def get_bundle(exam_id, version=_ANY):
+    """Cached bundle; reloaded when older than the TTL or, if given, when its version differs from `version`."""
+    with _lock:
+        b = _bundles.get(exam_id)
+    if b is not None and time.monotonic() - b.loaded_at < _ttl and (version is _ANY or b.version == version):
+        return b
+    b = load_bundle(exam_id)
+    with _lock:
+        _bundles[exam_id] = b
+    return b
+
+def warm(exam_id):
+    b = load_bundle(exam_id)
+    with _lock:
+        _bundles[exam_id] = b
+    return b
+
+def invalidate(exam_id):
+    with _lock:
+        _bundles.pop(exam_id, None)
+
+def cached_exam_ids():
+    with _lock:
+        return sorted(_bundles)
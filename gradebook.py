@@ -0,0 +1,230 @@
+import csv
+import io
+import zipfile
+import zlib
+
+from flask import Response, jsonify, request, stream_with_context
+from sqlalchemy import select, tuple_
+
+from config import Config
+from models import Exam, Mark, User, db
+import shards
+
+# ===== Gradebook export =====
+# Marks are read in keyset chunks (EXPORT_CHUNK_ROWS rows per query, each its
+# own short read so writers are never blocked while a slow client drains the
+# response) and turned into bytes as they arrive; the encoders below compress
+# incrementally, so memory stays bounded by one chunk whatever the export size.
+# Everything here is a generator meant to be wrapped in stream_with_context.
+
+
+def _csv_encoder():
+    buf = io.StringIO()
+    w = csv.writer(buf)
+
+    def encode(rows):
+        for r in rows:
+            w.writerow(r)
+        out = buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+        return out
+    return encode
+
+def exam_columns(exam_ids):
+    """(id, title) for each existing exam in exam_ids, in the order given."""
+    rows = dict(db.session.execute(select(Exam.id, Exam.title).where(Exam.id.in_(exam_ids))).all())
+    return [(eid, rows[eid]) for eid in exam_ids if eid in rows]
+
+EXAM_HEADER = ['student_id', 'student_username', 'marks', 'graded_at']
+
+def exam_rows(exam_id, chunk_rows):
+    """Yield lists of (student_id, username, marks, graded_at) for one exam, ordered by student."""
+    stmt = (select(Mark.student_id, Mark.id, User.username, Mark.marks, Mark.graded_at)
+            .outerjoin(User, User.id == Mark.student_id)
+            .where(Mark.exam_id == exam_id)
+            .order_by(Mark.student_id, Mark.id)
+            .limit(chunk_rows))
+    last = None
+    while True:
+        q = stmt if last is None else stmt.where(tuple_(Mark.student_id, Mark.id) > tuple_(*last))
+        with shards.exam_db(exam_id) as conn:  # a short read per chunk; users resolves to core from a shard
+            rows = conn.execute(q).all()
+        if not rows:
+            return
+        last = (rows[-1][0], rows[-1][1])
+        yield [(sid, name or '', '' if marks is None else marks, graded.isoformat() if graded else '')
+               for sid, _, name, marks, graded in rows]
+        if len(rows) < chunk_rows:
+            return
+
+def exam_csv(exam_id, chunk_rows, progress=None):
+    """Single-exam CSV (the api_exam_marks_csv format) as a stream of byte chunks.
+
+    progress, if given, is called with the number of rows in each chunk.
+    """
+    encode = _csv_encoder()
+    yield encode([EXAM_HEADER])
+    for rows in exam_rows(exam_id, chunk_rows):
+        if progress:
+            progress(len(rows))
+        yield encode(rows)
+
+def wide_rows(exams, chunk_rows, include_empty=False):
+    """Yield lists of gradebook rows: student id, username, then one mark per exam in `exams`.
+
+    Students are walked in id order, about chunk_rows marks' worth at a time,
+    and the marks of each block are fetched with one range query. A student
+    with several marks for the same exam shows the latest one.
+    """
+    exam_ids = [eid for eid, _ in exams]
+    col = {eid: i for i, eid in enumerate(exam_ids)}
+    per_chunk = max(1, chunk_rows // max(1, len(exam_ids)))
+    students = (select(User.id, User.username).where(User.role == 'student')
+                .order_by(User.id).limit(per_chunk))
+    last_id = 0
+    while True:
+        # Core execution on the session's connection: no ORM row processing
+        conn = db.session.connection()
+        chunk = conn.execute(students.where(User.id > last_id)).all()
+        if not chunk:
+            db.session.rollback()
+            return
+        lo, hi = chunk[0][0], chunk[-1][0]
+        grid = {}
+        for sid, eid, m in shards.marks_in_range(exam_ids, lo, hi):
+            row = grid.get(sid)
+            if row is None:
+                row = grid[sid] = [''] * len(exam_ids)
+            row[col[eid]] = '' if m is None else m
+        db.session.rollback()
+        out = []
+        for sid, name in chunk:
+            row = grid.get(sid)
+            if row is None:
+                if not include_empty:
+                    continue
+                row = [''] * len(exam_ids)
+            out.append([sid, name] + row)
+        last_id = hi
+        if out:
+            yield out
+        if len(chunk) < per_chunk:
+            return
+
+def wide_csv(exams, chunk_rows, include_empty=False, progress=None):
+    """progress, if given, is called with the number of marks cells in each chunk."""
+    encode = _csv_encoder()
+    yield encode([['student_id', 'student_username'] + [f'{title} [#{eid}]' for eid, title in exams]])
+    for rows in wide_rows(exams, chunk_rows, include_empty):
+        if progress:
+            progress(sum(1 for r in rows for v in r[2:] if v != ''))
+        yield encode(rows)
+
+def gzip_stream(chunks, level=6):
+    """Gzip a byte stream incrementally (one compressor, flushed only at the end)."""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+class _Sink:
+    # write-only, unseekable file object: zipfile then emits data descriptors
+    # after each member so nothing has to be rewritten once streamed
+    def __init__(self):
+        self.parts = []
+
+    def write(self, b):
+        self.parts.append(bytes(b))
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        out = b''.join(self.parts)
+        self.parts = []
+        return out
+
+def zip_stream(exams, chunk_rows, level=6, progress=None):
+    """A zip archive with one marks CSV per exam, compressed and emitted as it is read."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=level) as zf:
+        for eid, _ in exams:
+            with zf.open(f'exam_{eid}_marks.csv', 'w', force_zip64=True) as member:
+                for chunk in exam_csv(eid, chunk_rows, progress):
+                    member.write(chunk)
+                    out = sink.drain()
+                    if out:
+                        yield out
+            yield sink.drain()
+    yield sink.drain()
+
+def parse_exam_ids(raw):
+    """'3,5,8' -> [3, 5, 8]; raises ValueError on anything else."""
+    ids = []
+    for part in (raw or '').split(','):
+        part = part.strip()
+        if part:
+            ids.append(int(part))
+    return list(dict.fromkeys(ids))
+
+def export_response(exams, fmt, compress, include_empty, name):
+    """Streaming Response for a gradebook export of `exams` ([(id, title), ...])."""
+    chunk_rows = Config.EXPORT_CHUNK_ROWS
+    if fmt == 'zip':
+        body, mimetype, filename = zip_stream(exams, chunk_rows), 'application/zip', f'{name}.zip'
+    elif compress:
+        body, mimetype, filename = gzip_stream(wide_csv(exams, chunk_rows, include_empty)), 'application/gzip', f'{name}.csv.gz'
+    else:
+        body, mimetype, filename = wide_csv(exams, chunk_rows, include_empty), 'text/csv', f'{name}.csv'
+    resp = Response(stream_with_context(body), mimetype=mimetype)
+    resp.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    resp.headers['X-Accel-Buffering'] = 'no'  # let proxies pass chunks through
+    return resp
+
+def export_from_request(owner_id=None):
+    """Validate the gradebook query string and build the export.
+
+    exam_ids=1,2,3 (default: every exam, or every exam owned by owner_id),
+    format=wide|zip, compress=0 for a plain wide CSV, include_empty=1 to list
+    students with no marks in the selection. Returns (response, meta for the log)
+    or (error response, status); big exports come back as (job handle, 202).
+    """
+    try:
+        exam_ids = parse_exam_ids(request.args.get('exam_ids'))
+    except ValueError:
+        return jsonify({'ok': False, 'msg': 'bad_exam_ids'}), 400
+    fmt = request.args.get('format', 'wide')
+    if fmt not in ('wide', 'zip'):
+        return jsonify({'ok': False, 'msg': 'bad_format'}), 400
+    q = select(Exam.id, Exam.title)
+    if owner_id is not None:
+        q = q.where(Exam.created_by == owner_id)
+    if exam_ids:
+        found = dict(db.session.execute(q.where(Exam.id.in_(exam_ids))).all())
+        missing = [eid for eid in exam_ids if eid not in found]
+        if missing:
+            return jsonify({'ok': False, 'msg': 'exam_not_found', 'exam_ids': missing}), 404
+        exams = [(eid, found[eid]) for eid in exam_ids]
+    else:
+        exams = db.session.execute(q.order_by(Exam.id)).all()
+    if not exams:
+        return jsonify({'ok': False, 'msg': 'no_exams'}), 404
+    limit = Config.EXPORT_MAX_EXAMS
+    if len(exams) > limit:
+        return jsonify({'ok': False, 'msg': 'too_many_exams', 'max_exams': limit}), 400
+    compress = request.args.get('compress', '1') not in ('0', 'false', 'no')
+    include_empty = request.args.get('include_empty') in ('1', 'true', 'yes')
+    from job_routes import job_handle, should_defer, submit_job
+    rows = shards.count_marks([eid for eid, _ in exams])
+    if should_defer(rows):
+        # too big to build inside this request: hand it to the job runner
+        job = submit_job('gradebook', {'exam_ids': [eid for eid, _ in exams], 'format': fmt, 'compress': compress,
+                                       'include_empty': include_empty, 'owner_id': owner_id})
+        return job_handle(job)
+    name = f'exam_{exams[0][0]}_gradebook' if len(exams) == 1 else f'gradebook_{len(exams)}_exams'
+    resp = export_response(exams, fmt, compress, include_empty, name)
+    return resp, {'exam_ids': [eid for eid, _ in exams], 'format': fmt}
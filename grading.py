@@ -0,0 +1,37 @@
+# ===== Grading rules =====
+# Shared by submit_exam, the close-of-exam finalizer and regrades so every
+# path scores answers and applies cheating penalties the same way.
+
+def question_id(key):
+    """Answer keys arrive as 'q<id>' from the exam form, or as bare ids; return the int id or None."""
+    key_str = str(key)
+    if key_str.startswith('q'):
+        key_str = key_str[1:]
+    try:
+        return int(key_str)
+    except Exception:
+        return None
+
+def score_answers(answers, answer_key):
+    """One mark per correct answer. `answer_key` maps question id -> correct option."""
+    score = 0
+    for k, ans in (answers or {}).items():
+        qid = question_id(k)
+        correct = answer_key.get(qid) if qid is not None else None
+        if correct is None:
+            continue
+        # Normalize student's selected option and correct option to uppercase single letters
+        if (ans or '').strip().upper() == (correct or '').strip().upper():
+            score += 1
+    return score
+
+def apply_cheating_penalty(original_marks, cheating_count):
+    """Return (final_marks, penalty_flag): one incident halves the marks, two or more zero them."""
+    penalty_flag = 2 if cheating_count >= 2 else (1 if cheating_count == 1 else 0)
+    if penalty_flag >= 2:
+        final_marks = 0
+    elif penalty_flag == 1:
+        final_marks = max(0, original_marks * 0.5)
+    else:
+        final_marks = original_marks
+    return final_marks, penalty_flag
@@ -0,0 +1,125 @@
+from flask import Blueprint, request, jsonify, send_file, current_app, url_for
+from sqlalchemy import select
+from config import Config
+from models import Job, db
+from utils import add_log, admin_required, staff_required, current_staff
+import jobs
+
+jobs_bp = Blueprint('jobs', __name__)
+
+# ===== Background jobs (engine in jobs.py) =====
+
+def _own_job(job_id):
+    """The job if it exists and the caller may see it (admins see every job)."""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return None
+    role, uid, _ = current_staff()
+    if role != 'admin' and (job.role != 'teacher' or job.created_by != uid):
+        return None
+    return job
+
+def job_handle(job, status=202):
+    """Response for a newly queued job: where to poll and where the file will be."""
+    return jsonify({
+        'ok': True,
+        'job': jobs.job_dict(job),
+        'status_url': url_for('jobs.api_job_status', job_id=job.id),
+        'download_url': url_for('jobs.api_job_download', job_id=job.id),
+    }), status
+
+def jobs_available():
+    """True when queued jobs will run: in this process, or in the one APP_SERVICES leaves them to."""
+    return current_app.extensions.get('job_runner') is not None or current_app.extensions.get('jobs_elsewhere', False)
+
+def should_defer(rows):
+    """True when an export of `rows` rows should run as a job (or the caller asked with async=1)."""
+    if not jobs_available():
+        return False
+    if request.args.get('async') in ('1', 'true', 'yes'):
+        return True
+    return rows > Config.JOB_INLINE_MAX_ROWS
+
+def submit_job(kind, params):
+    """Queue a job for the logged-in teacher/admin (used by routes that hand big work off)."""
+    role, uid, username = current_staff()
+    job = jobs.submit(kind, params, role, uid, username)
+    add_log(uid, username, role, 'job_submitted', {'job_id': job.id, 'kind': kind, 'params': params})
+    return job
+
+@jobs_bp.route('/api/jobs', methods=['POST'])
+@staff_required
+def api_submit_job():
+    d = request.json or {}
+    kind = d.get('kind')
+    params = d.get('params') or {}
+    if not kind or not isinstance(params, dict):
+        return jsonify({'ok': False, 'msg': 'missing_kind'}), 400
+    role, uid, _ = current_staff()
+    if kind in ('gradebook', 'regrade') and role == 'teacher':
+        params['owner_id'] = uid  # teachers only export/regrade their own exams
+    try:
+        job = submit_job(kind, params)
+    except jobs.UnknownJobKind:
+        return jsonify({'ok': False, 'msg': 'unknown_kind', 'kinds': jobs.kinds_for(role)}), 400
+    except jobs.BadJobParams as e:
+        return jsonify({'ok': False, 'msg': 'bad_params', 'error': str(e)}), 400
+    return job_handle(job)
+
+@jobs_bp.route('/api/jobs', methods=['GET'])
+@staff_required
+def api_list_jobs():
+    role, uid, _ = current_staff()
+    limit = max(1, min(request.args.get('limit', default=50, type=int), 200))
+    q = select(Job).order_by(Job.created_at.desc()).limit(limit)
+    if role != 'admin':
+        q = q.where(Job.role == 'teacher', Job.created_by == uid)
+    status = request.args.get('status')
+    if status:
+        q = q.where(Job.status == status)
+    rows = db.session.execute(q).scalars().all()
+    return jsonify({'ok': True, 'jobs': [jobs.job_dict(j) for j in rows], 'kinds': jobs.kinds_for(role)})
+
+@jobs_bp.route('/api/jobs/<job_id>', methods=['GET'])
+@staff_required
+def api_job_status(job_id):
+    job = _own_job(job_id)
+    if job is None:
+        return jsonify({'ok': False, 'msg': 'job_not_found'}), 404
+    return jsonify({'ok': True, 'job': jobs.job_dict(job)})
+
+@jobs_bp.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@staff_required
+def api_cancel_job(job_id):
+    job = _own_job(job_id)
+    if job is None:
+        return jsonify({'ok': False, 'msg': 'job_not_found'}), 404
+    if job.status in jobs.FINISHED:
+        return jsonify({'ok': False, 'msg': 'job_finished', 'job': jobs.job_dict(job)}), 409
+    job = jobs.request_cancel(job)
+    role, uid, username = current_staff()
+    add_log(uid, username, role, 'job_cancelled', {'job_id': job.id, 'kind': job.kind})
+    return jsonify({'ok': True, 'job': jobs.job_dict(job)})
+
+@jobs_bp.route('/api/jobs/<job_id>/download', methods=['GET'])
+@staff_required
+def api_job_download(job_id):
+    job = _own_job(job_id)
+    if job is None:
+        return jsonify({'ok': False, 'msg': 'job_not_found'}), 404
+    path = jobs.artifact_file(job)
+    if path is None:
+        if job.status in ('queued', 'running'):
+            return jsonify({'ok': False, 'msg': 'job_not_finished', 'job': jobs.job_dict(job)}), 409
+        return jsonify({'ok': False, 'msg': 'no_artifact', 'job': jobs.job_dict(job)}), 410
+    role, uid, username = current_staff()
+    add_log(uid, username, role, 'job_download', {'job_id': job.id, 'kind': job.kind})
+    return send_file(path, mimetype=job.artifact_mime, as_attachment=True, download_name=job.artifact_name)
+
+@jobs_bp.route('/api/admin/jobs/stats', methods=['GET'])
+@admin_required
+def api_job_stats():
+    runner = current_app.extensions.get('job_runner')
+    if runner is None:
+        return jsonify({'ok': True, 'enabled': jobs_available(), 'runs_here': False})
+    return jsonify({'ok': True, 'enabled': True, 'stats': runner.stats()})
@@ -0,0 +1,573 @@
+import inspect
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from config import Config
+from models import Exam, Job, Log, db
+import shards
+
+# ===== Background jobs =====
+# Heavy exports and scans run outside the request thread. A request inserts a
+# row into `jobs` (status 'queued') and returns its id; every app process runs
+# a JobRunner that claims queued rows with a conditional UPDATE (so each job
+# runs exactly once across processes) and executes them on a thread or process
+# pool. Jobs report progress and notice cancellation through their row, which
+# also works when they run in a child process. Results are written to
+# JOB_ARTIFACT_DIR/<job id>/ and deleted once `expires_at` passes.
+#
+#   queued -> running -> succeeded | failed | cancelled
+#   queued -> cancelled;   succeeded -> expired (artifact removed)
+#
+# A running job whose worker stops heartbeating (the process died) is marked
+# failed after `stale_seconds`; jobs are not retried automatically.
+
+log = logging.getLogger(__name__)
+
+FINISHED = ('succeeded', 'failed', 'cancelled', 'expired')
+
+class JobCancelled(Exception):
+    pass
+
+class UnknownJobKind(ValueError):
+    pass
+
+class BadJobParams(ValueError):
+    pass
+
+# kind -> (function, roles allowed to submit it)
+_kinds = {}
+
+def job_kind(name, roles=('teacher', 'admin')):
+    """Register `fn(ctx, **params)` as a job kind."""
+    def deco(fn):
+        _kinds[name] = (fn, tuple(roles))
+        return fn
+    return deco
+
+def kinds_for(role):
+    return sorted(k for k, (_, roles) in _kinds.items() if role in roles)
+
+class JobContext:
+    """Handed to a running job: progress, cancellation and artifact output."""
+
+    def __init__(self, job, artifact_dir, update_seconds=0.5):
+        self.job_id = job.id
+        self.params = dict(job.params or {})
+        self.role = job.role
+        self.user_id = job.created_by
+        self.username = job.created_by_name
+        self.dir = os.path.join(artifact_dir, job.id)
+        self.artifact = None
+        self._update_seconds = update_seconds
+        self._next_update = 0.0
+        self._total = None
+        self._done = 0
+
+    def _write(self, **values):
+        t = Job.__table__
+        with db.engine.begin() as conn:
+            conn.execute(t.update().where(t.c.id == self.job_id).values(heartbeat_at=datetime.utcnow(), **values))
+            cancel = conn.execute(select(t.c.cancel_requested).where(t.c.id == self.job_id)).scalar()
+        if cancel:
+            raise JobCancelled()
+
+    def set_total(self, total):
+        self._total = max(1, int(total)) if total else None
+
+    def advance(self, n=1, message=None):
+        """Count `n` units of work done; writes progress (and checks for cancellation) at most every 0.5s."""
+        self._done += n
+        now = time.monotonic()
+        if now < self._next_update:
+            return
+        self._next_update = now + self._update_seconds
+        values = {'message': message} if message else {}
+        if self._total:
+            values['progress'] = min(0.99, self._done / self._total)
+        self._write(**values)
+
+    def check_cancelled(self):
+        self.advance(0)
+
+    def open_artifact(self, filename, mimetype):
+        """Open the job's output file for writing (one artifact per job)."""
+        os.makedirs(self.dir, exist_ok=True)
+        self.artifact = (filename, mimetype)
+        return open(os.path.join(self.dir, filename), 'wb')
+
+def submit(kind, params, role, user_id, username):
+    """Queue a job and return its row.
+
+    Raises UnknownJobKind for kinds the role may not run and BadJobParams when
+    `params` do not fit the job function.
+    """
+    entry = _kinds.get(kind)
+    if entry is None or role not in entry[1]:
+        raise UnknownJobKind(kind)
+    try:
+        inspect.signature(entry[0]).bind(None, **(params or {}))
+    except TypeError as e:
+        raise BadJobParams(str(e))
+    job = Job(id=uuid.uuid4().hex, kind=kind, params=params or {}, role=role,
+              created_by=user_id, created_by_name=username)
+    db.session.add(job)
+    db.session.commit()
+    runner = _runner
+    if runner is not None:
+        runner.wake()
+    return job
+
+def request_cancel(job):
+    """Cancel a queued job outright; ask a running one to stop at its next progress update."""
+    t = Job.__table__
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(t.update().where(t.c.id == job.id, t.c.status == 'queued')
+                     .values(status='cancelled', cancel_requested=True, finished_at=now))
+        conn.execute(t.update().where(t.c.id == job.id, t.c.status == 'running').values(cancel_requested=True))
+    db.session.refresh(job)
+    return job
+
+def artifact_file(job):
+    if job.status != 'succeeded' or not job.artifact_path or not os.path.exists(job.artifact_path):
+        return None
+    return job.artifact_path
+
+def job_dict(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'params': job.params,
+        'status': job.status,
+        'progress': 1.0 if job.status == 'succeeded' else round(job.progress or 0.0, 4),
+        'message': job.message,
+        'cancel_requested': bool(job.cancel_requested),
+        'created_by': job.created_by_name,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'result': job.result,
+        'error': job.error,
+        'artifact': None if not job.artifact_name else {
+            'name': job.artifact_name,
+            'mimetype': job.artifact_mime,
+            'bytes': job.artifact_bytes,
+            'expires_at': job.expires_at.isoformat() if job.expires_at else None,
+        },
+    }
+
+def execute(job_id, worker_id, artifact_dir, artifact_ttl):
+    """Run one claimed job to completion inside an app context and record the outcome."""
+    t = Job.__table__
+    job = db.session.get(Job, job_id)
+    if job is None or job.status != 'running' or job.worker != worker_id:
+        return None
+    fn = _kinds[job.kind][0] if job.kind in _kinds else None
+    ctx = JobContext(job, artifact_dir)
+    db.session.remove()
+    values = {}
+    try:
+        if fn is None:
+            raise UnknownJobKind(job.kind)
+        result = fn(ctx, **ctx.params)
+        values = {'status': 'succeeded', 'progress': 1.0, 'result': result, 'message': None}
+        if ctx.artifact:
+            name, mime = ctx.artifact
+            path = os.path.join(ctx.dir, name)
+            values.update(artifact_path=path, artifact_name=name, artifact_mime=mime,
+                          artifact_bytes=os.path.getsize(path),
+                          expires_at=datetime.utcnow() + timedelta(seconds=artifact_ttl))
+    except JobCancelled:
+        values = {'status': 'cancelled', 'message': 'cancelled'}
+    except Exception as e:
+        values = {'status': 'failed', 'error': f'{type(e).__name__}: {e}', 'message': None}
+        log.exception('job %s (%s) failed', job_id, fn.__name__ if fn else '?')
+    finally:
+        db.session.remove()
+    if values['status'] != 'succeeded':
+        shutil.rmtree(ctx.dir, ignore_errors=True)
+    values['finished_at'] = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(t.update().where(t.c.id == job_id, t.c.status == 'running', t.c.worker == worker_id)
+                     .values(**values))
+    return values['status']
+
+# process mode: every job runs in a fresh `python -m jobs <id>` interpreter with
+# a bare app bound to the same database. A new interpreter (rather than a
+# multiprocessing pool) never re-imports the web app's main module, so the RPC
+# server and scheduler are not started a second time, and the job's memory is
+# returned to the OS when it exits. Only kinds defined in this module can run
+# this way. Monitor events the job relays (regrade_progress, regrade_done)
+# go through the monitor_events table like those of any other process (see
+# utils.relay_event).
+
+def _child_main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description='run one claimed background job')
+    ap.add_argument('job_id')
+    ap.add_argument('--worker', required=True)
+    ap.add_argument('--artifact-dir', required=True)
+    ap.add_argument('--artifact-ttl', type=float, required=True)
+    args = ap.parse_args(argv)
+    from flask import Flask
+    child = Flask('jobs')
+    child.config['SQLALCHEMY_DATABASE_URI'] = os.environ['JOB_DATABASE_URI']
+    child.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(child)
+    with child.app_context():
+        if Config.SHARDING_ENABLED and db.engine.url.get_backend_name() == 'sqlite':
+            shards.configure(True, Config.SHARD_DIR, str(db.engine.url), Config.SHARD_MAX_OPEN)
+        status = execute(args.job_id, args.worker, args.artifact_dir, args.artifact_ttl)
+    print(status)
+    return 0
+
+_runner = None
+
+class JobRunner:
+    def __init__(self, app, workers=2, mode='thread', poll_seconds=1.0, artifact_dir=None,
+                 artifact_ttl=86400, stale_seconds=60, sweep_seconds=60, backup_seconds=0):
+        if mode not in ('thread', 'process'):
+            raise ValueError("mode must be 'thread' or 'process'")
+        self.app = app
+        self.workers = max(1, int(workers))
+        self.mode = mode
+        self.poll_seconds = float(poll_seconds)
+        self.artifact_dir = os.path.abspath(artifact_dir or os.path.join(os.path.dirname(__file__), 'job_artifacts'))
+        self.artifact_ttl = float(artifact_ttl)
+        self.stale_seconds = float(stale_seconds)
+        self.sweep_seconds = float(sweep_seconds)
+        self.backup_seconds = float(backup_seconds or 0)  # 0: no scheduled backups
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self._pool = None
+        self._running = {}      # job id -> future
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+        self._sweep_due = 0.0
+        self.counters = {'claimed': 0, 'succeeded': 0, 'failed': 0, 'cancelled': 0, 'expired': 0, 'stale': 0,
+                         'backups_scheduled': 0}
+        self.last_error = None
+
+    # --- lifecycle ---
+    def start(self):
+        global _runner
+        with self._cond:
+            if self._thread is not None:
+                return self
+            # in process mode the pool threads only wait on child interpreters
+            from concurrent.futures import ThreadPoolExecutor
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='job-worker')
+            self._thread = threading.Thread(target=self._run, name='job-runner', daemon=True)
+        os.makedirs(self.artifact_dir, exist_ok=True)
+        _runner = self
+        self._thread.start()
+        return self
+
+    def stop(self, wait=False):
+        global _runner
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+        if _runner is self:
+            _runner = None
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    # --- main loop ---
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                with self._cond:
+                    if self._stop:
+                        return
+                try:
+                    self._reap()
+                    self._heartbeat()
+                    if time.monotonic() >= self._sweep_due:
+                        self._sweep_due = time.monotonic() + self.sweep_seconds
+                        self.sweep()
+                    self._claim()
+                except Exception as e:  # keep the runner alive; surface the error in stats
+                    self.last_error = f'{type(e).__name__}: {e}'
+                    self.app.logger.exception('job runner tick failed')
+                finally:
+                    db.session.remove()
+                with self._cond:
+                    if self._stop:
+                        return
+                    self._cond.wait(self.poll_seconds)
+
+    def _reap(self):
+        for job_id, fut in list(self._running.items()):
+            if not fut.done():
+                continue
+            del self._running[job_id]
+            try:
+                status = fut.result()
+            except Exception as e:  # the worker itself failed (e.g. the job process crashed)
+                status = 'failed'
+                self._finish_lost(job_id, f'{type(e).__name__}: {e}')
+            if status in self.counters:
+                self.counters[status] += 1
+
+    def _heartbeat(self):
+        if not self._running:
+            return
+        t = Job.__table__
+        with db.engine.begin() as conn:
+            conn.execute(t.update().where(t.c.id.in_(list(self._running)), t.c.status == 'running')
+                         .values(heartbeat_at=datetime.utcnow()))
+
+    def _claim(self):
+        free = self.workers - len(self._running)
+        if free <= 0:
+            return
+        t = Job.__table__
+        with db.engine.connect() as conn:
+            candidates = conn.execute(select(t.c.id).where(t.c.status == 'queued')
+                                      .order_by(t.c.created_at, t.c.id).limit(free * 2)).scalars().all()
+        for job_id in candidates:
+            if free <= 0:
+                break
+            now = datetime.utcnow()
+            with db.engine.begin() as conn:
+                won = conn.execute(t.update().where(t.c.id == job_id, t.c.status == 'queued')
+                                   .values(status='running', worker=self.worker_id, started_at=now,
+                                           heartbeat_at=now)).rowcount == 1
+            if not won:
+                continue  # another process claimed it
+            self.counters['claimed'] += 1
+            free -= 1
+            target = self._process_execute if self.mode == 'process' else self._thread_execute
+            fut = self._pool.submit(target, job_id)
+            fut.add_done_callback(lambda _: self.wake())
+            self._running[job_id] = fut
+
+    def _thread_execute(self, job_id):
+        with self.app.app_context():
+            return execute(job_id, self.worker_id, self.artifact_dir, self.artifact_ttl)
+
+    def _process_execute(self, job_id):
+        import subprocess
+        import sys
+        env = dict(os.environ, JOB_DATABASE_URI=self.app.config['SQLALCHEMY_DATABASE_URI'])
+        proc = subprocess.run([sys.executable, '-m', 'jobs', job_id, '--worker', self.worker_id,
+                               '--artifact-dir', self.artifact_dir, '--artifact-ttl', str(self.artifact_ttl)],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            tail = (proc.stderr.strip().splitlines() or ['no output'])[-1]
+            raise RuntimeError(f'job process exited with {proc.returncode}: {tail}')
+        out = proc.stdout.strip().splitlines()
+        return out[-1] if out else None
+
+    def _finish_lost(self, job_id, error):
+        t = Job.__table__
+        with db.engine.begin() as conn:
+            conn.execute(t.update().where(t.c.id == job_id, t.c.status == 'running')
+                         .values(status='failed', error=error, finished_at=datetime.utcnow()))
+
+    def sweep(self, now=None):
+        """Expire old artifacts and fail running jobs whose worker stopped heartbeating."""
+        t = Job.__table__
+        now = now or datetime.utcnow()
+        with db.engine.connect() as conn:
+            expired = conn.execute(select(t.c.id, t.c.artifact_path)
+                                   .where(t.c.status == 'succeeded', t.c.expires_at < now)).all()
+        for job_id, path in expired:
+            shutil.rmtree(os.path.join(self.artifact_dir, job_id), ignore_errors=True)
+            with db.engine.begin() as conn:
+                conn.execute(t.update().where(t.c.id == job_id, t.c.status == 'succeeded')
+                             .values(status='expired', artifact_path=None))
+            self.counters['expired'] += 1
+        cutoff = now - timedelta(seconds=self.stale_seconds)
+        with db.engine.begin() as conn:
+            n = conn.execute(t.update().where(t.c.status == 'running', t.c.heartbeat_at < cutoff)
+                             .values(status='failed', error='worker lost', finished_at=now)).rowcount
+        self.counters['stale'] += n
+        scheduled = self._schedule_backup() if self.backup_seconds else False
+        return {'expired': len(expired), 'stale': n, 'backup_scheduled': scheduled}
+
+    def _schedule_backup(self):
+        # one job per BACKUP_INTERVAL slot: the id is derived from the slot, so when several
+        # processes sweep in the same slot only the first insert succeeds
+        from sqlalchemy.exc import IntegrityError
+        slot = int(time.time() // self.backup_seconds)
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(Job.__table__.insert().values(
+                    id=f'backup_{slot}', kind='backup', params={}, status='queued', progress=0,
+                    cancel_requested=False, role='admin', created_by=None, created_by_name='scheduler',
+                    created_at=datetime.utcnow()))
+        except IntegrityError:
+            return False
+        self.counters['backups_scheduled'] += 1
+        self.wake()
+        return True
+
+    def stats(self):
+        counts = dict(db.session.execute(select(Job.status, func.count()).group_by(Job.status)).all())
+        return {
+            'worker_id': self.worker_id,
+            'mode': self.mode,
+            'workers': self.workers,
+            'running_here': sorted(self._running),
+            'jobs_by_status': counts,
+            'counters': dict(self.counters),
+            'last_error': self.last_error,
+        }
+
+# ===== Job kinds =====
+
+def _count_marks(exam_ids):
+    return shards.count_marks(exam_ids)
+
+def _copy(ctx, chunks, out):
+    for chunk in chunks:
+        out.write(chunk)
+        ctx.check_cancelled()
+
+@job_kind('marks_csv')
+def marks_csv_job(ctx, exam_id):
+    """The api_exam_marks_csv download, built in the background."""
+    import gradebook
+    exam_id = int(exam_id)
+    ctx.set_total(_count_marks([exam_id]))
+    db.session.remove()
+    rows = [0]
+
+    def progress(n):
+        rows[0] += n
+        ctx.advance(n)
+    with ctx.open_artifact(f'exam_{exam_id}_marks.csv', 'text/csv') as out:
+        _copy(ctx, gradebook.exam_csv(exam_id, Config.EXPORT_CHUNK_ROWS, progress), out)
+    return {'exam_id': exam_id, 'rows': rows[0]}
+
+@job_kind('gradebook')
+def gradebook_job(ctx, exam_ids, format='wide', compress=True, include_empty=False, owner_id=None):
+    """A gradebook export (see gradebook.export_from_request) written to an artifact."""
+    import gradebook
+    q = select(Exam.id, Exam.title).where(Exam.id.in_(exam_ids))
+    if owner_id is not None:
+        q = q.where(Exam.created_by == owner_id)
+    found = dict(db.session.execute(q).all())
+    exams = [(eid, found[eid]) for eid in exam_ids if eid in found]
+    if not exams:
+        raise ValueError('no exams to export')
+    ctx.set_total(_count_marks([eid for eid, _ in exams]))
+    db.session.remove()
+    name = f'exam_{exams[0][0]}_gradebook' if len(exams) == 1 else f'gradebook_{len(exams)}_exams'
+    chunk_rows = Config.EXPORT_CHUNK_ROWS
+    if format == 'zip':
+        body, filename, mime = gradebook.zip_stream(exams, chunk_rows, progress=ctx.advance), f'{name}.zip', 'application/zip'
+    else:
+        body = gradebook.wide_csv(exams, chunk_rows, include_empty, progress=ctx.advance)
+        filename, mime = f'{name}.csv', 'text/csv'
+        if compress:
+            body, filename, mime = gradebook.gzip_stream(body), f'{name}.csv.gz', 'application/gzip'
+    with ctx.open_artifact(filename, mime) as out:
+        _copy(ctx, body, out)
+    return {'exam_ids': [eid for eid, _ in exams], 'format': format}
+
+@job_kind('logs_csv', roles=('admin',))
+def logs_csv_job(ctx, event_type=None, user_id=None, q=None):
+    """Every log row matching the filters (or a log_search query) as CSV, newest first."""
+    import csv
+    import io
+    chunk = Config.EXPORT_CHUNK_ROWS
+    base = select(Log.id, Log.created_at, Log.who_user_id, Log.username, Log.role, Log.event_type, Log.meta)
+    if event_type:
+        base = base.where(Log.event_type == event_type)
+    if user_id:
+        base = base.where(Log.who_user_id == int(user_id))
+    if not q:
+        ctx.set_total(db.session.execute(select(func.count()).select_from(base.subquery())).scalar())
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(['id', 'created_at', 'who_user_id', 'username', 'role', 'event_type', 'meta'])
+    rows_out = 0
+    before = None
+    with ctx.open_artifact('logs.csv', 'text/csv') as out:
+        while True:
+            if q:
+                # the search covers the exam shards too; filters apply to each page of hits
+                hits, before = shards.search_logs(q, limit=chunk, sort='recent', before=before)
+                rows = [(l.id, l.created_at, l.who_user_id, l.username, l.role, l.event_type, l.meta)
+                        for l, _ in hits if (not event_type or l.event_type == event_type)
+                        and (not user_id or l.who_user_id == int(user_id))]
+                db.session.rollback()
+                if not hits:
+                    break
+            else:
+                stmt = base.order_by(Log.id.desc()).limit(chunk)
+                if before is not None:
+                    stmt = stmt.where(Log.id < before)
+                rows = db.session.connection().execute(stmt).all()
+                db.session.rollback()
+                if not rows:
+                    break
+                before = rows[-1][0]
+            for r in rows:
+                w.writerow([r[0], r[1].isoformat() if r[1] else '', '' if r[2] is None else r[2], r[3] or '',
+                            r[4] or '', r[5], '' if r[6] is None else json.dumps(r[6])])
+            out.write(buf.getvalue().encode('utf-8'))
+            buf.seek(0)
+            buf.truncate()
+            rows_out += len(rows)
+            ctx.advance(len(rows), message=f'{rows_out} rows')
+            if (q and before is None) or (not q and len(rows) < chunk):
+                break
+    return {'rows': rows_out}
+
+@job_kind('regrade')
+def regrade_job(ctx, exam_id, dry_run=False, owner_id=None):
+    """Rescore an exam's stored submissions against its current answer key (see regrade.py)."""
+    import exam_cache
+    import regrade
+    exam = db.session.get(Exam, int(exam_id))
+    if exam is None or (owner_id is not None and exam.created_by != owner_id):
+        raise ValueError('exam not found')
+    key = exam_cache.load_bundle(exam.id).answer_key
+    db.session.remove()
+    done = [0]
+
+    def progress(n, total):
+        ctx.set_total(total)
+        ctx.advance(n - done[0], message=f'{n}/{total} scored')
+        done[0] = n
+    summary = regrade.regrade_exam(exam.id, key, dry_run=bool(dry_run), progress=progress)
+    summary['changes'] = summary['changes'][:20]  # the full diff stays in the logs
+    return summary
+
+@job_kind('backup', roles=('admin',))
+def backup_job(ctx, verify='full', keep=None):
+    """Online snapshot of the main database and exam shards into BACKUP_DIR (see backup.py)."""
+    import backup
+    if verify not in ('full', 'quick', 'none'):
+        raise ValueError("verify must be 'full', 'quick' or 'none'")
+    ctx.set_total(sum(backup.page_count(path) for _, path in backup.app_sources()))
+    db.session.remove()
+    manifest = backup.snapshot_now(verify, keep, progress=lambda name, pages: ctx.advance(pages, message=f'{name} copied'))
+    return {k: manifest[k] for k in ('name', 'bytes', 'seconds', 'pruned')} | {
+        'files': [{k: f.get(k) for k in ('file', 'pages', 'restarts', 'single_pass', 'integrity')}
+                  for f in manifest['files']]}
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(_child_main())
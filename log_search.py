@@ -0,0 +1,156 @@
+import re
+
+from sqlalchemy import text
+
+# ===== Full-text search over logs (SQLite FTS5) =====
+# logs_fts is a contentless FTS5 index keyed by logs.id holding the
+# username, the event_type and the string values of `meta` flattened with
+# json_tree. An AFTER INSERT trigger keeps it in sync for every writer (ORM,
+# Core bulk inserts, the RPC event flusher); rows that existed before the
+# index was created are loaded with rebuild(). There is no delete/update
+# trigger: a contentless index can only drop a row given its exact indexed
+# values, and rows from before the index may never have been indexed. Logs
+# are only deleted by migrate-to-shards, which rebuilds the index afterwards.
+# Every exam shard carries its own logs_fts for the exam logs it holds;
+# shards.search_logs runs the query on each and merges the hits. Other
+# databases report the feature as unavailable.
+
+FTS_TABLE = 'logs_fts'
+TRIGGER = 'logs_fts_ai'
+AUTO_BUILD_MAX_ROWS = 100000   # build on startup below this; larger tables need `flask rebuild-log-search`
+MAX_RANKED_RESULTS = 1000      # offset + limit cap for sort='rank'; use sort='recent' to page further
+RANK_WINDOW = 20000            # sort='rank' scores only the newest this-many matches of a query
+WEIGHTS = (2.0, 1.5, 1.0)      # bm25 weights: username, event_type, meta
+
+_FLATTEN = ("CASE WHEN json_valid({meta}) THEN (SELECT group_concat(value, ' ') FROM json_tree({meta}) "
+            "WHERE type NOT IN ('object', 'array', 'null')) END")
+
+_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "username, event_type, meta, content='', prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {TRIGGER} AFTER INSERT ON logs BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, username, event_type, meta) "
+    f"VALUES (new.id, new.username, new.event_type, {_FLATTEN.format(meta='new.meta')}); END",
+)
+
+class SearchUnavailable(Exception):
+    pass
+
+class BadQuery(ValueError):
+    pass
+
+def is_supported(engine):
+    return engine.dialect.name == 'sqlite'
+
+def index_exists(conn):
+    return conn.execute(text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:n"),
+                        {'n': FTS_TABLE}).first() is not None
+
+def ensure_index(engine, logger=None):
+    """Create the FTS table and insert trigger if missing. Returns 'unsupported', 'exists', 'built' or 'empty'."""
+    if not is_supported(engine):
+        return 'unsupported'
+    with engine.begin() as conn:
+        existed = index_exists(conn)
+        for stmt in _DDL:
+            conn.execute(text(stmt))
+        if existed:
+            return 'exists'
+        last_id = conn.execute(text('SELECT max(id) FROM logs')).scalar() or 0
+    if last_id == 0:
+        return 'empty'
+    if last_id <= AUTO_BUILD_MAX_ROWS:
+        rebuild(engine)
+        return 'built'
+    if logger is not None:
+        logger.warning('log search index created empty; run `flask --app app rebuild-log-search` '
+                       'to index the %d existing log rows', last_id)
+    return 'empty'
+
+def rebuild(engine, batch_size=100000, progress=None):
+    """Re-index every log row in id-range batches; returns the number of rows indexed."""
+    if not is_supported(engine):
+        raise SearchUnavailable('full-text log search needs SQLite FTS5')
+    with engine.begin() as conn:
+        for stmt in _DDL:
+            conn.execute(text(stmt))
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')"))
+        lo, hi = conn.execute(text('SELECT min(id), max(id) FROM logs')).first()
+    if lo is None:
+        return 0
+    fill = text(f"INSERT INTO {FTS_TABLE}(rowid, username, event_type, meta) "
+                f"SELECT id, username, event_type, {_FLATTEN.format(meta='meta')} FROM logs "
+                "WHERE id >= :lo AND id < :hi")
+    done = 0
+    start = lo
+    while start <= hi:
+        # each batch commits on its own so writers are never blocked for long
+        with engine.begin() as conn:
+            done += conn.execute(fill, {'lo': start, 'hi': start + batch_size}).rowcount
+        start += batch_size
+        if progress:
+            progress(done, min(start, hi + 1) - lo, hi - lo + 1)
+    with engine.begin() as conn:
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+    return done
+
+_TERM = re.compile(r'(?:\w+:)?"[^"]*"|\S+')
+
+def to_match_query(q):
+    """Turn free text into an FTS5 query: every term must match, `term*` is a prefix search,
+    "quoted text" is a phrase and `field:term` targets username, event_type or meta."""
+    parts = []
+    for tok in _TERM.findall(q or ''):
+        column = None
+        phrase = len(tok) > 1 and tok[0] == '"' and tok[-1] == '"'
+        if not phrase and ':' in tok:
+            col, rest = tok.split(':', 1)
+            if col in ('username', 'event_type', 'meta') and rest:
+                column, tok = col, rest
+                phrase = len(tok) > 1 and tok[0] == '"' and tok[-1] == '"'
+        prefix = not phrase and tok.endswith('*')
+        word = tok[1:-1] if phrase else tok.replace('"', '').rstrip('*')
+        if not word.strip():
+            continue
+        term = '"' + word.replace('"', '""') + '"' + ('*' if prefix else '')
+        parts.append(f'{column}:{term}' if column else term)
+    if not parts:
+        raise BadQuery('empty query')
+    return ' AND '.join(parts)
+
+def search(session, q, limit=50, offset=0, sort='rank', before_id=None, raw=False):
+    """Return (ids, scores) of matching log rows in one database (a Session, or a shard's Connection).
+
+    sort='rank'   best bm25 match first, paged with limit/offset.
+    sort='recent' newest first, paged with before_id (keyset on the log id).
+    raw=True passes `q` to FTS5 unchanged (full MATCH syntax).
+    """
+    bind = session.get_bind() if hasattr(session, 'get_bind') else session.engine
+    if not is_supported(bind):
+        raise SearchUnavailable('full-text log search needs SQLite FTS5')
+    match = q if raw else to_match_query(q)
+    params = {'q': match, 'limit': int(limit)}
+    if sort == 'recent':
+        sql = f"SELECT rowid, NULL FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :q"
+        if before_id:
+            sql += ' AND rowid < :before'
+            params['before'] = int(before_id)
+        sql += ' ORDER BY rowid DESC LIMIT :limit'
+    else:
+        w = ', '.join(str(x) for x in WEIGHTS)
+        # scoring every hit of a very common term costs ~1ms per 1000 rows, so rank
+        # within the newest RANK_WINDOW matches (walking rowids backwards is cheap)
+        sql = (f"SELECT rowid, score FROM (SELECT rowid, bm25({FTS_TABLE}, {w}) AS score FROM {FTS_TABLE} "
+               f"WHERE {FTS_TABLE} MATCH :q ORDER BY rowid DESC LIMIT :window) "
+               "ORDER BY score, rowid DESC LIMIT :limit OFFSET :offset")
+        params['offset'] = int(offset)
+        params['window'] = RANK_WINDOW
+    try:
+        rows = session.execute(text(sql), params).fetchall()
+    except Exception as e:
+        session.rollback()
+        msg = str(getattr(e, 'orig', e))
+        if 'fts5' in msg.lower() or 'syntax' in msg.lower() or 'no such column' in msg.lower():
+            raise BadQuery(msg)
+        raise
+    return [r[0] for r in rows], [r[1] for r in rows]
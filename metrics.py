@@ -0,0 +1,189 @@
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from flask import g, request, current_app
+
+# ===== Request / SQL instrumentation =====
+# Every request records its latency, the number of SQL statements it issued
+# and the time spent in them into fixed-bucket histograms. Counters are kept
+# in per-thread shards (no lock on the hot path) and merged when scraped.
+# When a thread exits, its shard is folded into a base total and dropped, so
+# short-lived server threads do not pile up shards.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+MAX_RECORDED_STATEMENTS = 100  # per request, for the slow-request log
+
+# layout of the per-endpoint counter list
+_N_LAT = len(LATENCY_BUCKETS) + 1
+_N_SQL = len(SQL_COUNT_BUCKETS) + 1
+_REQS, _LAT_SUM, _SQL_STMTS, _SQL_SUM, _SLOW = range(5)
+_LAT_OFF = 5
+_SQL_OFF = _LAT_OFF + _N_LAT
+_WIDTH = _SQL_OFF + _N_SQL
+
+_local = threading.local()
+_shards = []  # shards of live threads
+_base = {'endpoints': {}, 'status': {}}  # totals of threads that have exited
+_shards_lock = threading.Lock()
+
+class _ShardOwner:
+    # lives in the thread's threading.local, so it is freed when the thread ends
+    __slots__ = ('shard', '__weakref__')
+
+def _merge(dest, shard):
+    for name, row in list(shard['endpoints'].items()):
+        acc = dest['endpoints'].get(name)
+        if acc is None:
+            acc = dest['endpoints'][name] = [0] * _WIDTH
+        for i, v in enumerate(list(row)):
+            acc[i] += v
+    for key, n in list(shard['status'].items()):
+        dest['status'][key] = dest['status'].get(key, 0) + n
+
+def _retire(shard):
+    with _shards_lock:
+        _merge(_base, shard)
+        _shards.remove(shard)
+
+def _shard():
+    owner = getattr(_local, 'owner', None)
+    if owner is None:
+        owner = _local.owner = _ShardOwner()
+        owner.shard = {'endpoints': {}, 'status': {}}
+        with _shards_lock:
+            _shards.append(owner.shard)
+        weakref.finalize(owner, _retire, owner.shard)
+    return owner.shard
+
+def record_request(endpoint, status, seconds, sql_count, sql_seconds, slow):
+    shard = _shard()
+    row = shard['endpoints'].get(endpoint)
+    if row is None:
+        row = shard['endpoints'][endpoint] = [0] * _WIDTH
+    row[_REQS] += 1
+    row[_LAT_SUM] += seconds
+    row[_SQL_STMTS] += sql_count
+    row[_SQL_SUM] += sql_seconds
+    if slow:
+        row[_SLOW] += 1
+    row[_LAT_OFF + bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    row[_SQL_OFF + bisect_left(SQL_COUNT_BUCKETS, sql_count)] += 1
+    key = (endpoint, status)
+    shard['status'][key] = shard['status'].get(key, 0) + 1
+
+def snapshot():
+    """Merge all shards into {'endpoints': {name: row}, 'status': {(endpoint, code): n}}."""
+    out = {'endpoints': {}, 'status': {}}
+    with _shards_lock:  # a shard is never counted both live and retired
+        _merge(out, _base)
+        for s in _shards:
+            _merge(out, s)
+    return out
+
+def reset():
+    with _shards_lock:
+        for s in _shards + [_base]:
+            s['endpoints'].clear()
+            s['status'].clear()
+
+def _esc(v):
+    return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _fmt(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+def render_prometheus():
+    """Prometheus text exposition format (0.0.4)."""
+    snap = snapshot()
+    eps = sorted(snap['endpoints'].items())
+    out = []
+
+    def histogram(name, help_text, offset, buckets, sum_idx):
+        out.append(f'# HELP {name} {help_text}')
+        out.append(f'# TYPE {name} histogram')
+        for ep, row in eps:
+            label = f'endpoint="{_esc(ep)}"'
+            cum = 0
+            for i, le in enumerate(buckets):
+                cum += row[offset + i]
+                out.append(f'{name}_bucket{{{label},le="{le}"}} {cum}')
+            cum += row[offset + len(buckets)]
+            out.append(f'{name}_bucket{{{label},le="+Inf"}} {cum}')
+            out.append(f'{name}_sum{{{label}}} {_fmt(row[sum_idx])}')
+            out.append(f'{name}_count{{{label}}} {row[_REQS]}')
+
+    histogram('proctor_request_duration_seconds', 'Request latency by endpoint.', _LAT_OFF, LATENCY_BUCKETS, _LAT_SUM)
+    histogram('proctor_request_sql_statements', 'SQL statements issued per request by endpoint.', _SQL_OFF, SQL_COUNT_BUCKETS, _SQL_STMTS)
+
+    out.append('# HELP proctor_sql_duration_seconds_total Time spent executing SQL by endpoint.')
+    out.append('# TYPE proctor_sql_duration_seconds_total counter')
+    for ep, row in eps:
+        out.append(f'proctor_sql_duration_seconds_total{{endpoint="{_esc(ep)}"}} {_fmt(row[_SQL_SUM])}')
+    out.append('# HELP proctor_slow_requests_total Requests slower than SLOW_REQUEST_MS by endpoint.')
+    out.append('# TYPE proctor_slow_requests_total counter')
+    for ep, row in eps:
+        out.append(f'proctor_slow_requests_total{{endpoint="{_esc(ep)}"}} {row[_SLOW]}')
+    out.append('# HELP proctor_requests_total Requests by endpoint and status code.')
+    out.append('# TYPE proctor_requests_total counter')
+    for (ep, code), n in sorted(snap['status'].items()):
+        out.append(f'proctor_requests_total{{endpoint="{_esc(ep)}",status="{code}"}} {n}')
+    return '\n'.join(out) + '\n'
+
+# --- SQLAlchemy hooks ---
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_metrics_t0', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get('_metrics_t0')
+    if not stack:
+        return
+    elapsed = time.perf_counter() - stack.pop()
+    try:
+        m = g.get('_metrics')
+    except RuntimeError:
+        return  # outside an app context (e.g. background threads)
+    if m is None:
+        return
+    m['sql_count'] += 1
+    m['sql_time'] += elapsed
+    if len(m['statements']) < MAX_RECORDED_STATEMENTS:
+        m['statements'].append((statement[:500], round(elapsed * 1000, 3)))
+
+def _handle_error(context):
+    conn = context.connection
+    stack = conn.info.get('_metrics_t0') if conn is not None else None
+    if stack:
+        stack.pop()
+
+# --- Flask hooks ---
+def _before_request():
+    g._metrics = {'t0': time.perf_counter(), 'sql_count': 0, 'sql_time': 0.0, 'statements': []}
+
+def _after_request(response):
+    m = g.pop('_metrics', None)
+    if m is None:
+        return response
+    elapsed = time.perf_counter() - m['t0']
+    endpoint = request.endpoint or 'unmatched'
+    threshold_ms = current_app.config.get('SLOW_REQUEST_MS') or 0
+    slow = bool(threshold_ms) and elapsed * 1000 >= threshold_ms
+    record_request(endpoint, response.status_code, elapsed, m['sql_count'], m['sql_time'], slow)
+    if slow:
+        current_app.logger.warning(
+            'slow request %s %s (%s): %.1f ms, %d SQL statements, %.1f ms in SQL\n%s',
+            request.method, request.path, endpoint, elapsed * 1000, m['sql_count'], m['sql_time'] * 1000,
+            '\n'.join(f'  [{ms} ms] {stmt}' for stmt, ms in m['statements']))
+    return response
+
+def init_metrics(app):
+    """Install request middleware on `app` and cursor hooks on every SQLAlchemy engine."""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
@@ -9,7 +9,11 @@ class User(db.Model):
     username = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
     role = db.Column(db.String(20), nullable=False)  # 'student' or 'teacher'
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# admin user directory: keyset pages on (created_at, id) and case-insensitive prefix search
+db.Index('ix_users_role_created_at_id', User.role, User.created_at, User.id)
+db.Index('ix_users_role_lower_username', User.role, db.func.lower(User.username))
 
 class Log(db.Model):
     __tablename__ = 'logs'
@@ -31,6 +35,7 @@ class Exam(db.Model):
     is_published = db.Column(db.Boolean, nullable=False, default=False)
     num_questions = db.Column(db.Integer, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=True)  # bumped when the exam or its questions change (answer key version)
 
 class Mark(db.Model):
     __tablename__ = 'marks'
@@ -41,6 +46,9 @@ class Mark(db.Model):
     graded_at = db.Column(db.DateTime, nullable=True)
     cheating_count = db.Column(db.Integer, nullable=False, default=0)
 
+# per-exam marks in student order: CSV/gradebook exports page through this
+db.Index('ix_marks_exam_student', Mark.exam_id, Mark.student_id)
+
 class Question(db.Model):
     __tablename__ = 'questions'
     id = db.Column(db.Integer, primary_key=True)
@@ -54,3 +62,81 @@ class Question(db.Model):
     points = db.Column(db.Float, nullable=True)
     time_seconds = db.Column(db.Integer, nullable=True)  # per-question time
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ExamAttempt(db.Model):
+    # answers autosaved while a student sits an exam; graded at close if never submitted.
+    # submit_exam stores the final answers here too, so regrade.py can rescore them.
+    __tablename__ = 'exam_attempts'
+    __table_args__ = (db.UniqueConstraint('exam_id', 'student_id', name='uq_exam_attempts_exam_student'),)
+    id = db.Column(db.Integer, primary_key=True)
+    exam_id = db.Column(db.Integer, db.ForeignKey('exams.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    answers = db.Column(db.JSON, nullable=True)  # {question_id: 'A'/'B'/'C'/'D'}
+    cheating_count = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    submitted_at = db.Column(db.DateTime, nullable=True)  # set by submit_exam or at finalization
+
+class ExamAggregate(db.Model):
+    # written once when an exam is finalized at close (see scheduler.py)
+    __tablename__ = 'exam_aggregates'
+    exam_id = db.Column(db.Integer, db.ForeignKey('exams.id'), primary_key=True)
+    submitted = db.Column(db.Integer, nullable=False, default=0)
+    auto_graded = db.Column(db.Integer, nullable=False, default=0)  # graded from stored answers
+    absent = db.Column(db.Integer, nullable=False, default=0)
+    cheating = db.Column(db.Integer, nullable=False, default=0)
+    mean = db.Column(db.Float, nullable=True)
+    median = db.Column(db.Float, nullable=True)
+    min = db.Column(db.Float, nullable=True)
+    max = db.Column(db.Float, nullable=True)
+    finalized_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finalized_by = db.Column(db.String(120), nullable=True)  # scheduler worker id
+
+class StudentExam(db.Model):
+    # exams a student has a mark in; with sharding on, my_marks reads only these shards
+    __tablename__ = 'student_exams'
+    student_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    exam_id = db.Column(db.Integer, db.ForeignKey('exams.id'), primary_key=True)
+
+class MonitorEvent(db.Model):
+    # background events relayed to other processes' monitor streams (see utils.relay_event)
+    __tablename__ = 'monitor_events'
+    id = db.Column(db.Integer, primary_key=True)
+    origin = db.Column(db.String(64), nullable=False)  # process that raised it
+    payload = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SchedulerLease(db.Model):
+    # leader lease so only one app process runs scheduled jobs
+    __tablename__ = 'scheduler_leases'
+    name = db.Column(db.String(64), primary_key=True)
+    owner = db.Column(db.String(120), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class Job(db.Model):
+    # background jobs (see jobs.py); artifacts are files under JOB_ARTIFACT_DIR/<id>/
+    __tablename__ = 'jobs'
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    kind = db.Column(db.String(64), nullable=False)
+    params = db.Column(db.JSON, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed, cancelled, expired
+    progress = db.Column(db.Float, nullable=False, default=0.0)  # 0..1
+    message = db.Column(db.String(255), nullable=True)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    role = db.Column(db.String(20), nullable=False)  # submitter's role: 'teacher' or 'admin'
+    created_by = db.Column(db.Integer, nullable=True)
+    created_by_name = db.Column(db.String(120), nullable=True)
+    worker = db.Column(db.String(120), nullable=True)  # JobRunner that claimed it
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    artifact_path = db.Column(db.String(512), nullable=True)
+    artifact_name = db.Column(db.String(255), nullable=True)
+    artifact_mime = db.Column(db.String(100), nullable=True)
+    artifact_bytes = db.Column(db.Integer, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True)
+
+db.Index('ix_jobs_status_created_at', Job.status, Job.created_at)
@@ -0,0 +1,133 @@
+import time
+from datetime import datetime
+
+from sqlalchemy import and_, bindparam, select
+
+from grading import apply_cheating_penalty, question_id
+from models import ExamAttempt, Mark
+from utils import relay_event
+import shards
+
+# ===== Bulk regrade =====
+# Rescores every stored submission of an exam after its answer key changed.
+# The answers (kept on exam_attempts by submit_exam and the autosave) are
+# packed into one bytearray, a row of option codes per mark and a column per
+# question. Grading XORs the whole matrix with the key repeated once per row,
+# as a single big-int operation, and counts the zero bytes of each row (the
+# correct answers). Penalties are then reapplied with grading.apply_cheating_penalty
+# and Mark.cheating_count, exactly as submit_exam does. Only marks whose value
+# changed are written, in one executemany. Progress goes out on the monitor
+# stream as regrade_progress events, followed by one regrade_done.
+
+OPTION_CODES = {}
+for _i, _opt in enumerate('ABCD', 1):
+    OPTION_CODES[_opt] = OPTION_CODES[_opt.lower()] = _i
+NO_KEY = 255  # code for a question whose correct_option is not A-D: matches no answer
+
+def pack_answers(answers_list, qids):
+    """Row-major len(answers_list) x len(qids) bytearray of option codes (0: unanswered)."""
+    width = len(qids)
+    col = {}
+    for j, qid in enumerate(qids):
+        col[f'q{qid}'] = col[str(qid)] = j
+    mat = bytearray(width * len(answers_list))
+    for i, answers in enumerate(answers_list):
+        if not answers:
+            continue
+        base = i * width
+        for k, ans in answers.items():
+            j = col.get(k)
+            if j is None:
+                qid = question_id(k)  # unusual spellings ('q 7', ints); same parsing as score_answers
+                j = col.get(str(qid)) if qid is not None else None
+                if j is None:
+                    continue
+            if isinstance(ans, str):
+                code = OPTION_CODES.get(ans)
+                mat[base + j] = code if code is not None else OPTION_CODES.get(ans.strip().upper(), 0)
+    return mat
+
+def key_codes(answer_key, qids):
+    return bytes(OPTION_CODES.get((answer_key.get(q) or '').strip().upper(), NO_KEY) for q in qids)
+
+def score_packed(mat, key, rows):
+    """Correct answers per row of a packed matrix (see pack_answers) against key_codes()."""
+    width = len(key)
+    if not rows or not width:
+        return [0] * rows
+    n = width * rows
+    diff = (int.from_bytes(mat, 'little') ^ int.from_bytes(key * rows, 'little')).to_bytes(n, 'little')
+    return [diff.count(0, i, i + width) for i in range(0, n, width)]
+
+def regrade_exam(exam_id, answer_key, dry_run=False, chunk_rows=5000, progress=None, sample=100):
+    """Rescore exam_id's marks against answer_key (question id -> option) and write the ones that changed.
+
+    A regrade_progress event is published (and progress, if given, called with
+    rows scored so far and total rows) after each chunk of chunk_rows. Marks
+    with no stored answers (manual marks, absent students) are left alone, and
+    a mark edited while the regrade ran is not overwritten. Returns the diff
+    summary.
+    """
+    m, a = Mark.__table__, ExamAttempt.__table__
+    qids = sorted(answer_key)
+    key = key_codes(answer_key, qids)
+    t0 = time.perf_counter()
+    with shards.exam_db(exam_id) as conn:
+        rows = conn.execute(select(m.c.id, m.c.student_id, m.c.marks, m.c.cheating_count, a.c.answers)
+                            .outerjoin(a, and_(a.c.exam_id == m.c.exam_id, a.c.student_id == m.c.student_id))
+                            .where(m.c.exam_id == exam_id)
+                            .order_by(m.c.id)).all()
+    graded = [r for r in rows if r.answers is not None]
+    t1 = time.perf_counter()
+
+    changes, before, after = [], [], []
+    for start in range(0, len(graded), chunk_rows):
+        part = graded[start:start + chunk_rows]
+        scores = score_packed(pack_answers([r.answers for r in part], qids), key, len(part))
+        for r, score in zip(part, scores):
+            new, _ = apply_cheating_penalty(score, r.cheating_count or 0)
+            before.append(r.marks)
+            after.append(new)
+            if r.marks is None or abs(r.marks - new) > 1e-9:
+                changes.append((r, new))
+        relay_event({'type': 'regrade_progress', 'exam_id': exam_id, 'done': start + len(part),
+                     'total': len(graded), 'changed': len(changes), 'time': datetime.utcnow().isoformat()})
+        if progress:
+            progress(start + len(part), len(graded))
+    t2 = time.perf_counter()
+
+    written = 0
+    if changes and not dry_run:
+        now = datetime.utcnow()
+        stmt = (m.update()
+                .where(m.c.id == bindparam('mark_id'), m.c.marks.is_not_distinct_from(bindparam('old')))
+                .values(marks=bindparam('new'), graded_at=now))
+        with shards.exam_db(exam_id) as conn:
+            written = conn.execute(stmt, [{'mark_id': r.id, 'old': r.marks, 'new': new} for r, new in changes]).rowcount
+    t3 = time.perf_counter()
+
+    def mean(values):
+        values = [v for v in values if v is not None]
+        return round(sum(values) / len(values), 4) if values else None
+    summary = {
+        'exam_id': exam_id,
+        'questions': len(qids),
+        'marks': len(rows),
+        'regraded': len(graded),
+        'no_answers': len(rows) - len(graded),
+        'changed': len(changes),
+        'written': written,
+        'skipped_concurrent_edit': 0 if dry_run else len(changes) - written,
+        'increased': sum(1 for r, new in changes if r.marks is not None and new > r.marks),
+        'decreased': sum(1 for r, new in changes if r.marks is not None and new < r.marks),
+        'mean_before': mean(before),
+        'mean_after': mean(after),
+        'dry_run': bool(dry_run),
+        'changes': [{'mark_id': r.id, 'student_id': r.student_id, 'before': r.marks, 'after': new}
+                    for r, new in changes[:sample]],
+        'timings_ms': {'load': round((t1 - t0) * 1000, 1), 'compute': round((t2 - t1) * 1000, 1),
+                       'write': round((t3 - t2) * 1000, 1)},
+    }
+    relay_event({'type': 'regrade_done', **{k: v for k, v in summary.items() if k != 'changes'},
+                 'time': datetime.utcnow().isoformat()})
+    return summary
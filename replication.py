@@ -0,0 +1,188 @@
+import random
+import threading
+import time
+
+# ===== Replicated key-value store =====
+# Leader writes append to an in-memory replication log and bump a version.
+# Each replica has exactly one applier thread that replays the log in order,
+# `lag_seconds` after each entry was written, applying due entries in batches.
+# Thread count is therefore fixed (one per replica) no matter how many writes
+# arrive. Reads pick a copy according to the requested consistency mode.
+
+READ_MODES = ('strong', 'eventual', 'read_your_writes', 'bounded_staleness')
+
+class Replica:
+    def __init__(self, name):
+        self.name = name
+        self.data = {}
+        self.applied_version = 0
+        self.applied_entries = 0
+        self.batches = 0
+        self.last_applied_at = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def get(self, key):
+        with self.lock:
+            return self.data.get(key), self.applied_version
+
+class ReplicatedStore:
+    """Leader plus `replicas` followers fed from one append-only log."""
+
+    def __init__(self, replicas=3, lag_seconds=2.0, batch_size=500, compact_every=10000, clock=time.monotonic):
+        self.lag_seconds = float(lag_seconds)
+        self.batch_size = max(1, int(batch_size))
+        self.compact_every = compact_every
+        self._compact_at = compact_every  # log length that triggers the next compaction
+        self._clock = clock
+        self._leader = {}
+        self._version = 0
+        self._log = []      # (version, key, value, written_at); entry for version v is _log[v - 1 - _base]
+        self._base = 0      # versions already dropped from the front of _log
+        self._cond = threading.Condition()
+        self._stop = False
+        self.replicas = [Replica(f'replica-{i + 1}') for i in range(max(1, int(replicas)))]
+        self._rng = random.Random()
+        self._started = False
+
+    # --- lifecycle ---
+    def start(self):
+        with self._cond:
+            if self._started:
+                return self
+            self._started = True
+        for r in self.replicas:
+            r.thread = threading.Thread(target=self._apply_loop, args=(r,), name=f'kv-{r.name}', daemon=True)
+            r.thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        for r in self.replicas:
+            if r.thread is not None:
+                r.thread.join(timeout=5)
+
+    # --- writes ---
+    def write(self, key, value):
+        """Apply on the leader and append to the replication log; returns the new version token."""
+        with self._cond:
+            self._version += 1
+            v = self._version
+            self._leader[key] = value
+            self._log.append((v, key, value, self._clock()))
+            if len(self._log) >= self._compact_at:
+                self._compact()
+                # next attempt once the log has doubled what survived, so a lagging
+                # replica does not turn every write into a scan
+                self._compact_at = max(self.compact_every, 2 * len(self._log))
+            self._cond.notify_all()
+            return v
+
+    def _compact(self):
+        # drop entries every replica has applied (caller holds _cond)
+        floor = min(r.applied_version for r in self.replicas)
+        drop = floor - self._base
+        if drop > 0:
+            del self._log[:drop]
+            self._base = floor
+
+    def _apply_loop(self, replica):
+        cond = self._cond
+        while True:
+            with cond:
+                while True:
+                    if self._stop:
+                        return
+                    idx = replica.applied_version - self._base
+                    if idx < len(self._log):
+                        wait = self._log[idx][3] + self.lag_seconds - self._clock()
+                        if wait <= 0:
+                            break
+                        cond.wait(wait)
+                    else:
+                        cond.wait()
+                now = self._clock()
+                cutoff = now - self.lag_seconds
+                end = idx
+                limit = min(len(self._log), idx + self.batch_size)
+                while end < limit and self._log[end][3] <= cutoff:
+                    end += 1
+                batch = self._log[idx:end]
+            # apply outside the log lock so writers are not held up
+            with replica.lock:
+                data = replica.data
+                for _, key, value, _ in batch:
+                    data[key] = value
+                replica.applied_version = batch[-1][0]
+                replica.applied_entries += len(batch)
+                replica.batches += 1
+                replica.last_applied_at = now
+
+    # --- reads ---
+    def read(self, mode, key, token=None, max_staleness=None):
+        """Return (value, served_by, version_seen).
+
+        strong            - leader.
+        eventual          - any replica.
+        read_your_writes  - a replica that has applied `token` (falls back to the leader).
+        bounded_staleness - a replica whose oldest unapplied write is at most
+                            `max_staleness` seconds old (falls back to the leader).
+        """
+        if mode not in READ_MODES:
+            raise ValueError(f'unknown read mode: {mode}')
+        if mode == 'strong':
+            with self._cond:
+                return self._leader.get(key), 'leader', self._version
+        if mode == 'eventual':
+            r = self._rng.choice(self.replicas)
+            val, ver = r.get(key)
+            return val, r.name, ver
+        candidates = list(self.replicas)
+        self._rng.shuffle(candidates)
+        for r in candidates:
+            if mode == 'read_your_writes':
+                if r.applied_version >= int(token or 0):
+                    val, ver = r.get(key)
+                    if ver >= int(token or 0):
+                        return val, r.name, ver
+            elif self.staleness(r) <= float(max_staleness if max_staleness is not None else self.lag_seconds):
+                val, ver = r.get(key)
+                return val, r.name, ver
+        with self._cond:
+            return self._leader.get(key), 'leader', self._version
+
+    def staleness(self, replica):
+        """Seconds since the oldest write this replica has not applied yet (0 if caught up)."""
+        with self._cond:
+            idx = replica.applied_version - self._base
+            if idx >= len(self._log):
+                return 0.0
+            return max(0.0, self._clock() - self._log[idx][3])
+
+    # --- metrics ---
+    def stats(self):
+        with self._cond:
+            version = self._version
+            log_len = len(self._log)
+        out = []
+        for r in self.replicas:
+            out.append({
+                'name': r.name,
+                'applied_version': r.applied_version,
+                'lag_versions': version - r.applied_version,
+                'lag_seconds': round(self.staleness(r), 4),
+                'applied_entries': r.applied_entries,
+                'batches': r.batches,
+                'alive': bool(r.thread and r.thread.is_alive()),
+            })
+        return {
+            'leader_version': version,
+            'log_entries_retained': log_len,
+            'configured_lag_seconds': self.lag_seconds,
+            'batch_size': self.batch_size,
+            'replicas': out,
+            'max_lag_versions': max((x['lag_versions'] for x in out), default=0),
+            'max_lag_seconds': max((x['lag_seconds'] for x in out), default=0.0),
+        }
@@ -0,0 +1,439 @@
+import heapq
+import math
+import random
+import time
+from array import array
+from collections import deque
+
+# ===== Ricart–Agrawala discrete-event simulation =====
+# A heap-ordered event queue drives REQUEST/REPLY messages between nodes that
+# keep Lamport clocks and defer replies while they hold (or have priority for)
+# the critical section. Times are in milliseconds of simulated time.
+#
+# Two modes:
+#   exact     - every REQUEST and REPLY is its own event (O(N) per request).
+#   coalesced - nodes adopt the highest broadcast timestamp when they next
+#               request (the clock they would have after receiving those
+#               requests), so priority equals broadcast order and the waiting
+#               nodes form a FIFO queue. The entry order is an approximation
+#               (FIFO by broadcast time), not exact mode's order: with the
+#               same seed the two modes can admit nodes differently. A reply from node k to requester j
+#               then arrives at max(t_j + L_req, exit_k) + L_rep, so j's last
+#               reply arrives at
+#                   max(t_j + max of N-1 round trips, max over nodes ahead of
+#                       j of (exit_k + L_rep))
+#               The first term is drawn in O(1) from the distribution of the
+#               maximum; the second only needs the last few exits because
+#               exits are increasing and latencies bounded (exponential tails
+#               are cut at 40 means). Messages are counted, not scheduled:
+#               2(N-1) per entry as in exact mode. This is what lets 5,000
+#               nodes x 10 requests run in about a second.
+
+RELEASED, WANTED, HELD = 0, 1, 2
+
+# event kinds (heap entries are (time, seq, kind, a, b, ts))
+_ISSUE, _REQUEST, _REPLY, _ENTER, _EXIT = range(5)
+
+class Distribution:
+    """Latency/duration distribution: constant, uniform or exponential (with optional shift)."""
+
+    def __init__(self, kind='constant', value=1.0, low=0.0, high=1.0, mean=1.0, shift=0.0):
+        if kind not in ('constant', 'uniform', 'exponential'):
+            raise ValueError(f'unknown distribution: {kind}')
+        self.kind = kind
+        self.value = float(value)
+        self.low = float(low)
+        self.high = float(high)
+        self.mean = float(mean)
+        self.shift = float(shift)
+
+    def sample(self, rng):
+        if self.kind == 'constant':
+            return self.value
+        if self.kind == 'uniform':
+            return rng.uniform(self.low, self.high)
+        return self.shift + rng.expovariate(1.0 / self.mean) if self.mean > 0 else self.shift
+
+    def _rtt_quantile(self, q):
+        """Inverse CDF of the sum of two independent samples, given upper tail q = 1 - p."""
+        if self.kind == 'constant':
+            return 2 * self.value
+        if self.kind == 'uniform':
+            # sum of two uniforms is triangular on [2*low, 2*high]
+            w = self.high - self.low
+            if q >= 0.5:
+                return 2 * self.low + w * math.sqrt(2 * (1 - q))
+            return 2 * self.high - w * math.sqrt(2 * q)
+        if self.mean <= 0:
+            return 2 * self.shift
+        # Gamma(2, mean): tail q = e^-y (1 + y); solve y - ln(1+y) + ln q = 0 by Newton
+        lq = math.log(q)
+        y = max(1e-9, -lq + math.log(1 - lq))
+        for _ in range(30):
+            g = y - math.log1p(y) + lq
+            step = g * (1 + y) / y
+            y = max(1e-12, y - step)
+            if abs(step) < 1e-12 * (1 + y):
+                break
+        return 2 * self.shift + self.mean * y
+
+    def upper_bound(self):
+        """Largest one-way sample worth considering (exponential tail cut at 40 means)."""
+        if self.kind == 'constant':
+            return self.value
+        if self.kind == 'uniform':
+            return self.high
+        return self.shift + 40.0 * self.mean
+
+    def sample_rtt_max(self, rng, m):
+        """Draw max over m independent round trips (request + reply) in O(1)."""
+        if m <= 0:
+            return 0.0
+        u = 1.0 - rng.random()  # (0, 1]
+        q = -math.expm1(math.log(u) / m)  # 1 - u**(1/m), without cancellation
+        if q <= 0.0:
+            q = 5e-324
+        return self._rtt_quantile(q)
+
+    def to_dict(self):
+        if self.kind == 'constant':
+            return {'dist': 'constant', 'value': self.value}
+        if self.kind == 'uniform':
+            return {'dist': 'uniform', 'low': self.low, 'high': self.high}
+        return {'dist': 'exponential', 'mean': self.mean, 'shift': self.shift}
+
+def make_distribution(spec, default=1.0):
+    """Build a Distribution from a number (constant) or a dict like {'dist': 'uniform', 'low': 1, 'high': 3}."""
+    if spec is None:
+        return Distribution('constant', value=default)
+    if isinstance(spec, Distribution):
+        return spec
+    if isinstance(spec, (int, float)):
+        return Distribution('constant', value=spec)
+    spec = dict(spec)
+    kind = spec.pop('dist', spec.pop('kind', 'constant'))
+    return Distribution(kind, **{k: float(v) for k, v in spec.items()})
+
+
+class _Metrics:
+    """Running counters; nothing here grows with the number of CS entries."""
+
+    def __init__(self, record_order):
+        self.req_msgs = 0
+        self.reply_msgs = 0
+        self.entries = 0
+        self.events = 0
+        self.in_cs = 0
+        self.max_in_cs = 0
+        self.last_exit = None
+        self.sync_sum = 0.0
+        self.sync_max = 0.0
+        self.sync_n = 0
+        self.resp_sum = 0.0
+        self.resp_max = 0.0
+        self.order = [] if record_order else None
+
+    def entered(self, now, requested_at, node):
+        self.in_cs += 1
+        if self.in_cs > self.max_in_cs:
+            self.max_in_cs = self.in_cs
+        self.entries += 1
+        waited = now - requested_at
+        self.resp_sum += waited
+        if waited > self.resp_max:
+            self.resp_max = waited
+        # synchronization delay: last exit -> next entry, for requests already waiting at that exit
+        if self.last_exit is not None and requested_at <= self.last_exit:
+            d = now - self.last_exit
+            self.sync_sum += d
+            self.sync_n += 1
+            if d > self.sync_max:
+                self.sync_max = d
+        if self.order is not None:
+            self.order.append(node)
+
+    def exited(self, now):
+        self.in_cs -= 1
+        self.last_exit = now
+
+class RicartAgrawalaSimulation:
+    """Discrete-event Ricart–Agrawala run.
+
+    Either give `nodes` and `requests_per_node` (issue times come from the
+    think-time distribution), or `initial_requests` as (node_id, time) pairs.
+    Iterate `run()` to stream log entries; `summary` is filled when it ends.
+    """
+
+    EXACT_MAX_NODES = 64  # auto mode switches to coalesced above this; the API rejects exact beyond it
+
+    def __init__(self, nodes=0, requests_per_node=1, latency=None, cs_time=None, think_time=None,
+                 initial_requests=None, seed=None, coalesce=None, log_messages=False, record_order=False):
+        self.rng = random.Random(seed)
+        self.latency = make_distribution(latency, 1.0)
+        self.cs_time = make_distribution(cs_time, 1.0)
+        if initial_requests is not None:
+            ids = sorted({int(n) for n, _ in initial_requests})
+            self.node_ids = ids
+            self.n = len(ids)
+            index = {nid: i for i, nid in enumerate(ids)}
+            self._initial = sorted((float(t), index[int(n)]) for n, t in initial_requests)
+            self.requests_per_node = 0
+            self.think_time = make_distribution(think_time, 0.0)
+        else:
+            self.n = int(nodes)
+            self.node_ids = None
+            self._initial = None
+            self.requests_per_node = int(requests_per_node)
+            # default think time keeps offered load around 10% of the CS capacity
+            self.think_time = make_distribution(
+                think_time if think_time is not None else {'dist': 'exponential', 'mean': 10.0 * max(1, self.n)})
+        self.coalesce = self.n > self.EXACT_MAX_NODES if coalesce is None else bool(coalesce)
+        self.log_messages = log_messages and not self.coalesce
+        self.record_order = record_order
+        self.summary = None
+
+    def _node_id(self, i):
+        return self.node_ids[i] if self.node_ids is not None else i
+
+    def _seed_issues(self, heap):
+        """Initial ISSUE events; returns per-node count of requests still to issue later."""
+        if self._initial is not None:
+            for seq, (t, i) in enumerate(self._initial):
+                heap.append((t, seq, _ISSUE, i, 0, 0))
+            heapq.heapify(heap)
+            return array('l', [0]) * self.n, len(heap)
+        remaining = array('l', [max(0, self.requests_per_node - 1)]) * self.n
+        if self.requests_per_node <= 0:
+            return remaining, 0
+        sample = self.think_time.sample
+        rng = self.rng
+        for i in range(self.n):
+            heap.append((sample(rng), i, _ISSUE, i, 0, 0))
+        heapq.heapify(heap)
+        return remaining, self.n
+
+    def run(self):
+        """Generator over log entries: request, enter_cs and exit_cs (plus defer/reply in exact mode with log_messages)."""
+        m = _Metrics(self.record_order)
+        wall0 = time.perf_counter()
+        loop = self._run_coalesced(m) if self.coalesce else self._run_exact(m)
+        now = 0.0
+        for entry in loop:
+            now = entry['time']
+            yield entry
+        self._finish(m, now, time.perf_counter() - wall0)
+
+    def _run_exact(self, m):
+        n = self.n
+        rng = self.rng
+        lat = self.latency
+        push = heapq.heappush
+        pop = heapq.heappop
+        node_id = self._node_id
+        log_messages = self.log_messages
+
+        clock = array('q', [0]) * n
+        req_ts = array('q', [0]) * n
+        state = bytearray(n)
+        pending = array('l', [0]) * n
+        req_time = array('d', [0.0]) * n
+        deferred = {}   # node -> requesters waiting for its reply
+        backlog = {}    # node -> issues that arrived while it was still busy
+        heap = []
+        remaining, seq = self._seed_issues(heap)
+
+        while heap:
+            now, _, kind, a, b, ts = pop(heap)
+            m.events += 1
+            enter = -1
+
+            if kind == _ISSUE:
+                i = a
+                if state[i] != RELEASED:
+                    # one outstanding request per node; replay after it exits
+                    backlog[i] = backlog.get(i, 0) + 1
+                    continue
+                clock[i] += 1
+                c = req_ts[i] = clock[i]
+                state[i] = WANTED
+                req_time[i] = now
+                pending[i] = n - 1
+                for k in range(n):
+                    if k != i:
+                        push(heap, (now + lat.sample(rng), seq, _REQUEST, i, k, c)); seq += 1
+                m.req_msgs += n - 1
+                yield {'event': 'request', 'node': node_id(i), 'time': now, 'timestamp': c}
+                if n == 1:
+                    enter = i
+
+            elif kind == _REQUEST:
+                j, k = a, b
+                clock[k] = max(clock[k], ts) + 1
+                sk = state[k]
+                if sk == HELD or (sk == WANTED and (req_ts[k], k) < (ts, j)):
+                    deferred.setdefault(k, []).append(j)
+                    if log_messages:
+                        yield {'event': 'defer', 'node': node_id(k), 'to': node_id(j), 'time': now, 'timestamp': clock[k]}
+                else:
+                    clock[k] += 1
+                    push(heap, (now + lat.sample(rng), seq, _REPLY, k, j, clock[k])); seq += 1
+                    m.reply_msgs += 1
+                    if log_messages:
+                        yield {'event': 'reply', 'node': node_id(k), 'to': node_id(j), 'time': now, 'timestamp': clock[k]}
+
+            elif kind == _REPLY:
+                j = b
+                clock[j] = max(clock[j], ts) + 1
+                pending[j] -= 1
+                if pending[j] == 0 and state[j] == WANTED:
+                    enter = j
+
+            else:  # _EXIT
+                i = a
+                state[i] = RELEASED
+                m.exited(now)
+                clock[i] += 1
+                yield {'event': 'exit_cs', 'node': node_id(i), 'time': now, 'timestamp': clock[i]}
+                waiting = deferred.pop(i, None)
+                if waiting:
+                    c = clock[i]
+                    for j in waiting:
+                        push(heap, (now + lat.sample(rng), seq, _REPLY, i, j, c)); seq += 1
+                    m.reply_msgs += len(waiting)
+                if backlog.get(i):
+                    backlog[i] -= 1
+                    push(heap, (now, seq, _ISSUE, i, 0, 0)); seq += 1
+                elif remaining[i] > 0:
+                    remaining[i] -= 1
+                    push(heap, (now + self.think_time.sample(rng), seq, _ISSUE, i, 0, 0)); seq += 1
+
+            if enter >= 0:
+                state[enter] = HELD
+                m.entered(now, req_time[enter], node_id(enter))
+                push(heap, (now + self.cs_time.sample(rng), seq, _EXIT, enter, 0, 0)); seq += 1
+                yield {'event': 'enter_cs', 'node': node_id(enter), 'time': now, 'timestamp': clock[enter]}
+
+    def _run_coalesced(self, m):
+        n = self.n
+        rng = self.rng
+        lat = self.latency
+        lat_hi = lat.upper_bound()
+        push = heapq.heappush
+        pop = heapq.heappop
+        node_id = self._node_id
+        msgs_per_request = n - 1
+
+        clock = array('q', [0]) * n
+        busy = bytearray(n)
+        req_time = array('d', [0.0]) * n
+        fanin = array('d', [0.0]) * n       # t_j + max of the N-1 round trips
+        ahead = array('l', [0]) * n         # nodes queued or in the CS when j broadcast
+        queue = deque()                     # WANTED nodes in priority (= broadcast) order
+        exits = deque(maxlen=4096)          # recent exit times, newest last
+        holder = -1
+        backlog = {}
+        watermark = 0
+        heap = []
+        remaining, seq = self._seed_issues(heap)
+
+        def schedule_head(now):
+            # all nodes ahead of the head have exited; its last reply decides entry
+            j = queue[0]
+            ready = fanin[j]
+            cut = ready - lat_hi
+            for idx in range(min(ahead[j], len(exits))):
+                e = exits[-1 - idx]
+                if e < cut:
+                    break
+                r = e + lat.sample(rng)
+                if r > ready:
+                    ready = r
+                    cut = ready - lat_hi
+            return (max(ready, now), j)
+
+        while heap:
+            now, _, kind, a, b, ts = pop(heap)
+            m.events += 1
+
+            if kind == _ISSUE:
+                i = a
+                if busy[i]:
+                    backlog[i] = backlog.get(i, 0) + 1
+                    continue
+                busy[i] = 1
+                c = max(clock[i], watermark) + 1
+                clock[i] = watermark = c
+                req_time[i] = now
+                fanin[i] = now + lat.sample_rtt_max(rng, msgs_per_request)
+                ahead[i] = len(queue) + (1 if holder >= 0 else 0)
+                m.req_msgs += msgs_per_request
+                m.reply_msgs += msgs_per_request
+                queue.append(i)
+                yield {'event': 'request', 'node': node_id(i), 'time': now, 'timestamp': c}
+                if holder < 0 and len(queue) == 1:
+                    t, j = schedule_head(now)
+                    push(heap, (t, seq, _ENTER, j, 0, 0)); seq += 1
+
+            elif kind == _ENTER:
+                j = queue.popleft()
+                holder = j
+                clock[j] = max(clock[j], watermark) + 1
+                m.entered(now, req_time[j], node_id(j))
+                push(heap, (now + self.cs_time.sample(rng), seq, _EXIT, j, 0, 0)); seq += 1
+                yield {'event': 'enter_cs', 'node': node_id(j), 'time': now, 'timestamp': clock[j]}
+
+            else:  # _EXIT
+                i = a
+                holder = -1
+                busy[i] = 0
+                m.exited(now)
+                exits.append(now)
+                clock[i] += 1
+                yield {'event': 'exit_cs', 'node': node_id(i), 'time': now, 'timestamp': clock[i]}
+                if queue:
+                    t, j = schedule_head(now)
+                    push(heap, (t, seq, _ENTER, j, 0, 0)); seq += 1
+                if backlog.get(i):
+                    backlog[i] -= 1
+                    push(heap, (now, seq, _ISSUE, i, 0, 0)); seq += 1
+                elif remaining[i] > 0:
+                    remaining[i] -= 1
+                    push(heap, (now + self.think_time.sample(rng), seq, _ISSUE, i, 0, 0)); seq += 1
+
+    def _finish(self, m, now, wall):
+        total_msgs = m.req_msgs + m.reply_msgs
+        entries = m.entries
+        self.summary = {
+            'mode': 'coalesced' if self.coalesce else 'exact',
+            'nodes': self.n,
+            'cs_entries': entries,
+            'messages': {
+                'request': m.req_msgs,
+                'reply': m.reply_msgs,
+                'total': total_msgs,
+                'per_cs_entry': round(total_msgs / entries, 3) if entries else 0,
+            },
+            'sync_delay_ms': {
+                'mean': round(m.sync_sum / m.sync_n, 6) if m.sync_n else None,
+                'max': round(m.sync_max, 6) if m.sync_n else None,
+                'samples': m.sync_n,
+            },
+            'response_time_ms': {
+                'mean': round(m.resp_sum / entries, 6) if entries else None,
+                'max': round(m.resp_max, 6) if entries else None,
+            },
+            'sim_time_ms': round(now, 6),
+            'throughput_cs_per_sec': round(entries / (now / 1000.0), 3) if now > 0 else None,
+            'max_concurrent_cs': m.max_in_cs,
+            'events_processed': m.events,
+            'wall_seconds': round(wall, 4),
+            'latency': self.latency.to_dict(),
+            'cs_time': self.cs_time.to_dict(),
+        }
+        if m.order is not None:
+            self.summary['order'] = m.order
+
+    def run_to_completion(self):
+        for _ in self.run():
+            pass
+        return self.summary
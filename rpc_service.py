@@ -0,0 +1,230 @@
+import http.client
+import threading
+import time
+import queue
+from collections import deque
+from contextlib import contextmanager
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+import xmlrpc.client
+
+# ===== XML-RPC service =====
+# Threaded XML-RPC server with system.multicall batching. Recorded events go
+# into a bounded ring buffer (oldest entries are dropped when full) and are
+# flushed to the logs table in batches by a background thread.
+
+class _KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    # HTTP/1.1 lets pooled ServerProxy clients reuse their TCP connection
+    protocol_version = 'HTTP/1.1'
+
+class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class EventBuffer:
+    """Bounded ring buffer of RPC events with monotonically increasing sequence numbers."""
+
+    def __init__(self, capacity=10000):
+        self.capacity = max(1, int(capacity))
+        self._events = deque(maxlen=self.capacity)   # (seq, received_at, event)
+        self._pending = deque(maxlen=self.capacity)  # not yet flushed to the database
+        self._lock = threading.Lock()
+        self._seq = 0
+        self.dropped = 0
+        self.flushed = 0
+
+    def append(self, ev):
+        with self._lock:
+            self._seq += 1
+            item = (self._seq, time.time(), ev)
+            if len(self._pending) == self.capacity:
+                # oldest unflushed event is lost; keep count so it shows in stats
+                self.dropped += 1
+            self._events.append(item)
+            self._pending.append(item)
+            return self._seq
+
+    def query(self, since_seq=0, limit=100):
+        """Return up to `limit` buffered events with seq > since_seq, oldest first."""
+        limit = max(1, min(int(limit), self.capacity))
+        with self._lock:
+            items = [it for it in self._events if it[0] > since_seq]
+        return [{'seq': s, 'received_at': ts, 'event': ev} for s, ts, ev in items[:limit]]
+
+    def drain(self, max_items=None):
+        """Pop pending (unflushed) events for persistence."""
+        with self._lock:
+            n = len(self._pending) if max_items is None else min(max_items, len(self._pending))
+            return [self._pending.popleft() for _ in range(n)]
+
+    def mark_flushed(self, n):
+        with self._lock:
+            self.flushed += n
+
+    def stats(self):
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'buffered': len(self._events),
+                'pending_flush': len(self._pending),
+                'last_seq': self._seq,
+                'dropped': self.dropped,
+                'flushed': self.flushed,
+            }
+
+def _persist_events(app, items):
+    """Write drained events to the logs table in one executemany insert."""
+    from datetime import datetime
+    from models import Log, db
+    rows = []
+    for seq, ts, ev in items:
+        ev = ev if isinstance(ev, dict) else {'value': ev}
+        rows.append({
+            'who_user_id': ev.get('teacher_id'),
+            'username': ev.get('teacher_username'),
+            'role': 'rpc',
+            'event_type': 'rpc_event',
+            'meta': {'seq': seq, 'event': ev},
+            'created_at': datetime.utcfromtimestamp(ts),
+        })
+    with app.app_context():
+        db.session.execute(Log.__table__.insert(), rows)
+        db.session.commit()
+
+class RPCService:
+    """Owns the XML-RPC server thread, the event buffer and the periodic flusher."""
+
+    def __init__(self, host='127.0.0.1', port=9000, buffer_size=10000, flush_interval=2.0, flush_batch=1000, app=None):
+        self.host = host
+        self.port = port
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.app = app
+        self.buffer = EventBuffer(buffer_size)
+        self.server = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    # --- exposed RPC methods ---
+    def ping(self):
+        return 'pong'
+
+    def record_event(self, ev):
+        try:
+            self.buffer.append(ev)
+            return True
+        except Exception:
+            return False
+
+    def query_events(self, since_seq=0, limit=100):
+        return {'events': self.buffer.query(since_seq, limit), 'stats': self.buffer.stats()}
+
+    def stats(self):
+        return self.buffer.stats()
+
+    # --- lifecycle ---
+    def start(self):
+        server = ThreadedXMLRPCServer((self.host, self.port), requestHandler=_KeepAliveRequestHandler,
+                                      allow_none=True, logRequests=False)
+        server.register_multicall_functions()
+        server.register_function(self.ping, 'ping')
+        server.register_function(self.record_event, 'record_event')
+        server.register_function(self.query_events, 'query_events')
+        server.register_function(self.stats, 'stats')
+        self.server = server
+        self.port = server.server_address[1]  # resolves port 0 to the bound port
+        th = threading.Thread(target=server.serve_forever, name='xmlrpc-server', daemon=True)
+        th.start()
+        self._threads.append(th)
+        if self.app is not None and self.flush_interval:
+            fl = threading.Thread(target=self._flush_loop, name='xmlrpc-flusher', daemon=True)
+            fl.start()
+            self._threads.append(fl)
+        return self
+
+    def flush(self):
+        """Persist all pending events now; returns the number written."""
+        total = 0
+        while True:
+            items = self.buffer.drain(self.flush_batch)
+            if not items:
+                return total
+            try:
+                _persist_events(self.app, items)
+            except Exception:
+                # database unavailable: events stay readable from the ring buffer
+                return total
+            total += len(items)
+            self.buffer.mark_flushed(len(items))
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def stop(self):
+        self._stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.app is not None:
+            self.flush()
+
+_TRANSPORT_ERRORS = (OSError, http.client.HTTPException, xmlrpc.client.ProtocolError)
+
+class RPCClientPool:
+    """Small pool of ServerProxy clients. ServerProxy is not thread-safe, so each
+    request borrows one; idle proxies keep their keep-alive connection open."""
+
+    def __init__(self, url, size=8):
+        self.url = url
+        self.size = max(1, int(size))
+        self._idle = queue.LifoQueue(maxsize=self.size)
+
+    def _new_proxy(self):
+        return xmlrpc.client.ServerProxy(self.url, allow_none=True)
+
+    @contextmanager
+    def proxy(self):
+        try:
+            p = self._idle.get_nowait()
+        except queue.Empty:
+            p = self._new_proxy()
+        broken = False
+        try:
+            yield p
+        except _TRANSPORT_ERRORS:
+            broken = True
+            raise
+        finally:
+            # a Fault or an error in the caller leaves the connection usable; only a
+            # broken transport drops the proxy instead of returning it to the pool
+            if broken:
+                try:
+                    p('close')()
+                except Exception:
+                    pass
+            else:
+                try:
+                    self._idle.put_nowait(p)
+                except queue.Full:
+                    p('close')()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait()('close')()
+            except queue.Empty:
+                return
+
+_client_pool = None
+_client_pool_lock = threading.Lock()
+
+def get_client_pool():
+    """Process-wide client pool for the configured RPC server."""
+    global _client_pool
+    if _client_pool is None:
+        from config import Config
+        with _client_pool_lock:
+            if _client_pool is None:
+                _client_pool = RPCClientPool(f'http://{Config.RPC_HOST}:{Config.RPC_PORT}', Config.RPC_POOL_SIZE)
+    return _client_pool
@@ -0,0 +1,353 @@
+import heapq
+import os
+import socket
+import statistics
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+# ===== Exam lifecycle scheduler =====
+# One background thread per app process keeps a heap of upcoming exam
+# deadlines built from Exam.start_at / duration_minutes:
+#
+#   prewarm   `prewarm_seconds` before start_at: build the exam payload and
+#             answer key (exam_cache). Runs in every process that serves
+#             students, since each one has its own cache: a web worker that
+#             does not own the scheduler service runs a prewarm-only instance
+#             (finalize=False; no lease, no finalize jobs).
+#   finalize  at start_at + duration: grade stored in-progress answers, insert
+#             marks for absent students in bulk and write the exam aggregates,
+#             all in one transaction. Only the process holding the leader lease
+#             (scheduler_leases table) runs it, and the exam_aggregates primary
+#             key makes a second run a no-op even if two leaders ever overlap.
+#
+# Heap entries are never removed; an entry whose time no longer matches the
+# exam's current schedule is skipped when popped. refresh() (called by
+# api_update_exam) and a periodic resync pick up schedule changes, including
+# ones made through other processes.
+
+LEASE_NAME = 'exam_scheduler'
+ABSENT_POLICIES = ('zero', 'null', 'none')
+
+class ExamScheduler:
+    def __init__(self, app, prewarm_seconds=300, lease_seconds=30, resync_seconds=60, catchup_hours=24,
+                 absent_marks='none', clock=time.time, finalize=True):
+        if absent_marks not in ABSENT_POLICIES:
+            raise ValueError(f'absent_marks must be one of {ABSENT_POLICIES}')
+        self.app = app
+        self.prewarm_seconds = float(prewarm_seconds)
+        self.lease_seconds = float(lease_seconds)
+        self.resync_seconds = float(resync_seconds)
+        self.catchup_seconds = float(catchup_hours) * 3600
+        self.absent_marks = absent_marks
+        self.finalizes = bool(finalize)
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self._clock = clock
+        self._heap = []         # (due_ts, seq, kind, exam_id)
+        self._seq = 0
+        self._schedule = {}     # exam_id -> (start_ts, end_ts)
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+        self.is_leader = False
+        self._lease_due = 0.0 if self.finalizes else float('inf')  # prewarm-only: never takes the lease
+        self._resync_due = 0.0
+        self.counters = {'prewarmed': 0, 'finalized': 0, 'skipped_not_leader': 0, 'errors': 0}
+        self.last_error = None
+
+    # --- lifecycle ---
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return self
+            self._thread = threading.Thread(target=self._run, name='exam-scheduler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self.is_leader:
+            with self.app.app_context():
+                self._release_lease()
+
+    # --- schedule ---
+    def _push(self, due_ts, kind, exam_id):
+        heapq.heappush(self._heap, (due_ts, self._seq, kind, exam_id))
+        self._seq += 1
+
+    def _set(self, exam_id, start_ts, end_ts):
+        """Record an exam's schedule and queue its jobs (caller holds _cond)."""
+        if start_ts is None:
+            if self._schedule.pop(exam_id, None) is not None:
+                self._cond.notify_all()
+            return
+        if self._schedule.get(exam_id) == (start_ts, end_ts):
+            return
+        self._schedule[exam_id] = (start_ts, end_ts)
+        now = self._clock()
+        if start_ts > now:
+            self._push(start_ts - self.prewarm_seconds, 'prewarm', exam_id)
+        if self.finalizes:
+            self._push(end_ts, 'finalize', exam_id)
+        self._cond.notify_all()
+
+    @staticmethod
+    def _times(exam):
+        if not exam.is_published or not exam.start_at:
+            return None, None
+        start_ts = exam.start_at.timestamp()  # naive local time, as compared by the student routes
+        return start_ts, start_ts + (exam.duration_minutes or 0) * 60
+
+    def refresh(self, exam_id):
+        """Re-read one exam's schedule (after it was created or edited)."""
+        from models import Exam, db
+        exam = db.session.get(Exam, exam_id)
+        start_ts, end_ts = self._times(exam) if exam else (None, None)
+        with self._cond:
+            self._set(exam_id, start_ts, end_ts)
+
+    def _resync(self):
+        """Load every published exam that has not closed yet or closed within the catch-up window."""
+        from models import Exam, ExamAggregate, db
+        now = self._clock()
+        # start_at is naive local time; coarse filter in SQL, exact end check below
+        horizon = datetime.fromtimestamp(now - self.catchup_seconds) - timedelta(days=1)
+        rows = (db.session.query(Exam)
+                .outerjoin(ExamAggregate, ExamAggregate.exam_id == Exam.id)
+                .filter(Exam.is_published.is_(True), Exam.start_at.isnot(None),
+                        Exam.start_at >= horizon, ExamAggregate.exam_id.is_(None))
+                .all())
+        with self._cond:
+            seen = set()
+            for exam in rows:
+                start_ts, end_ts = self._times(exam)
+                if end_ts < now - self.catchup_seconds:
+                    continue
+                seen.add(exam.id)
+                self._set(exam.id, start_ts, end_ts)
+            for exam_id in [e for e in self._schedule if e not in seen]:
+                del self._schedule[exam_id]
+
+    # --- leader lease ---
+    def _renew_lease(self):
+        from sqlalchemy import or_
+        from sqlalchemy.exc import IntegrityError
+        from models import SchedulerLease, db
+        t = SchedulerLease.__table__
+        now = datetime.utcnow()
+        expires = now + timedelta(seconds=self.lease_seconds)
+        with db.engine.begin() as conn:
+            res = conn.execute(t.update()
+                               .where(t.c.name == LEASE_NAME, or_(t.c.owner == self.worker_id, t.c.expires_at < now))
+                               .values(owner=self.worker_id, expires_at=expires))
+            won = res.rowcount == 1
+            exists = won or conn.execute(t.select().where(t.c.name == LEASE_NAME)).first() is not None
+        if not exists:
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(t.insert().values(name=LEASE_NAME, owner=self.worker_id, expires_at=expires))
+                won = True
+            except IntegrityError:
+                won = False
+        became_leader = won and not self.is_leader
+        self.is_leader = won
+        return became_leader
+
+    def _release_lease(self):
+        from models import SchedulerLease, db
+        t = SchedulerLease.__table__
+        with db.engine.begin() as conn:
+            conn.execute(t.delete().where(t.c.name == LEASE_NAME, t.c.owner == self.worker_id))
+        self.is_leader = False
+
+    # --- main loop ---
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                with self._cond:
+                    if self._stop:
+                        return
+                now = self._clock()
+                try:
+                    if now >= self._lease_due:
+                        self._lease_due = now + self.lease_seconds / 3
+                        if self._renew_lease():
+                            # new leader: requeue everything so finalize jobs skipped as a follower run now
+                            with self._cond:
+                                self._schedule.clear()
+                            self._resync_due = 0
+                    if now >= self._resync_due:
+                        self._resync_due = now + self.resync_seconds
+                        self._resync()
+                    self._run_due(now)
+                except Exception as e:  # keep the scheduler alive; surface the error in stats
+                    self.counters['errors'] += 1
+                    self.last_error = f'{type(e).__name__}: {e}'
+                    self.app.logger.exception('exam scheduler tick failed')
+                finally:
+                    from models import db
+                    db.session.remove()
+                with self._cond:
+                    if self._stop:
+                        return
+                    wake = min(self._lease_due, self._resync_due)
+                    if self._heap:
+                        wake = min(wake, self._heap[0][0])
+                    self._cond.wait(max(0.0, min(wake - self._clock(), self.lease_seconds)))
+
+    def _run_due(self, now):
+        while True:
+            with self._cond:
+                if not self._heap or self._heap[0][0] > now:
+                    return
+                due_ts, _, kind, exam_id = heapq.heappop(self._heap)
+                sched = self._schedule.get(exam_id)
+                if sched is None:
+                    continue
+                start_ts, end_ts = sched
+                if kind == 'prewarm' and due_ts != start_ts - self.prewarm_seconds:
+                    continue  # stale entry, the exam was rescheduled
+                if kind == 'finalize' and due_ts != end_ts:
+                    continue
+            try:
+                if kind == 'prewarm':
+                    self.prewarm(exam_id)
+                elif self.is_leader:
+                    self.finalize(exam_id)
+                    with self._cond:
+                        self._schedule.pop(exam_id, None)
+                else:
+                    self.counters['skipped_not_leader'] += 1
+            except Exception:
+                # forget the exam so the next resync queues its jobs again
+                with self._cond:
+                    self._schedule.pop(exam_id, None)
+                raise
+
+    # --- jobs ---
+    def prewarm(self, exam_id):
+        import exam_cache
+        exam_cache.warm(exam_id)
+        self.counters['prewarmed'] += 1
+
+    def finalize(self, exam_id, now=None):
+        """Grade unsubmitted attempts, add absent marks and store the aggregates for one closed exam.
+
+        Returns the aggregate dict, or None if the exam is not due or was already finalized.
+        """
+        from sqlalchemy import exists, literal, select
+        from sqlalchemy.exc import IntegrityError
+        import exam_cache
+        import shards
+        from grading import apply_cheating_penalty, score_answers
+        from models import Exam, ExamAggregate, ExamAttempt, Mark, User, db
+        from utils import add_log, relay_event
+
+        exam = db.session.get(Exam, exam_id)
+        start_ts, end_ts = self._times(exam) if exam else (None, None)
+        if start_ts is None or (now or self._clock()) < end_ts:
+            return None
+        if db.session.get(ExamAggregate, exam_id) is not None:
+            return None
+        closed_at = datetime.utcnow()
+        key = exam_cache.load_bundle(exam_id).answer_key
+
+        m, at, u = Mark.__table__, ExamAttempt.__table__, User.__table__
+        db.session.rollback()  # writes go through exam_db's own connection
+        try:
+            # marks and attempts live in the exam's shard when sharding is on; users and
+            # exam_aggregates resolve to the main database from the same connection
+            with shards.exam_db(exam_id) as conn:
+                submitted = conn.execute(select(m.c.student_id, m.c.marks, m.c.cheating_count)
+                                         .where(m.c.exam_id == exam_id)).all()
+                marked = {sid for sid, _, _ in submitted}
+                attempts = conn.execute(select(at.c.id, at.c.student_id, at.c.answers, at.c.cheating_count)
+                                        .where(at.c.exam_id == exam_id, at.c.submitted_at.is_(None))).all()
+                graded_rows, attempt_ids = [], []
+                for a in attempts:
+                    attempt_ids.append(a.id)
+                    if a.student_id in marked:
+                        continue
+                    final, _ = apply_cheating_penalty(score_answers(a.answers, key), a.cheating_count or 0)
+                    graded_rows.append({'exam_id': exam_id, 'student_id': a.student_id, 'marks': final,
+                                        'graded_at': closed_at, 'cheating_count': a.cheating_count or 0})
+                    marked.add(a.student_id)
+
+                if graded_rows:
+                    conn.execute(m.insert(), graded_rows)
+                if attempt_ids:
+                    conn.execute(at.update().where(at.c.id.in_(attempt_ids)).values(submitted_at=closed_at))
+                absent = 0
+                if self.absent_marks != 'none':
+                    absent_value = 0.0 if self.absent_marks == 'zero' else None
+                    sel = (select(literal(exam_id), u.c.id, literal(absent_value), literal(closed_at), literal(0))
+                           .where(u.c.role == 'student',
+                                  ~exists().where(m.c.exam_id == exam_id, m.c.student_id == u.c.id)))
+                    res = conn.execute(m.insert().from_select(
+                        ['exam_id', 'student_id', 'marks', 'graded_at', 'cheating_count'], sel))
+                    absent = max(0, res.rowcount or 0)
+
+                scores = [s for _, s, _ in submitted if s is not None] + [r['marks'] for r in graded_rows]
+                agg = ExamAggregate(
+                    exam_id=exam_id,
+                    submitted=len(submitted),
+                    auto_graded=len(graded_rows),
+                    absent=absent,
+                    cheating=sum(1 for _, _, c in submitted if c) + sum(1 for r in graded_rows if r['cheating_count']),
+                    mean=round(statistics.fmean(scores), 4) if scores else None,
+                    median=statistics.median(scores) if scores else None,
+                    min=min(scores) if scores else None,
+                    max=max(scores) if scores else None,
+                    finalized_at=closed_at,
+                    finalized_by=self.worker_id,
+                )
+                # indexed in the same main-database commit as the aggregate: from then on
+                # my_marks finds this exam's marks through core.student_exams (see shards.py)
+                shards.index_marks(conn, exam_id)
+                # written last: its primary key is what makes finalize run once
+                conn.execute(ExamAggregate.__table__.insert().values(
+                    {c.name: getattr(agg, c.name) for c in ExamAggregate.__table__.columns}))
+        except IntegrityError:
+            return None  # another process finalized it first
+        out = aggregate_dict(agg)
+        self.counters['finalized'] += 1
+        add_log(None, 'scheduler', 'system', 'exam_finalized', out)
+        relay_event({'type': 'exam_finalized', **out, 'time': closed_at.isoformat()})
+        return out
+
+    def stats(self):
+        with self._cond:
+            upcoming = sorted((ts, kind, eid) for ts, _, kind, eid in self._heap
+                              if eid in self._schedule and ts in (self._schedule[eid][0] - self.prewarm_seconds,
+                                                                  self._schedule[eid][1]))
+        import exam_cache
+        return {
+            'worker_id': self.worker_id,
+            'finalizes': self.finalizes,
+            'is_leader': self.is_leader,
+            'scheduled_exams': len(self._schedule),
+            'next_jobs': [{'at': datetime.fromtimestamp(ts).isoformat(), 'job': kind, 'exam_id': eid}
+                          for ts, kind, eid in upcoming[:20]],
+            'cached_exams': exam_cache.cached_exam_ids(),
+            'counters': dict(self.counters),
+            'last_error': self.last_error,
+        }
+
+def aggregate_dict(agg):
+    return {
+        'exam_id': agg.exam_id,
+        'submitted': agg.submitted,
+        'auto_graded': agg.auto_graded,
+        'absent': agg.absent,
+        'cheating': agg.cheating,
+        'mean': agg.mean,
+        'median': agg.median,
+        'min': agg.min,
+        'max': agg.max,
+        'finalized_at': agg.finalized_at.isoformat() if agg.finalized_at else None,
+    }
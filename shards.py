@@ -0,0 +1,463 @@
+import glob
+import heapq
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from datetime import datetime
+
+from sqlalchemy import MetaData, Table, Column, create_engine, event, func, literal, select
+from sqlalchemy.engine import make_url
+
+import log_search
+from models import ExamAggregate, ExamAttempt, Log, Mark, StudentExam, db
+
+log = logging.getLogger(__name__)
+
+# ===== Per-exam shards =====
+# With sharding on, the write-hot per-exam rows (marks, exam_attempts and every
+# log whose meta carries an exam_id) live in their own SQLite file,
+# SHARD_DIR/exam_<id>.sqlite, so exams running at the same time no longer
+# queue on one database write lock. users/exams/questions and everything else
+# stay in the main database.
+#
+# Each shard connection ATTACHes the main database as `core`. SQLite resolves
+# an unqualified table name through the shard first and then the attached
+# database, so the same Core statements work on both layouts: `marks` means
+# the shard's table and `users`/`exams`/`exam_aggregates` the main one. Code
+# that touches per-exam rows asks exam_db(exam_id) for a connection and never
+# needs to know which layout is active.
+#
+# Shard files use WAL so teacher reads do not block student writes. A write
+# that spans a shard and `core` (the scheduler's finalize) commits per file,
+# with the main-database row written last.
+#
+# Reads that span students or the log stream avoid opening every shard.
+# my_marks reads the shards of exams that are not finalized yet (no
+# exam_aggregates row) plus those core.student_exams lists for the student.
+# Submits never write core.student_exams, so they stay off the main write
+# lock: finalize adds every mark of the exam in the same main-database commit
+# as its aggregate, and a mark first written after that (a late submit, a
+# teacher's set_mark) is indexed by note_mark before the shard write, so a
+# crash in between leaves at most an extra index row, never a hidden mark.
+# recent_logs skips shards whose files were last written before the oldest
+# row it would keep. Each shard has its own log search index (logs_fts, see
+# log_search.py), created when the shard is opened; search_logs queries the
+# main index and the shard ones and merges the hits.
+
+_SHARDED = (Mark.__table__, ExamAttempt.__table__, Log.__table__)
+_FILE = re.compile(r'^exam_(\d+)\.sqlite$')
+
+def _shard_metadata():
+    # plain copies of the sharded tables: no foreign keys (their targets live in core)
+    md = MetaData()
+    for t in _SHARDED:
+        cols = [Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable, default=c.default)
+                for c in t.columns]
+        Table(t.name, md, *cols)
+    from sqlalchemy import Index, UniqueConstraint
+    Index('ix_marks_exam_student', md.tables['marks'].c.exam_id, md.tables['marks'].c.student_id)
+    md.tables['exam_attempts'].append_constraint(
+        UniqueConstraint('exam_id', 'student_id', name='uq_exam_attempts_exam_student'))
+    Index('ix_logs_event_type_id', md.tables['logs'].c.event_type, md.tables['logs'].c.id)
+    return md
+
+SHARD_METADATA = _shard_metadata()
+
+class UnknownExam(LookupError):
+    """No shard exists for the exam and the exam is not in the main database."""
+
+class ShardRouter:
+    def __init__(self, shard_dir, main_uri, max_open=64, busy_timeout=30):
+        url = make_url(main_uri)
+        if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+            raise ValueError('sharding needs a file-based SQLite main database')
+        self.shard_dir = os.path.abspath(shard_dir)
+        self.main_path = os.path.abspath(url.database)
+        self.max_open = max(1, int(max_open))
+        self.busy_timeout = float(busy_timeout)
+        self._engines = OrderedDict()   # exam_id -> engine, least recently used first
+        self._lock = threading.Lock()
+        os.makedirs(self.shard_dir, exist_ok=True)
+
+    def path(self, exam_id):
+        return os.path.join(self.shard_dir, f'exam_{int(exam_id)}.sqlite')
+
+    def _exam_exists(self, exam_id):
+        conn = sqlite3.connect(self.main_path, timeout=self.busy_timeout)
+        try:
+            return conn.execute('SELECT 1 FROM exams WHERE id = ?', (exam_id,)).fetchone() is not None
+        finally:
+            conn.close()
+
+    def _open(self, exam_id):
+        path = self.path(exam_id)
+        # a new shard file only for a real exam: ids also arrive from client-supplied log meta
+        if not os.path.exists(path) and not self._exam_exists(exam_id):
+            raise UnknownExam(exam_id)
+        # a small pool per shard; dispose() on eviction closes its idle connections
+        engine = create_engine('sqlite:///' + path, pool_size=2, max_overflow=8,
+                               connect_args={'timeout': self.busy_timeout, 'check_same_thread': False})
+        main_path = self.main_path
+
+        @event.listens_for(engine, 'connect')
+        def _setup(dbapi_conn, _):
+            cur = dbapi_conn.cursor()
+            cur.execute('PRAGMA journal_mode=WAL')
+            cur.execute('PRAGMA synchronous=NORMAL')
+            cur.execute('ATTACH DATABASE ? AS core', (main_path,))
+            cur.close()
+        SHARD_METADATA.create_all(engine)
+        # shards from before per-shard search get their existing logs indexed here
+        log_search.ensure_index(engine, log)
+        return engine
+
+    def engine(self, exam_id):
+        exam_id = int(exam_id)
+        with self._lock:
+            eng = self._engines.get(exam_id)
+            if eng is not None:
+                self._engines.move_to_end(exam_id)
+                return eng
+        eng = self._open(exam_id)
+        with self._lock:
+            cur = self._engines.get(exam_id)
+            if cur is not None:
+                eng.dispose()
+                return cur
+            self._engines[exam_id] = eng
+            while len(self._engines) > self.max_open:
+                _, old = self._engines.popitem(last=False)
+                old.dispose()
+        return eng
+
+    def last_write(self, exam_id):
+        """UTC time of the last write to the shard (its file or WAL), or None without a file."""
+        path = self.path(exam_id)
+        times = [os.path.getmtime(p) for p in (path, path + '-wal') if os.path.exists(p)]
+        return datetime.utcfromtimestamp(max(times)) if times else None
+
+    def exam_ids(self):
+        """Exams that have a shard file, in id order."""
+        out = []
+        for p in glob.glob(os.path.join(self.shard_dir, 'exam_*.sqlite')):
+            m = _FILE.match(os.path.basename(p))
+            if m:
+                out.append(int(m.group(1)))
+        return sorted(out)
+
+    def close(self, close=True):
+        """Dispose the open engines; close=False (in a forked child) leaves the parent's connections alone."""
+        with self._lock:
+            engines, self._engines = list(self._engines.values()), OrderedDict()
+        for eng in engines:
+            eng.dispose(close=close)
+
+_router = None
+
+def configure(enabled, shard_dir=None, main_uri=None, max_open=64):
+    """Switch sharding on (returning the router) or off for this process."""
+    global _router
+    if _router is not None:
+        _router.close()
+    _router = ShardRouter(shard_dir, main_uri, max_open=max_open) if enabled else None
+    return _router
+
+def enabled():
+    return _router is not None
+
+def router():
+    return _router
+
+@contextmanager
+def exam_db(exam_id):
+    """A connection (in a transaction, committed on exit) that holds exam_id's marks, attempts and exam logs.
+
+    Raises UnknownExam for an id that has neither a shard nor a row in exams.
+    """
+    engine = _router.engine(exam_id) if _router is not None else db.engine
+    with engine.begin() as conn:
+        yield conn
+
+def index_marks(conn, exam_id, student_ids=None):
+    """Add core.student_exams rows for exam_id: the given students, or everyone with a mark in conn's marks table."""
+    if _router is None:
+        return
+    se, m = StudentExam.__table__, Mark.__table__
+    ins = se.insert().prefix_with('OR IGNORE')
+    if student_ids is not None:
+        if student_ids:
+            conn.execute(ins, [{'student_id': sid, 'exam_id': exam_id} for sid in set(student_ids)])
+    else:
+        conn.execute(ins.from_select(['student_id', 'exam_id'],
+                                     select(m.c.student_id, literal(exam_id)).where(m.c.exam_id == exam_id).distinct()))
+
+def note_mark(exam_id, student_id):
+    """Call before writing a mark: indexes it in the main database if the exam is already finalized.
+
+    Until finalize, my_marks reads the exam's shard anyway, so submits during
+    an exam touch only their shard.
+    """
+    if _router is None or db.session.get(ExamAggregate, exam_id) is None:
+        return
+    with db.engine.begin() as conn:
+        index_marks(conn, exam_id, [student_id])
+
+def exam_of(meta):
+    """exam_id from a log's meta, or None; decides whether the log row belongs in a shard."""
+    if not isinstance(meta, dict) or meta.get('exam_id') in (None, ''):
+        return None
+    try:
+        return int(meta['exam_id'])
+    except (TypeError, ValueError):
+        return None
+
+# ===== Cross-shard reporting =====
+
+def count_marks(exam_ids):
+    m = Mark.__table__
+    if _router is None:
+        return db.session.execute(select(func.count()).select_from(m).where(m.c.exam_id.in_(exam_ids))).scalar()
+    total = 0
+    for eid in exam_ids:
+        if os.path.exists(_router.path(eid)):
+            with exam_db(eid) as conn:
+                total += conn.execute(select(func.count()).select_from(m).where(m.c.exam_id == eid)).scalar()
+    return total
+
+def marks_in_range(exam_ids, lo, hi):
+    """(student_id, exam_id, marks) for students lo..hi in the given exams, ordered by exam, student, id."""
+    m = Mark.__table__
+    cols = (m.c.student_id, m.c.exam_id, m.c.marks)
+    order = (m.c.exam_id, m.c.student_id, m.c.id)
+    if _router is None:
+        return db.session.connection().execute(
+            select(*cols).where(m.c.exam_id.in_(exam_ids), m.c.student_id.between(lo, hi)).order_by(*order)).all()
+    out = []
+    for eid in exam_ids:
+        if os.path.exists(_router.path(eid)):
+            with exam_db(eid) as conn:
+                out.extend(conn.execute(select(*cols).where(m.c.exam_id == eid, m.c.student_id.between(lo, hi))
+                                        .order_by(*order)).all())
+    return out
+
+def marks_for_student(student_id):
+    """Every mark row of one student across the main database and the shards that can hold one (see above)."""
+    m, se, ag = Mark.__table__, StudentExam.__table__, ExamAggregate.__table__
+    q = select(m.c.exam_id, m.c.marks, m.c.cheating_count, m.c.graded_at).where(m.c.student_id == student_id)
+    rows = list(db.session.execute(q.order_by(m.c.id)).all())
+    if _router is not None:
+        exam_ids = set(db.session.execute(select(se.c.exam_id).where(se.c.student_id == student_id)).scalars())
+        finalized = set(db.session.execute(select(ag.c.exam_id)).scalars())
+        exam_ids.update(eid for eid in _router.exam_ids() if eid not in finalized)
+        for eid in sorted(exam_ids):
+            if not os.path.exists(_router.path(eid)):
+                continue
+            with exam_db(eid) as conn:
+                rows.extend(conn.execute(q.order_by(m.c.id)).all())
+    return rows
+
+def recent_logs(limit, event_type=None, user_id=None, exam_ids=None):
+    """Newest-first log rows from the main database merged with the shards.
+
+    exam_ids limits which shards are read (main-database rows are not filtered
+    by exam). Shards are visited most recently written first, and the walk
+    stops once `limit` rows are in hand that are all newer than the next
+    shard's last write. Each row has a `shard` attribute: the exam id, or None
+    for main.
+    """
+    t = Log.__table__
+    q = select(t.c.id, t.c.who_user_id, t.c.username, t.c.role, t.c.event_type, t.c.meta, t.c.created_at)
+    if event_type:
+        q = q.where(t.c.event_type == event_type)
+    if user_id:
+        q = q.where(t.c.who_user_id == user_id)
+    q = q.order_by(t.c.created_at.desc(), t.c.id.desc()).limit(limit)
+    key = lambda r: (r.created_at, r.id)
+    kept = [_LogRow(r, None) for r in db.session.execute(q).all()]
+    if _router is None:
+        return kept
+    wanted = set(exam_ids) if exam_ids is not None else None
+    candidates = []
+    for eid in _router.exam_ids():
+        if wanted is None or eid in wanted:
+            written = _router.last_write(eid)
+            if written is not None:
+                candidates.append((written, eid))
+    candidates.sort(reverse=True)
+    for written, eid in candidates:
+        # kept holds the newest `limit` rows so far; an older shard cannot displace any of them
+        if len(kept) >= limit and kept[-1].created_at is not None and kept[-1].created_at > written:
+            break
+        with exam_db(eid) as conn:
+            rows = [_LogRow(r, eid) for r in conn.execute(q).all()]
+        kept = list(heapq.merge(kept, rows, key=key, reverse=True))[:limit]
+    return kept
+
+def search_logs(q, limit=50, offset=0, sort='rank', before=None, raw=False):
+    """log_search.search over the main database and every shard, merged.
+
+    Returns (hits, next_before): hits are (row, score) pairs, rows as in
+    recent_logs. sort='rank' takes the best offset+limit hits of each index
+    and orders them by score (bm25 statistics are per index, so scores from
+    different shards are close but not strictly comparable). sort='recent'
+    pages newest first by (created_at, id) with one rowid keyset per source:
+    `before` is the previous call's next_before ({shard: before_id}, None
+    for main, 0 once a source is exhausted); next_before is None when every
+    source is exhausted. Shards are skipped as in recent_logs.
+    """
+    t = Log.__table__
+    rows_q = select(t.c.id, t.c.who_user_id, t.c.username, t.c.role, t.c.event_type, t.c.meta, t.c.created_at)
+
+    def run(conn, shard, **kw):
+        ids, scores = log_search.search(conn, q, raw=raw, **kw)
+        if not ids:
+            return []
+        by_id = {r.id: r for r in conn.execute(rows_q.where(t.c.id.in_(ids))).all()}
+        return [(_LogRow(by_id[i], shard), s) for i, s in zip(ids, scores) if i in by_id]
+
+    if sort != 'recent':
+        if _router is None:
+            return run(db.session, None, limit=limit, offset=offset), None
+        hits = run(db.session, None, limit=offset + limit)
+        for eid in _router.exam_ids():
+            with exam_db(eid) as conn:
+                hits.extend(run(conn, eid, limit=offset + limit))
+        hits.sort(key=lambda h: (h[0].created_at or datetime.min, h[0].id), reverse=True)
+        hits.sort(key=lambda h: h[1])
+        return hits[offset:offset + limit], None
+
+    cursor = dict(before or {})
+    key = lambda h: (h[0].created_at or datetime.min, h[0].id)
+    fetched = {}
+    kept = []
+
+    def visit(conn, shard):
+        got = run(conn, shard, limit=limit, sort='recent', before_id=cursor.get(shard))
+        fetched[shard] = len(got)
+        return list(heapq.merge(kept, got, key=key, reverse=True))[:limit]
+
+    if cursor.get(None) != 0:
+        kept = visit(db.session, None)
+    if _router is not None:
+        candidates = []
+        for eid in _router.exam_ids():
+            written = _router.last_write(eid)
+            if cursor.get(eid) != 0 and written is not None:
+                candidates.append((written, eid))
+        candidates.sort(reverse=True)
+        for written, eid in candidates:
+            if len(kept) >= limit and kept[-1][0].created_at is not None and kept[-1][0].created_at > written:
+                break
+            with exam_db(eid) as conn:
+                kept = visit(conn, eid)
+    for shard, n in fetched.items():
+        taken = [h[0].id for h in kept if h[0].shard == shard]
+        if taken and (n == limit or len(taken) < n):
+            cursor[shard] = min(taken)
+        elif len(taken) == n:
+            cursor[shard] = 0   # everything this source had left is on this page
+    sources = [None] + (_router.exam_ids() if _router is not None else [])
+    done = all(cursor.get(s) == 0 for s in sources)
+    return kept, None if done else cursor
+
+def encode_cursor(cursor):
+    """search_logs' next_before as a query-string token, e.g. `main:812,7:90`."""
+    return ','.join(f"{'main' if k is None else k}:{v}" for k, v in sorted(cursor.items(), key=lambda kv: kv[0] or 0))
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; raises ValueError on a malformed token."""
+    out = {}
+    for part in filter(None, (token or '').split(',')):
+        k, v = part.split(':', 1)
+        out[None if k == 'main' else int(k)] = int(v)
+    return out
+
+class _LogRow:
+    __slots__ = ('id', 'who_user_id', 'username', 'role', 'event_type', 'meta', 'created_at', 'shard')
+
+    def __init__(self, row, shard):
+        (self.id, self.who_user_id, self.username, self.role, self.event_type,
+         self.meta, self.created_at) = row
+        self.shard = shard
+
+# ===== Moving existing rows into shards =====
+
+def migrate_to_shards(batch_size=5000, progress=None):
+    """Move marks, attempts and exam logs from the main database into per-exam shards.
+
+    Rows are copied with their ids (INSERT OR IGNORE, so an interrupted run can
+    simply be repeated), then deleted from the main database, one exam at a
+    time. The log search index is rebuilt afterwards when logs moved.
+    Returns {exam_id: rows moved}.
+    """
+    if _router is None:
+        raise RuntimeError('sharding is not enabled')
+    moved = {}
+    m, a, lg = Mark.__table__, ExamAttempt.__table__, Log.__table__
+    with db.engine.connect() as conn:
+        exam_ids = set(conn.execute(select(m.c.exam_id).distinct()).scalars())
+        exam_ids |= set(conn.execute(select(a.c.exam_id).distinct()).scalars())
+    log_ids = {}
+    with db.engine.connect() as conn:
+        last = 0
+        while True:
+            rows = conn.execute(select(lg.c.id, lg.c.meta).where(lg.c.id > last).order_by(lg.c.id)
+                                .limit(batch_size)).all()
+            if not rows:
+                break
+            last = rows[-1][0]
+            for lid, meta in rows:
+                eid = exam_of(meta)
+                if eid is not None:
+                    log_ids.setdefault(eid, []).append(lid)
+    exam_ids |= set(log_ids)
+    with db.engine.connect() as conn:
+        known = set(conn.execute(select(db.metadata.tables['exams'].c.id)).scalars())
+    exam_ids &= known  # rows naming a missing exam stay in the main database
+    for eid in sorted(exam_ids):
+        n = 0
+        with db.engine.connect() as src:
+            mark_rows = [dict(r._mapping) for r in src.execute(m.select().where(m.c.exam_id == eid))]
+            attempt_rows = [dict(r._mapping) for r in src.execute(a.select().where(a.c.exam_id == eid))]
+        with exam_db(eid) as dst:
+            if mark_rows:
+                dst.execute(SHARD_METADATA.tables['marks'].insert().prefix_with('OR IGNORE'), mark_rows)
+            if attempt_rows:
+                dst.execute(SHARD_METADATA.tables['exam_attempts'].insert().prefix_with('OR IGNORE'), attempt_rows)
+            ids = log_ids.get(eid, [])
+            for i in range(0, len(ids), batch_size):
+                with db.engine.connect() as src:
+                    rows = [dict(r._mapping) for r in src.execute(lg.select().where(lg.c.id.in_(ids[i:i + batch_size])))]
+                dst.execute(SHARD_METADATA.tables['logs'].insert().prefix_with('OR IGNORE'), rows)
+            n = len(mark_rows) + len(attempt_rows) + len(ids)
+        with db.engine.begin() as conn:
+            index_marks(conn, eid, [r['student_id'] for r in mark_rows])
+            conn.execute(m.delete().where(m.c.exam_id == eid))
+            conn.execute(a.delete().where(a.c.exam_id == eid))
+            ids = log_ids.get(eid, [])
+            for i in range(0, len(ids), batch_size):
+                conn.execute(lg.delete().where(lg.c.id.in_(ids[i:i + batch_size])))
+        moved[eid] = n
+        if progress:
+            progress(eid, n)
+    # shards written before core.student_exams existed get indexed here too
+    m_shard = SHARD_METADATA.tables['marks']
+    for eid in _router.exam_ids():
+        with exam_db(eid) as conn:
+            sids = conn.execute(select(m_shard.c.student_id).where(m_shard.c.exam_id == eid).distinct()).scalars().all()
+        with db.engine.begin() as conn:
+            index_marks(conn, eid, sids)
+    if any(log_ids.values()):
+        # the moved ids are gone from logs but not from the contentless logs_fts (see log_search.py)
+        import log_search
+        if log_search.is_supported(db.engine):
+            with db.engine.connect() as conn:
+                indexed = log_search.index_exists(conn)
+            if indexed:
+                log_search.rebuild(db.engine, batch_size=max(batch_size, 100000))
+    return moved
@@ -1,8 +1,13 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask import Blueprint, request, jsonify, render_template, redirect, url_for, session, flash
 from werkzeug.security import check_password_hash
-from models import User, Exam, Question, Mark, Log, db
-from utils import add_log, student_required, publish_event
+from sqlalchemy import select
+from models import User, Exam, Mark, Log, ExamAttempt, db
+from utils import add_log, student_required, publish_event, get_waiting_room
+from waiting_room import TICKET_HEADER, to_local_iso
+from grading import score_answers, apply_cheating_penalty
+import exam_cache
+import shards
 
 student_bp = Blueprint('student', __name__)
 
@@ -57,9 +62,28 @@ def api_student_exams():
     )
     return jsonify({'ok': True, 'exams': out})
 
+def _exam_schedule(exam_id):
+    row = db.session.query(Exam.start_at, Exam.duration_minutes).filter_by(id=exam_id, is_published=True).first()
+    return (row.start_at, row.duration_minutes) if row else None
+
 @student_bp.route('/api/student/exam/<int:exam_id>', methods=['GET'])
 @student_required
 def api_student_exam_details(exam_id):
+    # Waiting room: early or backed-up students get a ticket and a Retry-After.
+    # Requests holding a ticket are answered here without a database query.
+    sid = session.get('student_id')
+    ticket = request.headers.get(TICKET_HEADER) or request.args.get('ticket')
+    wait = get_waiting_room().check(exam_id, sid, ticket, _exam_schedule)
+    if wait is not None:
+        now = datetime.now()
+        if wait['issued']:
+            add_log(sid, session.get('student_username'), 'student', 'exam_not_started', {'exam_id': exam_id, 'server_now': now.isoformat(), 'start_at': to_local_iso(wait['start_ts']), 'release_at': to_local_iso(wait['release_ts'])})
+        resp = jsonify({'ok': False, 'msg': wait['msg'], 'start_at': to_local_iso(wait['start_ts']), 'server_now': now.isoformat(),
+                        'ticket': wait['ticket'], 'release_at': to_local_iso(wait['release_ts']),
+                        'retry_after': wait['retry_after'], 'retry_after_ms': wait['retry_after_ms']})
+        resp.headers['Retry-After'] = str(wait['retry_after'])
+        return resp, 403 if wait['msg'] == 'not_started' else 429
+
     exam = Exam.query.filter_by(id=exam_id, is_published=True).first()
     if not exam:
         return jsonify({'ok': False, 'msg': 'exam_not_found'}), 404
@@ -72,26 +96,12 @@ def api_student_exam_details(exam_id):
             add_log(session.get('student_id'), session.get('student_username'), 'student', 'exam_not_started', {'exam_id': exam.id, 'server_now': now.isoformat(), 'start_at': exam.start_at.isoformat()})
             return jsonify({'ok': False, 'msg': 'not_started', 'start_at': exam.start_at.isoformat(), 'server_now': now.isoformat()}), 403
         if exam.start_at and exam.duration_minutes:
-            from datetime import timedelta
             if now > exam.start_at + timedelta(minutes=exam.duration_minutes):
                 add_log(session.get('student_id'), session.get('student_username'), 'student', 'exam_time_over', {'exam_id': exam.id, 'server_now': now.isoformat(), 'start_at': exam.start_at.isoformat()})
                 return jsonify({'ok': False, 'msg': 'time_over', 'start_at': exam.start_at.isoformat(), 'server_now': now.isoformat()}), 403
 
-    questions = Question.query.filter_by(exam_id=exam.id).order_by(Question.created_at.asc()).all()
-    qlist = []
-    for q in questions:
-        qlist.append({
-            'id': q.id,
-            'text': q.text,
-            'options': {
-                'A': q.option_a,
-                'B': q.option_b,
-                'C': q.option_c,
-                'D': q.option_d
-            },
-            'points': q.points,
-            'time_seconds': q.time_seconds
-        })
+    # question list is pre-built by the scheduler shortly before start_at
+    qlist = exam_cache.get_bundle(exam.id, exam.updated_at).questions
     add_log(
         session.get('student_id'),
         session.get('student_username'),
@@ -122,45 +132,30 @@ def api_student_submit_exam():
     if not exam:
         return jsonify({'ok': False, 'msg': 'exam_not_found'}), 404
 
-    # Calculate original marks
-    original_marks = 0
-    for qid_key, ans in answers.items():
-        # Frontend sends keys like 'q<id>' (e.g., 'q12'). Normalize to integer ID.
-        key_str = str(qid_key)
-        if key_str.startswith('q'):
-            key_str = key_str[1:]
-        try:
-            qid = int(key_str)
-        except Exception:
-            # Skip malformed keys
-            continue
-        q = Question.query.filter_by(id=qid, exam_id=exam.id).first()
-        if not q:
-            continue
-        # Normalize student's selected option and correct option to uppercase single letters
-        student_opt = (ans or '').strip().upper()
-        correct_opt = (q.correct_option or '').strip().upper()
-        original_marks += 1 if student_opt == correct_opt else 0
+    # Calculate original marks against the cached answer key (reloaded if another worker changed it)
+    original_marks = score_answers(answers, exam_cache.get_bundle(exam.id, exam.updated_at).answer_key)
 
     # Apply cheating penalty logic (to match frontend UI expectations)
-    penalty_flag = 2 if cheating_count >= 2 else (1 if cheating_count == 1 else 0)
-    if penalty_flag >= 2:
-        final_marks = 0
-    elif penalty_flag == 1:
-        final_marks = max(0, original_marks * 0.5)
-    else:
-        final_marks = original_marks
-
-    # Save or update Mark (store final marks)
-    m = Mark.query.filter_by(exam_id=exam.id, student_id=session.get('student_id')).first()
-    if not m:
-        m = Mark(exam_id=exam.id, student_id=session.get('student_id'), marks=final_marks, graded_at=datetime.utcnow(), cheating_count=cheating_count)
-        db.session.add(m)
-    else:
-        m.marks = final_marks
-        m.graded_at = datetime.utcnow()
-        m.cheating_count = cheating_count
-    db.session.commit()
+    final_marks, penalty_flag = apply_cheating_penalty(original_marks, cheating_count)
+
+    # Save or update Mark (store final marks); marks/attempts live in the exam's shard when sharding is on
+    sid = session.get('student_id')
+    now = datetime.utcnow()
+    m, a = Mark.__table__, ExamAttempt.__table__
+    shards.note_mark(exam.id, sid)
+    with shards.exam_db(exam.id) as conn:
+        mark_id = conn.execute(select(m.c.id).where(m.c.exam_id == exam.id, m.c.student_id == sid).limit(1)).scalar()
+        values = {'marks': final_marks, 'graded_at': now, 'cheating_count': cheating_count}
+        if mark_id is None:
+            conn.execute(m.insert().values(exam_id=exam.id, student_id=sid, **values))
+        else:
+            conn.execute(m.update().where(m.c.id == mark_id).values(**values))
+        # keep the submitted answers on the attempt (regrades rescore them); the finalizer skips it
+        done = conn.execute(a.update().where(a.c.exam_id == exam.id, a.c.student_id == sid)
+                            .values(answers=answers, cheating_count=cheating_count, updated_at=now, submitted_at=now))
+        if not done.rowcount:
+            conn.execute(a.insert().values(exam_id=exam.id, student_id=sid, answers=answers, cheating_count=cheating_count,
+                                           started_at=now, updated_at=now, submitted_at=now))
 
     add_log(
         session.get('student_id'),
@@ -186,6 +181,46 @@ def api_student_submit_exam():
 
     return jsonify({'ok': True, 'total_marks': final_marks, 'original_marks': original_marks, 'cheating_penalty': penalty_flag})
 
+@student_bp.route('/api/student/save_answers', methods=['POST'])
+@student_required
+def api_student_save_answers():
+    """Autosave in-progress answers; graded at exam close if the student never submits."""
+    data = request.json or request.form or {}
+    exam_id = data.get('exam_id')
+    answers = data.get('answers', {})
+    cheating_count = int(data.get('cheating_count', 0)) if str(data.get('cheating_count', '0')).isdigit() else 0
+    if not exam_id or not isinstance(answers, dict):
+        return jsonify({'ok': False, 'msg': 'missing_data'}), 400
+    try:
+        exam_id = int(exam_id)
+    except Exception:
+        return jsonify({'ok': False, 'msg': 'bad_exam_id'}), 400
+    # same gate as the exam details endpoint: published and inside start_at .. start_at + duration
+    schedule = _exam_schedule(exam_id)
+    if schedule is None:
+        return jsonify({'ok': False, 'msg': 'exam_not_found'}), 404
+    start_at, duration = schedule
+    local_now = datetime.now()  # start_at is naive local time
+    if start_at and local_now < start_at:
+        return jsonify({'ok': False, 'msg': 'not_started', 'start_at': start_at.isoformat()}), 403
+    if start_at and duration and local_now > start_at + timedelta(minutes=duration):
+        return jsonify({'ok': False, 'msg': 'time_over', 'start_at': start_at.isoformat()}), 403
+    sid = session.get('student_id')
+    now = datetime.utcnow()
+    t = ExamAttempt.__table__
+    with shards.exam_db(exam_id) as conn:
+        row = conn.execute(select(t.c.id, t.c.submitted_at, t.c.cheating_count)
+                           .where(t.c.exam_id == exam_id, t.c.student_id == sid)).first()
+        if row is None:
+            conn.execute(t.insert().values(exam_id=exam_id, student_id=sid, answers=answers, cheating_count=cheating_count,
+                                           started_at=now, updated_at=now))
+        elif row.submitted_at is not None:
+            return jsonify({'ok': False, 'msg': 'already_submitted'}), 409
+        else:
+            conn.execute(t.update().where(t.c.id == row.id)
+                         .values(answers=answers, cheating_count=max(row.cheating_count or 0, cheating_count), updated_at=now))
+    return jsonify({'ok': True, 'saved_at': now.isoformat()})
+
 @student_bp.route('/api/student/my_marks', methods=['GET'])
 @student_required
 def api_student_my_marks():
@@ -193,13 +228,13 @@ def api_student_my_marks():
     sid = session.get('student_id')
     if not sid:
         return jsonify({'ok': False, 'msg': 'not_logged_in'}), 401
-    marks = Mark.query.filter_by(student_id=sid).all()
+    marks = shards.marks_for_student(sid)
     # Preload recent submit logs to backfill cheating_count if missing (e.g., old rows before migration)
     recent_logs = Log.query.filter_by(who_user_id=sid, event_type='submit_exam').order_by(Log.created_at.desc()).limit(200).all()
+    titles = dict(db.session.query(Exam.id, Exam.title).filter(Exam.id.in_({m.exam_id for m in marks})).all()) if marks else {}
     out = []
     for m in marks:
-        exam = Exam.query.get(m.exam_id)
-        cheat_cnt = m.cheating_count if hasattr(m, 'cheating_count') else 0
+        cheat_cnt = m.cheating_count or 0
         if not cheat_cnt:
             # Try to backfill from logs
             for lg in recent_logs:
@@ -211,7 +246,7 @@ def api_student_my_marks():
                     pass
         out.append({
             'exam_id': m.exam_id,
-            'exam_title': exam.title if exam else f'Exam {m.exam_id}',
+            'exam_title': titles.get(m.exam_id, f'Exam {m.exam_id}'),
             'marks': m.marks,
             'cheating_count': cheat_cnt or 0
         })
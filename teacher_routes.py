@@ -1,10 +1,12 @@
-import io
-import csv
 from datetime import datetime
-from flask import Blueprint, request, jsonify, render_template, redirect, url_for, session, flash, current_app, Response
+from flask import Blueprint, request, jsonify, render_template, redirect, url_for, session, flash, current_app, Response, stream_with_context
 from werkzeug.security import check_password_hash
-from models import User, Exam, Question, Mark, Log, db
-from utils import add_log, teacher_required, subscribe_events, simulate_ricart_agarwala, primary_process, backup_process, consistency_write, consistency_read
+from sqlalchemy import select
+from config import Config
+from models import User, Exam, Question, Mark, ExamAggregate, db
+from utils import add_log, teacher_required, subscribe_events, start_event_relay, simulate_ricart_agarwala, get_lb_dispatcher, get_replicated_store, consistency_write, refresh_exam_schedule
+import shards
+from job_routes import job_handle, should_defer, submit_job
 
 teacher_bp = Blueprint('teacher', __name__)
 
@@ -43,26 +45,24 @@ def api_teacher_cheating_logs():
     we fetch recent entries and filter in Python by checking exam ownership.
     """
     limit = request.args.get('limit', default=300, type=int)
-    # Fetch recent cheating logs
-    logs = Log.query.filter_by(event_type='cheating_detected').order_by(Log.created_at.desc()).limit(limit).all()
     teacher_id = session.get('teacher_id')
+    owned = dict(db.session.query(Exam.id, Exam.title).filter(Exam.created_by == teacher_id).all())
+    # Fetch recent cheating logs (only this teacher's exam shards are read when sharding is on)
+    logs = shards.recent_logs(limit, 'cheating_detected', exam_ids=owned)
     out = []
     for lg in logs:
         try:
             exam_id = int(lg.meta.get('exam_id')) if lg.meta and 'exam_id' in lg.meta else None
         except Exception:
             exam_id = None
-        if not exam_id:
-            continue
-        exam = Exam.query.get(exam_id)
-        if not exam or exam.created_by != teacher_id:
+        if not exam_id or exam_id not in owned:
             continue
         out.append({
             'id': lg.id,
             'student_id': lg.who_user_id,
             'student_username': lg.username,
             'exam_id': exam_id,
-            'exam_title': exam.title,
+            'exam_title': owned[exam_id],
             'cheating_count': (lg.meta or {}).get('cheating_count', 0),
             'created_at': lg.created_at.isoformat()
         })
@@ -140,6 +140,7 @@ def api_update_exam():
         else:
             exam.is_published = bool(is_published)
     db.session.commit()
+    refresh_exam_schedule(exam.id)
     add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'update_exam', {'exam_id': exam.id})
     return jsonify({'ok':True, 'exam': {'id': exam.id, 'duration': exam.duration_minutes, 'is_published': exam.is_published, 'num_questions': exam.num_questions}})
 
@@ -187,6 +188,7 @@ def api_create_question():
     )
     db.session.add(q)
     db.session.commit()
+    refresh_exam_schedule(exam_id)
 
     add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'create_question',
             {'exam_id': exam_id, 'question_id': q.id})
@@ -223,6 +225,74 @@ def api_list_questions():
 
     return jsonify({'ok': True, 'questions': out})
 
+@teacher_bp.route('/api/teacher/update_question', methods=['POST'])
+@teacher_required
+def api_update_question():
+    """Edit a question (e.g. fix its correct_option); stored marks change only with /api/teacher/regrade."""
+    d = request.form or request.json or {}
+    try:
+        q = db.session.get(Question, int(d.get('question_id')))
+    except Exception:
+        return jsonify({'ok': False, 'msg': 'bad_question_id'}), 400
+    exam = Exam.query.get(q.exam_id) if q else None
+    if not exam or exam.created_by != session.get('teacher_id'):
+        return jsonify({'ok': False, 'msg': 'question_not_found_or_forbidden'}), 404
+    old_key = q.correct_option
+    for field in ('text', 'option_a', 'option_b', 'option_c', 'option_d'):
+        if d.get(field) not in (None, ''):
+            setattr(q, field, str(d.get(field)).strip())
+    if d.get('correct_option') not in (None, ''):
+        correct = str(d.get('correct_option')).strip().upper()
+        if correct not in ('A', 'B', 'C', 'D'):
+            return jsonify({'ok': False, 'msg': 'bad_correct_option'}), 400
+        q.correct_option = correct
+    try:
+        if 'points' in d:
+            q.points = float(d['points']) if d['points'] not in (None, '') else None
+        if 'time_seconds' in d:
+            q.time_seconds = int(d['time_seconds']) if d['time_seconds'] not in (None, '') else None
+    except Exception:
+        db.session.rollback()
+        return jsonify({'ok': False, 'msg': 'bad_types'}), 400
+    db.session.commit()
+    refresh_exam_schedule(exam.id)
+    key_changed = q.correct_option != old_key
+    add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'update_question',
+            {'exam_id': exam.id, 'question_id': q.id, 'key_changed': key_changed})
+    return jsonify({'ok': True, 'key_changed': key_changed,
+                    'marks_to_regrade': shards.count_marks([exam.id]) if key_changed else 0,
+                    'question': {
+                        'id': q.id,
+                        'text': q.text,
+                        'options': {'A': q.option_a, 'B': q.option_b, 'C': q.option_c, 'D': q.option_d},
+                        'correct': q.correct_option,
+                        'points': q.points,
+                        'time_seconds': q.time_seconds
+                    }})
+
+@teacher_bp.route('/api/teacher/regrade', methods=['POST'])
+@teacher_required
+def api_regrade_exam():
+    """Rescore every stored submission of an exam against its current key (dry_run=1 to preview the diff)."""
+    import exam_cache
+    import regrade
+    d = request.form or request.json or {}
+    try:
+        exam_id = int(d.get('exam_id'))
+    except Exception:
+        return jsonify({'ok': False, 'msg': 'bad_exam_id'}), 400
+    dry_run = str(d.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+    exam = Exam.query.get(exam_id)
+    if not exam or exam.created_by != session.get('teacher_id'):
+        return jsonify({'ok': False, 'msg': 'exam_not_found_or_forbidden'}), 404
+    if not dry_run and should_defer(shards.count_marks([exam_id])):
+        # big exam: write the new marks from a job (the preview always runs here; it only reads)
+        return job_handle(submit_job('regrade', {'exam_id': exam_id, 'owner_id': session.get('teacher_id')}))
+    summary = regrade.regrade_exam(exam_id, exam_cache.load_bundle(exam_id).answer_key, dry_run=dry_run)
+    add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'regrade_exam',
+            {k: v for k, v in summary.items() if k != 'changes'})
+    return jsonify({'ok': True, 'summary': summary})
+
 # API Routes - Marks Management
 @teacher_bp.route('/api/teacher/exams_for_marks', methods=['GET'])
 @teacher_required
@@ -252,14 +322,15 @@ def api_set_mark():
     # Optional validation: marks must be non-negative if provided
     if marks_val is not None and marks_val < 0:
         return jsonify({'ok': False, 'msg': 'marks_must_be_non_negative'}), 400
-    mark = Mark.query.filter_by(exam_id=exam_id, student_id=student_id).first()
-    if not mark:
-        mark = Mark(exam_id=exam_id, student_id=student_id, marks=marks_val, graded_at=(datetime.utcnow() if marks_val is not None else None))
-        db.session.add(mark)
-    else:
-        mark.marks = marks_val
-        mark.graded_at = (datetime.utcnow() if marks_val is not None else None)
-    db.session.commit()
+    m = Mark.__table__
+    values = {'marks': marks_val, 'graded_at': (datetime.utcnow() if marks_val is not None else None)}
+    shards.note_mark(exam_id, student_id)
+    with shards.exam_db(exam_id) as conn:
+        mark_id = conn.execute(select(m.c.id).where(m.c.exam_id == exam_id, m.c.student_id == student_id).limit(1)).scalar()
+        if mark_id is None:
+            conn.execute(m.insert().values(exam_id=exam_id, student_id=student_id, **values))
+        else:
+            conn.execute(m.update().where(m.c.id == mark_id).values(**values))
     add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'set_mark', {'exam_id': exam_id, 'student_id': student_id, 'marks': marks_val})
     return jsonify({'ok':True})
 
@@ -269,37 +340,66 @@ def api_exam_marks():
     exam_id = request.args.get('exam_id', type=int)
     if not exam_id:
         return jsonify({'ok':False, 'msg':'missing_exam_id'}), 400
-    # join students
-    marks = Mark.query.filter_by(exam_id=exam_id).all()
+    # join students (users resolves to the main database from a shard connection)
+    m, u = Mark.__table__, User.__table__
+    with shards.exam_db(exam_id) as conn:
+        marks = conn.execute(select(m.c.id, m.c.student_id, u.c.username, m.c.marks, m.c.graded_at)
+                             .outerjoin(u, u.c.id == m.c.student_id).where(m.c.exam_id == exam_id)).all()
     out = []
-    for m in marks:
-        student = User.query.get(m.student_id)
-        out.append({'id': m.id, 'student_id': m.student_id, 'student_username': student.username if student else None, 'marks': m.marks, 'graded_at': m.graded_at.isoformat() if m.graded_at else None})
+    for r in marks:
+        out.append({'id': r.id, 'student_id': r.student_id, 'student_username': r.username, 'marks': r.marks, 'graded_at': r.graded_at.isoformat() if r.graded_at else None})
     return jsonify({'ok':True, 'marks': out})
 
+@teacher_bp.route('/api/teacher/exam_summary', methods=['GET'])
+@teacher_required
+def api_exam_summary():
+    """Aggregates written when the exam was finalized at close (see scheduler.py)."""
+    exam_id = request.args.get('exam_id', type=int)
+    if not exam_id:
+        return jsonify({'ok':False, 'msg':'missing_exam_id'}), 400
+    exam = Exam.query.get(exam_id)
+    if not exam or exam.created_by != session.get('teacher_id'):
+        return jsonify({'ok': False, 'msg': 'exam_not_found_or_forbidden'}), 404
+    agg = db.session.get(ExamAggregate, exam_id)
+    if agg is None:
+        return jsonify({'ok': True, 'finalized': False})
+    from scheduler import aggregate_dict
+    return jsonify({'ok': True, 'finalized': True, 'summary': aggregate_dict(agg)})
+
 @teacher_bp.route('/api/teacher/exam_marks_csv', methods=['GET'])
 @teacher_required
 def api_exam_marks_csv():
     exam_id = request.args.get('exam_id', type=int)
     if not exam_id:
         return jsonify({'ok':False, 'msg':'missing_exam_id'}), 400
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['student_id','student_username','marks','graded_at'])
-    marks = Mark.query.filter_by(exam_id=exam_id).all()
-    for m in marks:
-        student = User.query.get(m.student_id)
-        writer.writerow([m.student_id, student.username if student else '', '' if m.marks is None else m.marks, '' if not m.graded_at else m.graded_at.isoformat()])
-    resp = current_app.response_class(output.getvalue(), mimetype='text/csv')
+    rows = shards.count_marks([exam_id])
+    if should_defer(rows):
+        # large exam: build the file in the background and return a job handle to poll
+        return job_handle(submit_job('marks_csv', {'exam_id': exam_id}))
+    import gradebook
+    resp = current_app.response_class(stream_with_context(gradebook.exam_csv(exam_id, Config.EXPORT_CHUNK_ROWS)), mimetype='text/csv')
     resp.headers['Content-Disposition'] = f'attachment; filename=exam_{exam_id}_marks.csv'
     add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'download_csv', {'exam_id': exam_id})
     return resp
 
+@teacher_bp.route('/api/teacher/gradebook', methods=['GET'])
+@teacher_required
+def api_teacher_gradebook():
+    """Streamed students x exams gradebook (or zip of per-exam CSVs) for this teacher's exams."""
+    import gradebook
+    resp, meta = gradebook.export_from_request(owner_id=session.get('teacher_id'))
+    if isinstance(meta, int):
+        return resp, meta
+    add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'download_gradebook', meta)
+    return resp
+
 # Real-time monitoring stream (SSE)
 @teacher_bp.route('/api/teacher/monitor_stream')
 @teacher_required
 def api_teacher_monitor_stream():
+    # also receive scheduler/job events raised in other processes (utils.relay_event)
+    start_event_relay(current_app._get_current_object())
+
     def event_stream():
         for ev in subscribe_events():
             import json
@@ -308,14 +408,16 @@ def api_teacher_monitor_stream():
     return Response(event_stream(), headers=headers)
 
 # ===== DS Demo Endpoints =====
+# The demo engines (xmlrpc client, simulator, dispatcher, replicas) are imported
+# inside the handlers so workers that never serve a demo do not load them.
 
 @teacher_bp.route('/api/teacher/rpc_ping', methods=['GET'])
 @teacher_required
 def api_rpc_ping():
+    from rpc_service import get_client_pool
     try:
-        import xmlrpc.client
-        proxy = xmlrpc.client.ServerProxy('http://127.0.0.1:9000', allow_none=True)
-        res = proxy.ping()
+        with get_client_pool().proxy() as proxy:
+            res = proxy.ping()
         add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'rpc_ping', {'result': res})
         return jsonify({'ok': True, 'result': res})
     except Exception as e:
@@ -325,53 +427,120 @@ def api_rpc_ping():
 @teacher_bp.route('/api/teacher/rpc_record_event', methods=['POST'])
 @teacher_required
 def api_rpc_record_event():
+    from rpc_service import get_client_pool
     d = request.json or request.form or {}
     try:
-        import xmlrpc.client
-        proxy = xmlrpc.client.ServerProxy('http://127.0.0.1:9000', allow_none=True)
-        ok = proxy.record_event({
-            'teacher_id': session.get('teacher_id'),
-            'teacher_username': session.get('teacher_username'),
-            'event': d.get('event') or 'test_event'
-        })
+        with get_client_pool().proxy() as proxy:
+            ok = proxy.record_event({
+                'teacher_id': session.get('teacher_id'),
+                'teacher_username': session.get('teacher_username'),
+                'event': d.get('event') or 'test_event'
+            })
         add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'rpc_record_event', {'stored': bool(ok), 'event': d.get('event')})
         return jsonify({'ok': True, 'stored': bool(ok)})
     except Exception as e:
         add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'rpc_record_event_error', {'error': str(e)})
         return jsonify({'ok': False, 'error': str(e)}), 500
 
+@teacher_bp.route('/api/teacher/rpc_events', methods=['GET'])
+@teacher_required
+def api_rpc_events():
+    """Read back events stored by the RPC service (ring buffer, oldest first)."""
+    from rpc_service import get_client_pool
+    since_seq = request.args.get('since_seq', default=0, type=int)
+    limit = request.args.get('limit', default=100, type=int)
+    try:
+        with get_client_pool().proxy() as proxy:
+            res = proxy.query_events(since_seq, limit)
+        return jsonify({'ok': True, 'events': res['events'], 'stats': res['stats']})
+    except Exception as e:
+        return jsonify({'ok': False, 'error': str(e)}), 500
+
 @teacher_bp.route('/api/teacher/ricart_agarwala', methods=['POST'])
 @teacher_required
 def api_ricart_agarwala():
+    """Run the Ricart–Agrawala simulation.
+
+    Either `requests` as a list of {node_id, timestamp} (returns order + log), or
+    `nodes`/`requests_per_node` with optional `latency`, `cs_time`, `think_time`
+    distributions, `seed` and `mode` ('exact'/'coalesced'). With `stream` the
+    log is sent as NDJSON lines followed by a final {"summary": ...} line.
+    """
+    from ricart_agrawala import RicartAgrawalaSimulation, make_distribution
     d = request.json or request.form or {}
-    # Expect requests as list of {node_id:int, timestamp:int}
-    reqs = d.get('requests') or []
+    reqs = d.get('requests')
+    opts = {}
     try:
-        parsed = [(int(item['node_id']), int(item['timestamp'])) for item in reqs]
+        for key in ('latency', 'cs_time', 'think_time'):
+            if d.get(key) is not None:
+                opts[key] = make_distribution(d.get(key))
+        if d.get('seed') is not None:
+            opts['seed'] = int(d.get('seed'))
+        if d.get('mode') in ('exact', 'coalesced'):
+            opts['coalesce'] = d.get('mode') == 'coalesced'
+        if reqs is not None:
+            parsed = [(int(item['node_id']), int(item['timestamp'])) for item in reqs]
+            sim = RicartAgrawalaSimulation(initial_requests=parsed, record_order=True, **opts)
+            entries = len(parsed)
+        else:
+            nodes = int(d.get('nodes') or 0)
+            per_node = int(d.get('requests_per_node') or 1)
+            if nodes <= 0 or per_node <= 0 or nodes * per_node > Config.RA_MAX_CS_ENTRIES:
+                return jsonify({'ok': False, 'msg': 'bad_requests'}), 400
+            sim = RicartAgrawalaSimulation(nodes=nodes, requests_per_node=per_node, **opts)
+            entries = nodes * per_node
     except Exception:
         return jsonify({'ok': False, 'msg': 'bad_requests'}), 400
-    res = simulate_ricart_agarwala(parsed)
-    add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'ricart_agarwala', {'order': res['order']})
-    return jsonify({'ok': True, 'order': res['order'], 'log': res['log']})
+    # exact mode schedules 2(N-1) messages per entry; keep it to small runs
+    if not sim.coalesce and (sim.n > sim.EXACT_MAX_NODES or entries * sim.n > Config.RA_MAX_CS_ENTRIES):
+        return jsonify({'ok': False, 'msg': 'exact_mode_too_large', 'max_nodes': sim.EXACT_MAX_NODES,
+                        'max_entries_x_nodes': Config.RA_MAX_CS_ENTRIES}), 400
+    teacher_id, teacher_username = session.get('teacher_id'), session.get('teacher_username')
+
+    if str(d.get('stream', '')).lower() in ('1', 'true', 'yes'):
+        def ndjson():
+            import json
+            for entry in sim.run():
+                yield json.dumps(entry) + '\n'
+            yield json.dumps({'summary': sim.summary}) + '\n'
+        add_log(teacher_id, teacher_username, 'teacher', 'ricart_agarwala', {'nodes': sim.n, 'mode': 'coalesced' if sim.coalesce else 'exact', 'stream': True})
+        return Response(ndjson(), mimetype='application/x-ndjson')
+
+    if reqs is not None:
+        res = simulate_ricart_agarwala(parsed, **opts)
+        add_log(teacher_id, teacher_username, 'teacher', 'ricart_agarwala', {'order': res['order']})
+        return jsonify({'ok': True, 'order': res['order'], 'log': res['log'], 'stats': res['stats']})
+    stats = sim.run_to_completion()
+    add_log(teacher_id, teacher_username, 'teacher', 'ricart_agarwala', {'nodes': sim.n, 'cs_entries': stats['cs_entries'], 'mode': stats['mode']})
+    return jsonify({'ok': True, 'stats': stats})
 
 @teacher_bp.route('/api/teacher/lb_process', methods=['POST'])
 @teacher_required
 def api_lb_process():
+    from dispatcher import NoBackendAvailable
     d = request.json or request.form or {}
     payload = d.get('payload') or {}
-    # Try primary; on failure, fallback to backup
+    # Route through the circuit-breaking dispatcher; a tripped primary is skipped
     try:
-        out = primary_process(payload)
-        add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'lb_primary', {'payload': payload})
-        return jsonify({'ok': True, 'path': 'primary', 'result': out})
-    except Exception as e:
-        try:
-            out = backup_process(payload)
-            add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'lb_backup', {'payload': payload, 'primary_error': str(e)})
-            return jsonify({'ok': True, 'path': 'backup', 'result': out, 'primary_error': str(e)})
-        except Exception as e2:
-            add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'lb_error', {'payload': payload, 'primary_error': str(e), 'backup_error': str(e2)})
-            return jsonify({'ok': False, 'error': str(e2), 'primary_error': str(e)}), 500
+        path, out, errors = get_lb_dispatcher().dispatch(payload)
+    except NoBackendAvailable as e:
+        errors = e.args[0] if e.args and isinstance(e.args[0], dict) else {}
+        add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'lb_error', {'payload': payload, 'errors': errors})
+        return jsonify({'ok': False, 'error': 'no_backend_available', 'errors': errors}), 500
+    meta = {'payload': payload}
+    resp = {'ok': True, 'path': path, 'result': out}
+    if errors:
+        meta['errors'] = errors
+        resp['errors'] = errors
+        if 'primary' in errors:
+            meta['primary_error'] = resp['primary_error'] = errors['primary']
+    add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'lb_' + path.split('#')[0], meta)
+    return jsonify(resp)
+
+@teacher_bp.route('/api/teacher/lb_stats', methods=['GET'])
+@teacher_required
+def api_lb_stats():
+    return jsonify({'ok': True, 'stats': get_lb_dispatcher().stats()})
 
 @teacher_bp.route('/api/teacher/consistency_write', methods=['POST'])
 @teacher_required
@@ -381,17 +550,29 @@ def api_consistency_write():
     value = d.get('value')
     if not key:
         return jsonify({'ok': False, 'msg': 'missing_key'}), 400
-    consistency_write(key, value)
-    add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'consistency_write', {'key': key, 'value': value})
-    return jsonify({'ok': True})
+    version = consistency_write(key, value)
+    # session token so later read_your_writes reads see at least this version
+    session['consistency_version'] = max(version, session.get('consistency_version') or 0)
+    add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'consistency_write', {'key': key, 'value': value, 'version': version})
+    return jsonify({'ok': True, 'version': version})
 
 @teacher_bp.route('/api/teacher/consistency_read', methods=['GET'])
 @teacher_required
 def api_consistency_read():
+    from replication import READ_MODES
     key = request.args.get('key', '').strip()
     mode = request.args.get('mode', 'eventual')
     if not key:
         return jsonify({'ok': False, 'msg': 'missing_key'}), 400
-    val = consistency_read(mode, key)
-    add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'consistency_read', {'key': key, 'mode': mode, 'value': val})
-    return jsonify({'ok': True, 'mode': mode, 'key': key, 'value': val})
+    if mode not in READ_MODES:
+        return jsonify({'ok': False, 'msg': 'bad_mode'}), 400
+    token = request.args.get('version', type=int) or session.get('consistency_version') or 0
+    max_staleness = request.args.get('max_staleness', type=float)
+    val, served_by, seen = get_replicated_store().read(mode, key, token=token, max_staleness=max_staleness)
+    add_log(session.get('teacher_id'), session.get('teacher_username'), 'teacher', 'consistency_read', {'key': key, 'mode': mode, 'value': val, 'served_by': served_by})
+    return jsonify({'ok': True, 'mode': mode, 'key': key, 'value': val, 'served_by': served_by, 'version_seen': seen})
+
+@teacher_bp.route('/api/teacher/consistency_stats', methods=['GET'])
+@teacher_required
+def api_consistency_stats():
+    return jsonify({'ok': True, 'stats': get_replicated_store().stats()})
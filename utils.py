@@ -1,10 +1,12 @@
 from functools import wraps
 from flask import session, redirect, url_for
-from models import Log, db
+from models import Log, MonitorEvent, db
+import os
 import queue
 import threading
-import random
 import time
+import uuid
+import random
 
 # Simple in-memory pub/sub for real-time monitoring
 _subscribers = []  # list of Queues
@@ -31,8 +33,77 @@ def subscribe_events():
             if q in _subscribers:
                 _subscribers.remove(q)
 
+# Events from background work (scheduler finalize, regrade jobs) are often
+# published where no teacher is listening: the run-services process or a
+# `python -m jobs` child. relay_event also stores them in monitor_events;
+# each process with monitor subscribers polls that table and republishes the
+# rows other processes wrote on its own bus. The table keeps the newest
+# MONITOR_RELAY_KEEP rows.
+_relay_origin = f'{os.getpid()}:{uuid.uuid4().hex[:8]}'
+_relay_thread = None
+_relay_lock = threading.Lock()
+
+def relay_event(event: dict):
+    """publish_event here and in every other process that has monitor subscribers."""
+    from config import Config
+    publish_event(event)
+    t = MonitorEvent.__table__
+    try:
+        with db.engine.begin() as conn:
+            new_id = conn.execute(t.insert().values(origin=_relay_origin, payload=event)).inserted_primary_key[0]
+            conn.execute(t.delete().where(t.c.id <= new_id - Config.MONITOR_RELAY_KEEP))
+    except Exception:
+        pass  # monitoring is best effort; the work that raised the event carries on
+
+def start_event_relay(app):
+    """Start this process's monitor_events poller (once); called when a monitor stream opens."""
+    global _relay_thread
+    with _relay_lock:
+        if _relay_thread is None:
+            _relay_thread = threading.Thread(target=_relay_loop, args=(app,), name='monitor-relay', daemon=True)
+            _relay_thread.start()
+
+def _relay_loop(app):
+    from sqlalchemy import func, select
+    from config import Config
+    t = MonitorEvent.__table__
+    last = None  # None: skip to the newest row, nobody was listening before
+    with app.app_context():
+        while True:
+            with _subs_lock:
+                listening = bool(_subscribers)
+            rows = []
+            try:
+                with db.engine.connect() as conn:
+                    if last is None or not listening:
+                        last = conn.execute(select(func.max(t.c.id))).scalar() or 0
+                    else:
+                        rows = conn.execute(select(t.c.id, t.c.origin, t.c.payload).where(t.c.id > last)
+                                            .order_by(t.c.id).limit(500)).all()
+            except Exception:
+                pass  # e.g. the table is locked; try again next tick
+            for rid, origin, payload in rows:
+                last = rid
+                if origin != _relay_origin:
+                    publish_event(payload)
+            time.sleep(Config.MONITOR_RELAY_POLL_SECONDS)
+
 def add_log(who_id, username, role, event_type, meta=None):
     """Helper function to add log entries"""
+    import shards
+    exam_id = shards.exam_of(meta) if shards.enabled() else None
+    if exam_id is not None:
+        # exam traffic goes to the exam's shard (see shards.py); an exam_id
+        # that names no exam stays in the main database below
+        try:
+            with shards.exam_db(exam_id) as conn:
+                conn.execute(Log.__table__.insert(), {'who_user_id': who_id, 'username': username, 'role': role,
+                                                      'event_type': event_type, 'meta': meta})
+        except shards.UnknownExam:
+            pass
+        else:
+            db.session.commit()  # callers rely on add_log committing their pending changes
+            return
     entry = Log(who_user_id=who_id, username=username, role=role, event_type=event_type, meta=meta or {})
     db.session.add(entry)
     db.session.commit()
@@ -42,33 +113,24 @@ def admin_required(fn):
     @wraps(fn)
     def wrapper(*a, **kw):
         if not session.get('admin_logged_in'):
-            return redirect(url_for('admin_login'))
+            return redirect(url_for('admin.admin_login'))
         return fn(*a, **kw)
     return wrapper
 
 # ===== Distributed Systems Simulations =====
-# Ricart–Agrawala mutual exclusion (simulated)
-def simulate_ricart_agarwala(requests):
+# Ricart–Agrawala mutual exclusion (simulated; engine in ricart_agrawala.py)
+def simulate_ricart_agarwala(requests, **options):
     """
-    requests: list of tuples (node_id, timestamp)
-    Returns an ordered list representing the critical section entry order and a log.
+    requests: list of tuples (node_id, timestamp); timestamps are issue times in ms.
+    Runs the discrete-event simulation and returns the critical section entry
+    order, the request/enter/exit log and the run statistics.
     """
-    # Sort by (timestamp, node_id) to simulate total ordering
-    ordered = sorted(requests, key=lambda x: (x[1], x[0]))
-    log = []
-    for node_id, ts in ordered:
-        log.append({
-            'event': 'enter_cs',
-            'node': node_id,
-            'timestamp': ts
-        })
-        # simulate work
-        log.append({
-            'event': 'exit_cs',
-            'node': node_id,
-            'timestamp': ts
-        })
-    return {'order': [n for n, _ in ordered], 'log': log}
+    from ricart_agrawala import RicartAgrawalaSimulation
+    sim = RicartAgrawalaSimulation(initial_requests=requests, record_order=True, **options)
+    log = list(sim.run())
+    stats = dict(sim.summary)
+    order = stats.pop('order')
+    return {'order': order, 'log': log, 'stats': stats}
 
 # Load balancing / failover simulation
 _primary_fail_ratio = 0.5  # 50% failure chance
@@ -82,44 +144,124 @@ def primary_process(payload):
 def backup_process(payload):
     return {'processor': 'backup', 'received': payload}
 
-# Consistency simulation: leader/replica with lag
-_leader_store = {}
-_replica_store = {}
-_replica_lag_seconds = 2
-_replica_lock = threading.Lock()
+# Worker implementations the lb dispatcher can route to. Config.LB_POOL names
+# them as 'kind' or 'kind#n' (several instances of the same kind).
+_lb_workers = {'primary': primary_process, 'backup': backup_process}
+_lb_dispatcher = None
+_lb_lock = threading.Lock()
+
+def get_lb_dispatcher():
+    """Process-wide dispatcher built from Config.LB_* settings."""
+    global _lb_dispatcher
+    if _lb_dispatcher is None:
+        from config import Config
+        from dispatcher import Backend, CircuitBreaker, Dispatcher, parse_pool_spec
+        with _lb_lock:
+            if _lb_dispatcher is None:
+                backends = []
+                for name, priority, weight in parse_pool_spec(Config.LB_POOL):
+                    fn = _lb_workers.get(name.split('#')[0])
+                    if fn is None:
+                        continue
+                    breaker = CircuitBreaker(window=Config.LB_BREAKER_WINDOW,
+                                             min_calls=Config.LB_BREAKER_MIN_CALLS,
+                                             error_threshold=Config.LB_BREAKER_ERROR_RATE,
+                                             reset_timeout=Config.LB_BREAKER_RESET_SECONDS)
+                    backends.append(Backend(name, fn, priority=priority, weight=weight, breaker=breaker))
+                _lb_dispatcher = Dispatcher(backends, strategy=Config.LB_STRATEGY)
+    return _lb_dispatcher
+
+# Consistency simulation: leader + lagging replicas (engine in replication.py)
+_kv_store = None
+_kv_lock = threading.Lock()
+
+def get_replicated_store():
+    """Process-wide replicated store; applier threads start on first use."""
+    global _kv_store
+    if _kv_store is None:
+        from config import Config
+        from replication import ReplicatedStore
+        with _kv_lock:
+            if _kv_store is None:
+                _kv_store = ReplicatedStore(replicas=Config.REPLICA_COUNT,
+                                            lag_seconds=Config.REPLICA_LAG_SECONDS,
+                                            batch_size=Config.REPLICA_BATCH_SIZE).start()
+    return _kv_store
 
 def consistency_write(key, value):
-    _leader_store[key] = value
-    # schedule replication after lag
-    def do_replicate():
-        with _replica_lock:
-            _replica_store[key] = value
-    t = threading.Timer(_replica_lag_seconds, do_replicate)
-    t.daemon = True
-    t.start()
-    return True
-
-def consistency_read(mode, key):
-    if mode == 'strong':
-        return _leader_store.get(key)
-    else:  # eventual
-        with _replica_lock:
-            return _replica_store.get(key)
+    """Write through the leader; returns the version token for read-your-writes."""
+    return get_replicated_store().write(key, value)
+
+def consistency_read(mode, key, token=None, max_staleness=None):
+    value, _, _ = get_replicated_store().read(mode, key, token=token, max_staleness=max_staleness)
+    return value
+
+# Exam start admission control (engine in waiting_room.py)
+_waiting_room = None
+_waiting_room_lock = threading.Lock()
+
+def get_waiting_room():
+    """Process-wide waiting room; tickets are signed with the app's secret key."""
+    global _waiting_room
+    if _waiting_room is None:
+        from flask import current_app
+        from config import Config
+        from waiting_room import WaitingRoom
+        with _waiting_room_lock:
+            if _waiting_room is None:
+                _waiting_room = WaitingRoom(current_app.secret_key,
+                                            rate=Config.WAITING_ROOM_RATE,
+                                            jitter_seconds=Config.WAITING_ROOM_JITTER_SECONDS,
+                                            schedule_ttl=Config.WAITING_ROOM_SCHEDULE_TTL)
+    return _waiting_room
+
+def refresh_exam_schedule(exam_id):
+    """Tell the caches and scheduler that an exam's schedule or questions changed.
+
+    Bumps exams.updated_at, the version other processes compare their cached
+    answer key against (see exam_cache.get_bundle).
+    """
+    from datetime import datetime
+    from flask import current_app
+    from models import Exam
+    import exam_cache
+    db.session.execute(db.update(Exam).where(Exam.id == exam_id).values(updated_at=datetime.utcnow()))
+    db.session.commit()
+    exam_cache.invalidate(exam_id)
+    get_waiting_room().forget(exam_id)
+    sched = current_app.extensions.get('exam_scheduler')
+    if sched is not None:
+        sched.refresh(exam_id)
 
 def student_required(fn):
     """Decorator to protect student routes"""
     @wraps(fn)
     def wrapper(*args, **kwargs):
         if not session.get('student_logged_in'):
-            return redirect(url_for('student_login'))
+            return redirect(url_for('student.student_login'))
         return fn(*args, **kwargs)
     return wrapper
 
+def staff_required(fn):
+    """Decorator for routes shared by teachers and admins"""
+    @wraps(fn)
+    def wrapper(*a, **kw):
+        if not (session.get('admin_logged_in') or session.get('teacher_logged_in')):
+            return redirect(url_for('teacher.teacher_login'))
+        return fn(*a, **kw)
+    return wrapper
+
+def current_staff():
+    """(role, user id, username) of the logged-in admin or teacher; admin wins if both."""
+    if session.get('admin_logged_in'):
+        return 'admin', None, session.get('admin_username')
+    return 'teacher', session.get('teacher_id'), session.get('teacher_username')
+
 def teacher_required(fn):
     """Decorator to protect teacher routes"""
     @wraps(fn)
     def wrapper(*a, **kw):
         if not session.get('teacher_logged_in'):
-            return redirect(url_for('teacher_login'))
+            return redirect(url_for('teacher.teacher_login'))
         return fn(*a, **kw)
     return wrapper
@@ -0,0 +1,172 @@
+import math
+import random
+import threading
+import time
+from datetime import datetime
+
+from itsdangerous import BadSignature, URLSafeSerializer
+
+# ===== Waiting room for exam start =====
+# Students who open an exam before start_at (or while admission is backed up)
+# get a signed ticket holding their release time instead of a bare 403, plus
+# a Retry-After telling them when to come back. Release times come from a
+# per-exam meter that hands out slots at `rate` per second from start_at, so
+# the class arrives as a ramp instead of all in the same second. A request
+# carrying a ticket is checked against the signature and the clock only; the
+# database is not touched until the student is actually admitted.
+
+TICKET_HEADER = 'X-Admission-Ticket'
+
+class AdmissionMeter:
+    """Hands out admission slots for one exam at `rate` per second (GCRA-style).
+
+    Each student keeps the slot they were first given, so polling without the
+    ticket does not push the rest of the class back.
+    """
+
+    def __init__(self, start_ts, end_ts, rate):
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = start_ts
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, student_id, now):
+        with self._lock:
+            slot = self._slots.get(student_id)
+            if slot is None:
+                slot = max(self._next, self.start_ts, now)
+                self._next = slot + self.interval
+                self._slots[student_id] = slot
+            return slot
+
+    def stats(self, now):
+        with self._lock:
+            issued = len(self._slots)
+            admitted = sum(1 for s in self._slots.values() if s <= now)
+            backlog = max(0.0, self._next - max(now, self.start_ts))
+        return {'issued': issued, 'admitted': admitted, 'backlog_seconds': round(backlog, 3)}
+
+class WaitingRoom:
+    """Admission control in front of the exam details endpoint."""
+
+    def __init__(self, secret, rate=50.0, jitter_seconds=1.0, schedule_ttl=5.0, clock=time.time):
+        self.rate = float(rate)
+        self.jitter_seconds = max(0.0, float(jitter_seconds))
+        self.schedule_ttl = float(schedule_ttl)
+        self._clock = clock
+        self._signer = URLSafeSerializer(secret, salt='exam-admission')
+        self._meters = {}      # exam_id -> AdmissionMeter
+        self._schedules = {}   # exam_id -> (start_ts, end_ts, fetched_at)
+        self._lock = threading.Lock()
+
+    # --- tickets ---
+    def issue_ticket(self, exam_id, student_id, start_ts, release_ts, end_ts):
+        end_ts = None if end_ts == math.inf else round(end_ts, 3)
+        return self._signer.dumps([int(exam_id), student_id, round(start_ts, 3), round(release_ts, 3), end_ts])
+
+    def verify_ticket(self, ticket, exam_id, student_id):
+        """Return (start_ts, release_ts, end_ts) for a valid ticket issued to this student for this exam, else None."""
+        if not ticket:
+            return None
+        try:
+            t_exam, t_student, start_ts, release_ts, end_ts = self._signer.loads(ticket)
+        except (BadSignature, ValueError, TypeError):
+            return None
+        if t_exam != int(exam_id) or t_student != student_id:
+            return None
+        return float(start_ts), float(release_ts), math.inf if end_ts is None else float(end_ts)
+
+    # --- schedule cache ---
+    def _schedule(self, exam_id, load_schedule, now):
+        with self._lock:
+            cached = self._schedules.get(exam_id)
+        if cached is not None and now - cached[2] < self.schedule_ttl:
+            return cached
+        sched = load_schedule(exam_id)
+        if sched is None or sched[0] is None:
+            entry = (None, None, now)
+        else:
+            start_at, duration_minutes = sched
+            start_ts = start_at.timestamp()
+            end_ts = start_ts + (duration_minutes or 0) * 60 if duration_minutes else math.inf
+            entry = (start_ts, end_ts, now)
+        with self._lock:
+            self._schedules[exam_id] = entry
+            meter = self._meters.get(exam_id)
+            if meter is not None and entry[0] != meter.start_ts:
+                del self._meters[exam_id]  # start time moved; hand out fresh slots
+        return entry
+
+    def forget(self, exam_id):
+        """Drop the cached schedule and slots for an exam (after it was edited)."""
+        with self._lock:
+            self._schedules.pop(exam_id, None)
+            self._meters.pop(exam_id, None)
+
+    def _meter(self, exam_id, start_ts, end_ts, now):
+        with self._lock:
+            meter = self._meters.get(exam_id)
+            if meter is None:
+                meter = self._meters[exam_id] = AdmissionMeter(start_ts, end_ts, self.rate)
+                # exams that have ended no longer need their slot tables
+                for eid in [e for e, m in self._meters.items() if m.end_ts < now]:
+                    del self._meters[eid]
+            return meter
+
+    # --- admission ---
+    def check(self, exam_id, student_id, ticket, load_schedule):
+        """Decide whether this request may load the exam now.
+
+        Returns None to admit (the caller does its own lookups and start/end
+        checks), or a dict describing the wait: msg, start_ts, release_ts,
+        retry_after(_ms), ticket and whether the ticket was newly issued.
+        `load_schedule(exam_id)` returns (start_at, duration_minutes) or None
+        and is only called when the cached schedule is missing or stale.
+        """
+        now = self._clock()
+        held = self.verify_ticket(ticket, exam_id, student_id)
+        if held is not None:
+            start_ts, release_ts, end_ts = held
+            if now >= release_ts or now > end_ts:
+                return None
+            return self._wait(start_ts, release_ts, ticket, now, issued=False)
+
+        start_ts, end_ts, _ = self._schedule(exam_id, load_schedule, now)
+        if start_ts is None or now > end_ts:
+            return None
+        meter = self._meter(exam_id, start_ts, end_ts, now)
+        release_ts = meter.reserve(student_id, now)
+        if now < start_ts and self.jitter_seconds:
+            # stable per student, so re-issued tickets keep the same release time
+            release_ts += random.Random(f'{exam_id}:{student_id}').uniform(0, self.jitter_seconds)
+        if release_ts <= now:
+            return None
+        ticket = self.issue_ticket(exam_id, student_id, start_ts, release_ts, end_ts)
+        return self._wait(start_ts, release_ts, ticket, now, issued=True)
+
+    def _wait(self, start_ts, release_ts, ticket, now, issued):
+        return {
+            'msg': 'not_started' if now < start_ts else 'waiting_room',
+            'start_ts': start_ts,
+            'release_ts': release_ts,
+            'retry_after': max(1, math.ceil(release_ts - now)),  # whole seconds, for the header
+            'retry_after_ms': max(0, int((release_ts - now) * 1000)),
+            'ticket': ticket,
+            'issued': issued,
+        }
+
+    def stats(self):
+        now = self._clock()
+        with self._lock:
+            meters = dict(self._meters)
+        return {
+            'rate_per_second': self.rate,
+            'jitter_seconds': self.jitter_seconds,
+            'exams': {eid: m.stats(now) for eid, m in meters.items()},
+        }
+
+def to_local_iso(ts):
+    """Timestamps here are derived from naive local start_at values; render them the same way."""
+    return datetime.fromtimestamp(ts).isoformat()